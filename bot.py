@@ -103,4 +103,6 @@ async def reload(ctx: commands.Context, cog: str = None):
         else:
             await ctx.send(f"{cog} doesn't exist")
 
-bot.run(get_config()['Bot']['Token'])
\ No newline at end of file
+if __name__ == '__main__':
+    # Scoring processes import this module without running the bot
+    bot.run(get_config()['Bot']['Token'])
\ No newline at end of file
@@ -2,14 +2,19 @@ import discord
 from discord.ext import commands, tasks
 from discord import ButtonStyle, Interaction, app_commands
 import asyncio
+from datetime import datetime, timezone
 import aiohttp
 import ast
 import logging
 from typing import List
 
 from discord_utils import CallableButton, CustomException, View
+from lib import profiling
 from lib.credentials import Credentials
-from utils import get_config
+from lib.exportcache import EXPORT_CACHE
+from lib.scores import MatchGroup
+from lib.session import SESSIONS
+from utils import get_config, toTable, SCHEDULER, LOGS_FOLDER
 
 REPO_AUTHOR_NAME = "timraay/HLLLogUtilities"
 
@@ -130,6 +135,91 @@ class _util(commands.Cog):
         except discord.HTTPException:
             pass
 
+    @commands.command(name="scheduled", description="View the coroutines scheduled to run next", usage="r!scheduled [limit]", hidden=True)
+    @commands.is_owner()
+    async def scheduled(self, ctx, limit: int = 10):
+        jobs = SCHEDULER.upcoming(min(limit, 15))
+        if not jobs:
+            await ctx.send("Nothing is scheduled")
+            return
+
+        now = datetime.now(tz=timezone.utc)
+        rows = [("Due in", "Name")] + [(str(job.when - now).split('.')[0], job.name[:80]) for job in jobs]
+        await ctx.send(f"{len(SCHEDULER)} coroutines scheduled\n```\n{toTable(rows)}\n```")
+
+    @commands.command(name="profile", description="Enable, disable, reset, dump or view iteration profiles", usage="r!profile [on|off|reset|dump|name]", hidden=True)
+    @commands.is_owner()
+    async def profile(self, ctx, action: str = None):
+        if action in ("on", "off"):
+            profiling.set_enabled(action == "on")
+            await ctx.send(f"Profiling is now {'enabled' if profiling.is_enabled() else 'disabled'}")
+            return
+        elif action == "reset":
+            profiling.reset()
+            await ctx.send("Profiles have been reset")
+            return
+        elif action == "dump":
+            path = LOGS_FOLDER / f"profiles_{datetime.now(tz=timezone.utc):%Y%m%d_%H%M%S}.json"
+            profiling.dump(path)
+            await ctx.send(f"Profiles dumped to `{path}`", file=discord.File(path))
+            return
+
+        rows = [("Profile", "Phase", "Count", "p50 ms", "p90 ms", "p99 ms", "p50 blocks")]
+        for name, profile in profiling.PROFILES.items():
+            if action and action not in name:
+                continue
+            for phase, summary in profile.summary().items():
+                rows.append((name, phase, summary['count'], summary['p50_ms'], summary['p90_ms'], summary['p99_ms'],
+                    summary.get('p50_blocks', '')))
+
+        status = "enabled" if profiling.is_enabled() else "disabled"
+        if len(rows) == 1:
+            await ctx.send(f"Profiling is {status}, nothing has been recorded yet")
+            return
+
+        table = toTable(rows)
+        if len(table) > 1900:
+            table = table[:1900].rsplit('\n', 1)[0] + "\n..."
+        await ctx.send(f"Profiling is {status}\n```\n{table}\n```")
+
+    @commands.command(name="exportcache", description="View or clear the cache of rendered exports", usage="r!exportcache [clear]", hidden=True)
+    @commands.is_owner()
+    async def export_cache(self, ctx, action: str = None):
+        if action == "clear":
+            EXPORT_CACHE.clear()
+            await ctx.send("Export cache has been cleared")
+            return
+
+        stats = EXPORT_CACHE.stats()
+        await ctx.send("{entries} exports cached, taking up {size_mb:.1f} of {max_size_mb:.0f} MB\n"
+            "{hits} hits, {misses} misses ({hit_rate:.0%} hit rate)".format(
+            size_mb=stats['size'] / 1024 / 1024, max_size_mb=stats['max_size'] / 1024 / 1024, **stats))
+
+    @commands.command(name="verifyscores", description="Compare a session's live scoreboard with one rebuilt from its logs", usage="r!verifyscores <session_id>", hidden=True)
+    @commands.is_owner()
+    async def verify_scores(self, ctx, session_id: int):
+        session = SESSIONS.get(session_id)
+        if not session:
+            raise CustomException("Unknown session!", f"No session with ID {session_id} is loaded")
+
+        live = session.get_scores()
+        if live is None:
+            await ctx.send("This session has no live scoreboard, its scores are always rebuilt from its logs")
+            return
+
+        rebuilt = await session.loop.run_in_executor(None, MatchGroup.from_logs, session.iter_logs())
+        live_matches = [live.stats] + live.matches
+        rebuilt_matches = [rebuilt.stats] + rebuilt.matches
+        if len(live_matches) != len(rebuilt_matches):
+            await ctx.send(f"Live scoreboard has {len(live.matches)} matches, rebuilt scoreboard has {len(rebuilt.matches)}")
+            return
+
+        mismatches = [i for i, (a, b) in enumerate(zip(live_matches, rebuilt_matches)) if a.to_text() != b.to_text()]
+        if mismatches:
+            await ctx.send("Scores differ for: " + ", ".join("entire session" if i == 0 else f"match {i}" for i in mismatches))
+        else:
+            await ctx.send(f"Live scoreboard matches the logs ({len(live.matches)} matches)")
+
     @commands.command(name="force-disable-autosession", hidden=True)
     @commands.is_owner()
     async def disable_autosession(self, ctx, *credentials_ids: int):
@@ -1,108 +1,34 @@
 from datetime import datetime
-from io import StringIO
-from typing import Callable, List, Optional, Union
+from io import BytesIO, StringIO
+from typing import Callable, List, Union
 
 import discord
 from discord import app_commands, Interaction, ui, ButtonStyle, SelectOption
 from discord.ext import commands
 from discord.ui import Select
 from discord.utils import escape_markdown as esc_md, format_dt
-from pydantic import BaseModel
 
 from cogs.sessions import autocomplete_sessions
 from cogs.credentials import SECURITY_URL
 from cogs.apikeys import HSSApiKeysModal
 from discord_utils import CallableButton, CallableSelect, View, only_once, CustomException, get_error_embed, get_success_embed
 from lib.converters import ExportFormats, Converter
+from lib.exportcache import EXPORT_CACHE
+from lib.exportfiles import ExportCompression, RenderedExport, MAX_ATTACHMENTS, DEFAULT_MAX_FILE_SIZE, choose_compression, estimate_size, write_parts, write_scoreboard
 from lib.hss.api_key import api_keys_in_guild_ttl, HSSApiKey, HSSTeam
 from lib.info.models import EventFlags, EventTypes
-from lib.mappings import get_map_and_mode, parse_layer
-from lib.scores import create_scoreboard, MatchGroup
+from lib.mappings import get_map_and_mode
+from lib.scores import create_scoreboard
 from lib.session import HLLCaptureSession, SESSIONS
-from lib.storage import LogLine
-
-class ExportRange(BaseModel):
-    start_time: Optional[datetime]
-    end_time: Optional[datetime]
-    unload_time: Optional[datetime]
-    map_name: Optional[str]
-
-    @property
-    def has_end_time(self):
-        return self.end_time or self.unload_time
-
-    @property
-    def shortest_end_time(self):
-        if not self.has_end_time:
-            return None
-        elif not self.unload_time:
-            return self.end_time
-        elif not self.end_time:
-            return self.unload_time
-        else:
-            return min(self.end_time, self.unload_time)
-    
-    @property
-    def longest_end_time(self):
-        if not self.has_end_time:
-            return None
-        elif not self.unload_time:
-            return self.end_time
-        elif not self.end_time:
-            return self.unload_time
-        else:
-            return max(self.end_time, self.unload_time)
-
-    @property
-    def duration(self):
-        if self.start_time and self.has_end_time:
-            return self.shortest_end_time - self.start_time
-        else:
-            return None
-    
-    def is_eligible_for_helo(self):
-        return self.start_time and self.has_end_time
-
-def get_ranges(logs):
-    flags = EventFlags(server_match_started=True, server_match_ended=True, server_map_changed=True)
-    ranges = [ExportRange()]
-    for log in flags.filter_logs(logs):
-        try:
-            log_type = EventTypes(log.type)
-        except ValueError:
-            continue
-
-        if log_type == EventTypes.server_match_ended:
-            ranges[-1].end_time = log.event_time
-            if not ranges[-1].map_name:
-                ranges[-1].map_name = " ".join(get_map_and_mode(log.new))
-
-        elif log_type == EventTypes.server_match_started:
-            ranges[-1].unload_time = log.event_time
-            ranges.append(ExportRange(
-                start_time=log.event_time,
-                map_name=" ".join(get_map_and_mode(log.new))
-            ))
-
-        elif log_type == EventTypes.server_map_changed:
-            if not ranges[-1].start_time:
-                last_start = None
-            else:
-                last_start = (log.event_time - ranges[-1].start_time).total_seconds()
-
-            if len(ranges) >= 2 and last_start and last_start < 30:
-                # The line appeared after the server_match_started event
-                ranges[-2].map_name = parse_layer(log.old).pretty()
-                ranges[-1].map_name = parse_layer(log.new).pretty()
-            
-            elif not last_start or last_start > 60:
-                # The line appeared before the server_match_started event
-                ranges[-1].map_name = parse_layer(log.old).pretty()
-
-    if len(ranges) == 1:
-        ranges.clear()
-
-    return ranges
+from lib.summaries import ExportRange, SessionSummary
+from lib.storage import LogRecord
+
+def ensure_session_has_logs(session: HLLCaptureSession):
+    if not session.has_logs():
+        raise CustomException(
+            "Invalid session!",
+            "This session doesn't hold any logs yet"
+        )
 
 
 class ExportView(View):
@@ -119,30 +45,25 @@ class ExportView(View):
         ("Modifiers", "🧮", EventFlags.modifiers()),
     )
 
-    def __init__(self, interaction: Interaction, session: HLLCaptureSession, as_scoreboard: bool = False):
+    def __init__(self, interaction: Interaction, session: HLLCaptureSession, summary: SessionSummary, as_scoreboard: bool = False,
+            logs_version: int = None):
         super().__init__(timeout=300)
         self.interaction = interaction
         self.session = session
-        self.as_scoreboard = bool(as_scoreboard)
-        
-        self.logs = session.get_logs()
-        if not self.logs:
-            raise CustomException(
-                "Invalid session!",
-                "This session doesn't hold any logs yet"
-            )
+        self.as_scoreboard = as_scoreboard
+        self.summary = summary
+        # The logs version the summary was fetched at, which is what the
+        # scoreboards of this view are cached under
+        self.logs_version = session.get_logs_version() if logs_version is None else logs_version
 
-        self._ranges = get_ranges(self.logs)
+        self._ranges = summary.ranges
         self._range_index = None
 
-        if self.as_scoreboard:
-            self.scores = MatchGroup.from_logs(self.logs) 
-        else:
-            self.scores = None
-
         self.range = ExportRange()
         self.flags = EventFlags.all()
         self.format = ExportFormats.text
+        # Compress only when needed by default
+        self.compression: Union[ExportCompression, None] = None
 
         # Add flags select
 
@@ -195,11 +116,33 @@ class ExportView(View):
                 for format in ExportFormats.__members__.values()
             ]
         ))
+
+        # Add compression select
+
+        if not self.as_scoreboard:
+            self.add_item(CallableSelect(self.select_compression,
+                placeholder="Select a compression...",
+                options=[
+                    SelectOption(label="Compress when too large", description="Compress files too large to upload otherwise",
+                        emoji="📦", value="auto", default=True),
+                    SelectOption(label="Compress as .zip", description="A zip archive", emoji="🗜️", value=ExportCompression.zip.name),
+                    SelectOption(label="Compress as .gz", description="A gzip file", emoji="🗜️", value=ExportCompression.gzip.name),
+                ]
+            ))
+
+    @classmethod
+    async def create(cls, interaction: Interaction, session: HLLCaptureSession, as_scoreboard: bool = False):
+        ensure_session_has_logs(session)
+        # Logs may only be added while the summary is fetched, so it is at
+        # least as recent as this version
+        logs_version = session.get_logs_version()
+        summary = await session.fetch_summary(with_scores=as_scoreboard)
+        return cls(interaction, session, summary, as_scoreboard, logs_version=logs_version)
         
     async def send(self):
-        content, file = self.get_message_payload()
-        if file:
-            await self.interaction.response.send_message(content, file=file)
+        content, files = await self.get_message_payload()
+        if files:
+            await self.interaction.response.send_message(content, files=files)
         else:
             await self.interaction.response.send_message(content)
 
@@ -210,45 +153,95 @@ class ExportView(View):
         )
 
     async def edit(self):
-        content, file = self.get_message_payload()
-        attachments = [file] if file else []
-        await self.interaction.edit_original_response(content=content, attachments=attachments)
+        content, files = await self.get_message_payload()
+        await self.interaction.edit_original_response(content=content, attachments=files)
 
-    def get_message_payload(self):
-        self.logs = self.session.get_logs(
-            from_=self.range.start_time,
-            to=self.range.unload_time,
-            filter=self.flags
-        )
+    @property
+    def max_file_size(self):
+        """The maximum number of bytes a file can have to be uploaded"""
+        guild = self.interaction.guild
+        return guild.filesize_limit if guild else DEFAULT_MAX_FILE_SIZE
 
+    async def get_message_payload(self):
         content = f"{'Scoreboard' if self.as_scoreboard else 'Logs'} for **{esc_md(self.session.name)}**"
         if self.range.map_name:
             content += f" ({self.range.map_name})"
         if self.flags != self.flags.all():
             content += f"\n> Includes: **{'**, **'.join([option[0] for option in self.flags_options if option[2] <= self.flags])}**"
 
-        file = None
+        if self.as_scoreboard:
+            version = self.logs_version
+            options = ('scoreboard', self._range_index, self.format.name)
+        else:
+            version = self.session.get_logs_version()
+            options = ('logs', self.range.start_time, self.range.unload_time, self.flags.value, self.format.name,
+                self.compression and self.compression.name, self.max_file_size)
+
+        cached, output = EXPORT_CACHE.get(self.session.id, version, *options)
+        if not cached:
+            output = await self.render()
+            EXPORT_CACHE.put(self.session.id, version, *options, output=output)
+
+        files = list()
+
+        if output is not None:
+            if output.compression != ExportCompression.none:
+                content += f"\n> Compressed from {output.raw_size / 1000000:.1f} MB to {output.size / 1000000:.1f} MB"
+            if len(output.parts) > MAX_ATTACHMENTS:
+                content += (f"\n> Only the first {MAX_ATTACHMENTS} of {len(output.parts)} parts could be attached,"
+                    " select a shorter time range or fewer log types to export the rest")
+            elif len(output.parts) > 1:
+                content += f"\n> Split into {len(output.parts)} parts, since it is too large to upload as one file"
+            files = [discord.File(BytesIO(part.data), filename=part.filename) for part in output.parts[:MAX_ATTACHMENTS]]
 
-        if self.logs:
-            converter: Converter = self.format.value
+        else:
+            content += '\n```\nNo logs match the given criteria!\n```'
+        
+        return content, files
 
-            if self.as_scoreboard:
-                if self._range_index is None:
-                    match_data = self.scores
-                else:
-                    match_data = self.scores.matches[self._range_index]
+    async def render(self) -> Union[RenderedExport, None]:
+        """Render the files to export, or return `None` if no logs match
+        the selected options"""
+        has_logs = self.session.has_logs(
+            from_=self.range.start_time,
+            to=self.range.unload_time,
+            filter=self.flags
+        )
+        if not has_logs:
+            return None
 
-                fp = StringIO(converter.create_scoreboard(match_data))
-                file = discord.File(fp, filename=self.session.name + '.' + converter.ext())
+        converter: Converter = self.format.value
+        filename = self.session.name + '.' + converter.ext()
 
+        if self.as_scoreboard:
+            if self._range_index is None:
+                match_data = self.summary.scores
             else:
-                fp = StringIO(converter.convert_many(self.logs))
-                file = discord.File(fp, filename=self.session.name + '.' + converter.ext())
+                match_data = self.summary.get_match(self._range_index)
+
+            return write_scoreboard(converter, match_data, filename)
+
+        max_size = self.max_file_size
+        compression = self.compression
+        if compression is None:
+            # Compress large exports right away instead of finding out they
+            # are too large after converting them
+            num_logs = self.session.count_logs(
+                from_=self.range.start_time,
+                to=self.range.unload_time,
+                filter=self.flags
+            )
+            compression = choose_compression(converter, num_logs, max_size)
+            if compression != ExportCompression.none:
+                self.session.logger.info('Compressing export of %s logs estimated at %.1f MB',
+                    num_logs, estimate_size(converter, num_logs) / 1000000)
 
-        else:
-            content += '\n```\nNo logs match the given criteria!\n```'
-        
-        return content, file
+        logs = self.session.iter_logs(
+            from_=self.range.start_time,
+            to=self.range.unload_time,
+            filter=self.flags
+        )
+        return await self.session.loop.run_in_executor(None, write_parts, converter, logs, filename, compression, max_size)
 
     async def select_range(self, interaction: Interaction, values: List[str]):
         range_i = int(values[0])
@@ -263,7 +256,8 @@ class ExportView(View):
         await self.edit()
 
         if self.range.is_eligible_for_helo() and range_i not in self.session.sent_helo_prompt_indices:
-            view = HeLOSubmitPromptView(self.session.get_logs(from_=self.range.start_time, to=self.range.unload_time), self.interaction.user)
+            logs = await self.session.fetch_logs(from_=self.range.start_time, to=self.range.unload_time)
+            view = HeLOSubmitPromptView(logs, self.interaction.user)
             view.message = await interaction.followup.send(content=f"The above match (**{esc_md(self.session.name)}**) may be submitted to HeLO!", view=view, ephemeral=True, wait=True)
             self.session.sent_helo_prompt_indices.append(range_i)
     
@@ -282,20 +276,19 @@ class ExportView(View):
         await interaction.response.defer()
         await self.edit()
 
+    async def select_compression(self, interaction: Interaction, values: List[str]):
+        self.compression = None if values[0] == "auto" else ExportCompression[values[0]]
+        await interaction.response.defer()
+        await self.edit()
+
 class ToHeLOExportView(View):
-    def __init__(self, interaction: Interaction, session: HLLCaptureSession):
+    def __init__(self, interaction: Interaction, session: HLLCaptureSession, ranges: List[ExportRange]):
         super().__init__(timeout=300)
         self.interaction = interaction
         self.session = session
         
-        self.logs = session.get_logs()
-        if not self.logs:
-            raise CustomException(
-                "Invalid session!",
-                "This session doesn't hold any logs yet"
-            )
-
-        self._ranges = get_ranges(self.logs)
+        self.logs = list()
+        self._ranges = ranges
         self._range_index = None
 
         self.range = ExportRange()
@@ -331,9 +324,15 @@ class ToHeLOExportView(View):
             disabled=True,
         )
         self.add_item(self.submit_button)
+
+    @classmethod
+    async def create(cls, interaction: Interaction, session: HLLCaptureSession):
+        ensure_session_has_logs(session)
+        summary = await session.fetch_summary(with_scores=False)
+        return cls(interaction, session, summary.ranges)
         
     async def send(self):
-        content, embed = self.get_message_payload()
+        content, embed = await self.get_message_payload()
         await self.interaction.response.send_message(
             content=content,
             embed=embed,
@@ -342,16 +341,11 @@ class ToHeLOExportView(View):
         )
 
     async def edit(self, interaction: Interaction):
-        content, embed = self.get_message_payload()
+        content, embed = await self.get_message_payload()
         self.submit_button.disabled = not self.range.is_eligible_for_helo()
         await interaction.response.edit_message(content=content, embed=embed, view=self)
 
-    def get_message_payload(self):
-        self.logs = self.session.get_logs(
-            from_=self.range.start_time,
-            to=self.range.unload_time
-        )
-
+    async def get_message_payload(self):
         content = f"Logs for **{esc_md(self.session.name)}**"
         if self.range.map_name:
             content += f" ({self.range.map_name})"
@@ -359,6 +353,10 @@ class ToHeLOExportView(View):
         embed = None
 
         if self.range.is_eligible_for_helo():
+            self.logs = await self.session.fetch_logs(
+                from_=self.range.start_time,
+                to=self.range.unload_time
+            )
             end_log = next(log for log in self.logs if log.type == str(EventTypes.server_match_ended))
             map_name = get_map_and_mode(end_log.new)[0]
             allies_score = int(end_log.message.split(' - ')[0])
@@ -375,7 +373,7 @@ class ToHeLOExportView(View):
                 color=discord.Color(7844437),
             )
 
-        elif self.logs:
+        elif self.session.has_logs(from_=self.range.start_time, to=self.range.unload_time):
             embed = get_error_embed("Select a match that has been captured from start to finish!")
 
         else:
@@ -398,7 +396,7 @@ class ToHeLOExportView(View):
         await send_hss_submit_prompt(interaction, self.logs)
 
 
-async def send_hss_submit_prompt(interaction: Interaction, logs: List[LogLine]):
+async def send_hss_submit_prompt(interaction: Interaction, logs: List[LogRecord]):
     api_keys = await api_keys_in_guild_ttl(interaction.guild.id)
     if not api_keys:
         view = HeLOSubmitPromptApiKeyView(logs)
@@ -411,7 +409,7 @@ async def send_hss_submit_prompt(interaction: Interaction, logs: List[LogLine]):
     await interaction.response.edit_message(content=None, embed=embed, view=view)
 
 class HeLOSubmitPromptView(View):
-    def __init__(self, logs: List[LogLine], user: discord.Member):
+    def __init__(self, logs: List[LogRecord], user: discord.Member):
         super().__init__(timeout=60 * 10)
         self.logs = logs
         self.user = user
@@ -436,7 +434,7 @@ class HeLOSubmitPromptView(View):
             await self.message.edit(view=self)
 
 class HeLOSubmitPromptApiKeyView(View):
-    def __init__(self, logs: List[LogLine]):
+    def __init__(self, logs: List[LogRecord]):
         super().__init__()
         self.logs = logs
     
@@ -466,7 +464,7 @@ class HeLOSubmitPromptApiKeyView(View):
         await interaction.response.edit_message(embed=embed, view=view)
     
 class HeLOSubmitSelectOpponentView(View):
-    def __init__(self, api_key: HSSApiKey, logs: List[LogLine], teams: List[HSSTeam]):
+    def __init__(self, api_key: HSSApiKey, logs: List[LogRecord], teams: List[HSSTeam]):
         super().__init__()
         self.api_key = api_key
         self.logs = logs
@@ -607,7 +605,7 @@ class HeLOSubmitSelectOpponentView(View):
         return embed
     
 class HeLOSubmitSelectApiKeyView(View):
-    def __init__(self, api_keys: List[HSSApiKey], logs: List[LogLine]):
+    def __init__(self, api_keys: List[HSSApiKey], logs: List[LogRecord]):
         super().__init__()
         self.api_keys = api_keys
         self.logs = logs
@@ -635,7 +633,7 @@ class HeLOSubmitSelectApiKeyView(View):
         await interaction.edit_original_response(embed=embed, view=view)
 
 class HeLOSubmitSelectWinnerView(View):
-    def __init__(self, api_key: HSSApiKey, logs: List[LogLine], opponent: HSSTeam, map_name: str, allies_score: int, axis_score: int):
+    def __init__(self, api_key: HSSApiKey, logs: List[LogRecord], opponent: HSSTeam, map_name: str, allies_score: int, axis_score: int):
         super().__init__()
         self.api_key = api_key
         self.logs = logs
@@ -690,7 +688,7 @@ class HeLOSubmitSelectWinnerView(View):
         await interaction.response.edit_message(embed=embed, view=view)
 
 class HeLOSubmitSelectGameTypeView(View):
-    def __init__(self, api_key: HSSApiKey, logs: List[LogLine], opponent: HSSTeam, won: bool, map_name: str, allies_score: int, axis_score: int):
+    def __init__(self, api_key: HSSApiKey, logs: List[LogRecord], opponent: HSSTeam, won: bool, map_name: str, allies_score: int, axis_score: int):
         super().__init__()
         self.api_key = api_key
         self.logs = logs
@@ -753,7 +751,7 @@ class HeLOSubmitSelectGameTypeView(View):
         await interaction.response.edit_message(embed=embed, view=view)
 
 class HeLOSubmitConfirmationView(View):
-    def __init__(self, api_key: HSSApiKey, logs: List[LogLine], opponent: HSSTeam, won: bool, game_type: str, map_name: str, allies_score: int, axis_score: int):
+    def __init__(self, api_key: HSSApiKey, logs: List[LogRecord], opponent: HSSTeam, won: bool, game_type: str, map_name: str, allies_score: int, axis_score: int):
         super().__init__()
         self.api_key = api_key
         self.logs = logs
@@ -856,7 +854,7 @@ class exports(commands.Cog):
     )
     async def export_logs(self, interaction: Interaction, session: int):
         session: HLLCaptureSession = SESSIONS[session]
-        view = ExportView(interaction, session)
+        view = await ExportView.create(interaction, session)
         await view.send()
         
     @ExportGroup.command(name="scoreboard", description="Export a scoreboard from a session")
@@ -868,7 +866,7 @@ class exports(commands.Cog):
     )
     async def export_scoreboard(self, interaction: Interaction, session: int):
         session: HLLCaptureSession = SESSIONS[session]
-        view = ExportView(interaction, session, as_scoreboard=True)
+        view = await ExportView.create(interaction, session, as_scoreboard=True)
         await view.send()
         
     @ExportGroup.command(name="to_helo", description="Export a session to HeLO")
@@ -880,7 +878,7 @@ class exports(commands.Cog):
     )
     async def export_scoreboard(self, interaction: Interaction, session: int):
         session: HLLCaptureSession = SESSIONS[session]
-        view = ToHeLOExportView(interaction, session)
+        view = await ToHeLOExportView.create(interaction, session)
         await view.send()
         
 async def setup(bot: commands.Bot):
@@ -1,3 +1,4 @@
+import asyncio
 import discord
 from discord import app_commands, Interaction, ButtonStyle
 from discord.ext import commands, tasks
@@ -5,12 +6,15 @@ from discord.utils import escape_markdown as esc_md
 from datetime import datetime, timedelta, timezone
 from dateutil.parser import parse as dt_parse
 from enum import Enum
+from time import perf_counter
 from traceback import print_exc
 from typing import Union, Optional, Literal
 
 from lib.session import DELETE_SESSION_AFTER, SESSIONS, HLLCaptureSession, get_sessions
-from lib.credentials import Credentials, CREDENTIALS
-from lib.storage import cursor
+from lib.credentials import Credentials
+from lib.journal import LogJournal
+from lib.expiry import expiry_worker
+from lib.storage import LogStorageFormat, cursor, checkpoint_database, is_incremental_vacuum_enabled, enable_incremental_vacuum
 from lib.modifiers import ModifierFlags
 from cogs.credentials import RCONCredentialsModal, SessionModifierView, SECURITY_URL, MODIFIERS_URL, autocomplete_credentials
 from discord_utils import CallableButton, CustomException, get_success_embed, get_question_embed, only_once, View, ExpiredButtonError, get_command_mention
@@ -357,26 +361,30 @@ class sessions(commands.Cog):
     async def on_ready(self):
         """Initialize all sessions and autosessions"""
 
-        cursor.execute("SELECT ROWID FROM sessions WHERE deleted = 0")
-        for (id_,) in cursor.fetchall():
-            if id_ not in SESSIONS:
-                try:
-                    HLLCaptureSession.load_from_db(id_)
-                except:
-                    print('Failed to load session', id_)
-                    print_exc()
-        
-        cursor.execute("SELECT ROWID FROM credentials WHERE autosession_enabled = 1")
-        for (id_,) in cursor.fetchall():
-            if id_ not in CREDENTIALS:
-                try:
-                    Credentials.load_from_db(id_)
-                except:
-                    print('Failed to load credentials and initialize autosession', id_)
-                    print_exc()
+        # Also loads all credentials in use or with auto-session enabled
+        HLLCaptureSession.load_all_from_db()
+
+        # Recover logs that had not been pushed to the database yet when
+        # the bot last shut down
+        for id_, path in LogJournal.find_all().items():
+            session = SESSIONS.get(id_)
+            try:
+                if session:
+                    if not session.gatherer.is_running():
+                        session.recover_from_journal()
+                else:
+                    cursor.execute("SELECT deleted FROM sessions WHERE ROWID = ?", (id_,))
+                    res = cursor.fetchone()
+                    if not res or res[0]:
+                        path.unlink()
+            except:
+                print('Failed to recover logs of session', id_)
+                print_exc()
 
         if not self.session_manager.is_running():
             self.session_manager.start()
+        if not expiry_worker.is_alive():
+            expiry_worker.start()
 
     @tasks.loop(minutes=5)
     async def session_manager(self):
@@ -385,6 +393,64 @@ class sessions(commands.Cog):
             if sess.should_delete():
                 sess.delete()
 
+        # Move the logs of sessions that ended a while ago to cold storage
+        for sess in tuple(SESSIONS.values()):
+            if sess.should_archive():
+                try:
+                    await sess.migrate_logs_async(LogStorageFormat.archived)
+                except:
+                    print('Failed to archive logs of session', sess.id)
+                    print_exc()
+
+        # Readers hold on to old snapshots, which can stop automatic
+        # checkpoints from catching up. A passive checkpoint never waits
+        # on them.
+        busy, log_pages, checkpointed_pages = checkpoint_database('PASSIVE')
+        if busy or checkpointed_pages < log_pages:
+            print(f'WAL checkpoint incomplete, {checkpointed_pages}/{log_pages} pages checkpointed')
+
+    @commands.command(name="migratelogs")
+    @commands.is_owner()
+    async def migrate_session_logs(self, ctx: commands.Context):
+        """Move the logs of all sessions to the partitioned storage format,
+        except those that are already archived"""
+        log_format = LogStorageFormat.partitioned
+        sessions = [sess for sess in SESSIONS.values() if sess.log_format not in (log_format, LogStorageFormat.archived)]
+        await ctx.send(f"Migrating the logs of {len(sessions)} sessions to the {log_format} format...")
+
+        start = perf_counter()
+        num_logs = 0
+        failed = 0
+        for sess in sessions:
+            try:
+                num_logs += sess.migrate_logs(log_format)
+            except:
+                print('Failed to migrate logs of session', sess.id)
+                print_exc()
+                failed += 1
+            # Give other tasks a chance to run in between sessions
+            await asyncio.sleep(0)
+        
+        await ctx.send(f"Migrated {num_logs} logs of {len(sessions) - failed} sessions in {round(perf_counter() - start, 1)}s ({failed} failed)")
+
+    @commands.command(name="enablevacuum")
+    @commands.is_owner()
+    async def enable_vacuum(self, ctx: commands.Context):
+        """Rebuild the database so that space freed by deleted sessions can
+        be reclaimed. The bot does not respond until this is done."""
+        if is_incremental_vacuum_enabled():
+            await ctx.send("Incremental vacuuming is already enabled")
+            return
+
+        await ctx.send("Rebuilding the database, the bot will not respond until this is done...")
+        # Everything else writes through the same connection, so waiting for
+        # the rebuild on the event loop is what keeps them from failing
+        for sess in tuple(SESSIONS.values()):
+            sess.push_to_db()
+        start = perf_counter()
+        enable_incremental_vacuum()
+        await ctx.send(f"Enabled incremental vacuuming in {round(perf_counter() - start, 1)}s")
+
     def _parse_start_and_end_time(self, start_time: Union[str, datetime], end_time: Union[str, datetime]):
         if not isinstance(start_time, datetime):
             try:
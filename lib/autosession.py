@@ -208,8 +208,5 @@ class AutoSessionManager:
         )
 
     def get_active_session(self):
-        from lib.session import get_sessions
-        return next((
-            session for session in get_sessions(self.credentials.guild_id)
-            if session.credentials == self.credentials and session.active_in() is True
-        ), None)
+        from lib.session import get_active_session
+        return get_active_session(self.id)
@@ -0,0 +1,527 @@
+from array import array
+from datetime import datetime, timedelta
+import logging
+from typing import Dict, Iterable, List, Union, TYPE_CHECKING
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from lib import mappings
+from lib.info.models import EventTypes
+from lib.scores import Faction, MatchData, MatchGroup, MatchGroupBuilder, PlayerData, ScoreVector
+from utils import get_config
+
+if TYPE_CHECKING:
+    from lib.storage import LogRecord
+
+SCORING_ENGINES = ('objects', 'columnar')
+SCORING_ENGINE = get_config().get('Session', 'ScoringEngine', fallback='objects').lower()
+if SCORING_ENGINE not in SCORING_ENGINES:
+    logging.warning('Unknown scoring engine "%s", using objects instead', SCORING_ENGINE)
+    SCORING_ENGINE = 'objects'
+elif SCORING_ENGINE == 'columnar' and np is None:
+    logging.warning('The columnar scoring engine requires numpy, which is not installed. Using objects instead.')
+    SCORING_ENGINE = 'objects'
+
+def create_group_builder() -> Union['ColumnarGroupBuilder', MatchGroupBuilder]:
+    """Returns a builder for the scores of a stream of logs, using the
+    configured scoring engine. Both have the same `feed` and `build`
+    methods, but only the object engine can take snapshots."""
+    if SCORING_ENGINE == 'columnar':
+        return ColumnarGroupBuilder()
+    return MatchGroupBuilder()
+
+def build_group(logs: Iterable['LogRecord']) -> MatchGroup:
+    """Same as `MatchGroup.from_logs`, but using the configured scoring
+    engine"""
+    builder = create_group_builder()
+    for log in logs:
+        builder.feed(log)
+    return builder.build()
+
+
+# Log types, by name
+_OTHER = 0
+_KILL = 1
+_TEAMKILL = 2
+_SUICIDE = 3
+_JOIN = 4
+_LEAVE = 5
+_SWITCH_TEAM = 6
+_MAP_CHANGED = 7
+_MATCH_STARTED = 8
+_MATCH_ENDED = 9
+_TYPE_CODES = {log_type.name: _OTHER for log_type in EventTypes}
+_TYPE_CODES.update({
+    EventTypes.player_kill.name: _KILL,
+    EventTypes.player_teamkill.name: _TEAMKILL,
+    EventTypes.player_suicide.name: _SUICIDE,
+    EventTypes.player_join_server.name: _JOIN,
+    EventTypes.player_leave_server.name: _LEAVE,
+    EventTypes.player_switch_team.name: _SWITCH_TEAM,
+    EventTypes.server_map_changed.name: _MAP_CHANGED,
+    EventTypes.server_match_started.name: _MATCH_STARTED,
+    EventTypes.server_match_ended.name: _MATCH_ENDED,
+})
+
+# Factions, with -1 meaning that no faction is given at all
+_FACTIONS = (Faction.Any, Faction.Allies, Faction.Axis)
+_ANY = 0
+_ALLIES = 1
+_AXIS = 2
+_TEAM_CODES = {faction.value: code for code, faction in enumerate(_FACTIONS)}
+
+# The kinds of events in the stream of each player, and their position
+# among the events caused by the same log. These follow the order in
+# which `MatchDataBuilder` updates players.
+_SCORE = 0
+_FACTION = 1
+_SESSION = 2
+_STEP = 8
+_SCORE_STEP = 0
+_KILLER_STEP = 1
+_VICTIM_STEP = 2
+_KILL_STEP = 3
+_DEATH_STEP = 4
+_SESSION_STEP = 5
+
+_ONE_MICROSECOND = timedelta(microseconds=1)
+
+class MatchColumns:
+    """The logs of a single match, reduced to typed arrays holding only
+    what is needed for the scores of its players.
+
+    Players, weapons and factions are stored as codes. Players are
+    numbered in the order `MatchDataBuilder` would have created them.
+    """
+    def __init__(self):
+        self.player_codes: Dict[str, int] = dict()
+        self.names: List[str] = list()
+        self.weapon_codes: Dict[str, int] = dict()
+        self.map_name: str = None
+        self.match_ended: 'LogRecord' = None
+        self.start: datetime = None
+        self.end: datetime = None
+        self.num_logs = 0
+
+        self.types = array('b')
+        self.players = array('q')
+        self.players2 = array('q')
+        # For team switches, the faction the player is put on instead
+        self.teams = array('b')
+        self.teams2 = array('b')
+        self.weapons = array('q')
+
+        # The index of each log with scores, and its scores
+        self.score_logs = array('q')
+        self.scores = array('q')
+        # The index of each log of a player joining or leaving, and its time
+        self.session_logs = array('q')
+        self.session_times: List[datetime] = list()
+
+    def _get_player(self, steam_id: str, name: str):
+        code = self.player_codes.get(steam_id)
+        if code is None:
+            code = self.player_codes[steam_id] = len(self.names)
+            self.names.append(name)
+        return code
+
+    def feed(self, log: 'LogRecord', type_code: int):
+        if self.start is None:
+            self.start = log.event_time
+        self.end = log.event_time
+        self.num_logs += 1
+
+        if type_code == _MAP_CHANGED:
+            self.map_name = mappings.parse_layer(log.new).pretty()
+            return
+        elif type_code == _MATCH_STARTED:
+            if not self.map_name:
+                self.map_name = " ".join(mappings.get_map_and_mode(log.new))
+            return
+        elif type_code == _MATCH_ENDED:
+            if not self.map_name:
+                self.map_name = " ".join(mappings.get_map_and_mode(log.new))
+            self.match_ended = log
+            return
+
+        index = len(self.types)
+        player = self._get_player(log.player_steamid, log.player_name)
+        if log.player2_steamid in self.player_codes:
+            player2 = self.player_codes[log.player2_steamid]
+        elif log.player2_steamid:
+            player2 = self._get_player(log.player2_steamid, log.player2_name)
+        else:
+            player2 = -1
+
+        weapon = log.weapon
+        if weapon:
+            if weapon not in mappings.WEAPONS:
+                logging.warning('Weapon "%s" is not mapped', weapon)
+            else:
+                weapon = mappings.WEAPONS[weapon]
+        weapon_code = self.weapon_codes.get(weapon)
+        if weapon_code is None:
+            weapon_code = self.weapon_codes[weapon] = len(self.weapon_codes)
+
+        if type_code == _SWITCH_TEAM:
+            if log.old and log.new:
+                team = _ANY
+            elif log.new:
+                team = _TEAM_CODES[log.new]
+            else:
+                team = -1
+        else:
+            team = _TEAM_CODES[log.player_team] if log.player_team else _ANY
+
+        self.types.append(type_code)
+        self.players.append(player)
+        self.players2.append(player2)
+        self.teams.append(team)
+        self.teams2.append(_TEAM_CODES[log.player2_team] if log.player2_team else _ANY)
+        self.weapons.append(weapon_code)
+
+        if log.player_combat_score is not None:
+            self.score_logs.append(index)
+            self.scores.extend((log.player_combat_score, log.player_offense_score,
+                log.player_defense_score, log.player_support_score))
+
+        if type_code == _JOIN or type_code == _LEAVE:
+            self.session_logs.append(index)
+            self.session_times.append(log.event_time)
+
+    def build(self) -> MatchData:
+        if not self.num_logs:
+            return MatchData(players=[], duration=timedelta())
+
+        players = self._build_players()
+        duration = self.end - self.start
+        if self.match_ended:
+            return MatchData(
+                players=players,
+                duration=duration,
+                map=self.map_name,
+                team1_score=self.match_ended.message.split(' - ')[0],
+                team2_score=self.match_ended.message.split(' - ')[1],
+            )
+        else:
+            return MatchData(
+                players=players,
+                duration=duration,
+                map=self.map_name,
+            )
+
+    def _build_players(self) -> List[PlayerData]:
+        num_players = len(self.names)
+        types = np.frombuffer(self.types, dtype=np.int8)
+        players = np.frombuffer(self.players, dtype=np.int64)
+        players2 = np.frombuffer(self.players2, dtype=np.int64)
+        teams = np.frombuffer(self.teams, dtype=np.int8).astype(np.int64)
+        teams2 = np.frombuffer(self.teams2, dtype=np.int8).astype(np.int64)
+        weapons = np.frombuffer(self.weapons, dtype=np.int64)
+        indices = np.arange(len(types), dtype=np.int64)
+
+        kills = types == _KILL
+        teamkills = types == _TEAMKILL
+        suicides = types == _SUICIDE
+        deaths = kills | teamkills
+
+        def count(values: 'np.ndarray'):
+            return np.bincount(values, minlength=num_players)
+
+        stats = dict(
+            kills=count(players[kills]),
+            allied_kills=count(players[kills & (teams == _ALLIES)]),
+            axis_kills=count(players[kills & (teams == _AXIS)]),
+            teamkills=count(players[teamkills]),
+            suicides=count(players[suicides]),
+            deaths=count(players2[deaths]) + count(players[suicides]),
+            allied_deaths=count(players2[deaths & (teams2 == _ALLIES)]) + count(players[suicides & (teams == _ALLIES)]),
+            axis_deaths=count(players2[deaths & (teams2 == _AXIS)]) + count(players[suicides & (teams == _AXIS)]),
+        )
+        stats.update(self._get_streaks(num_players, indices, players, players2, kills, deaths, suicides))
+        stats = {attr: values.tolist() for attr, values in stats.items()}
+
+        states = self._get_player_states(num_players, indices, types, players, players2, teams, teams2,
+            kills | teamkills | suicides)
+
+        weapon_names = list(self.weapon_codes)
+        res = list()
+        for code, (steam_id, name) in enumerate(zip(self.player_codes, self.names)):
+            player = PlayerData(steam_id, name, self.start, self.end)
+            for attr, values in stats.items():
+                setattr(player, attr, values[code])
+            for attr, values in states.items():
+                setattr(player, attr, values[code])
+            res.append(player)
+
+        for player, other, num in _count_pairs(players[kills], weapons[kills], len(weapon_names)):
+            res[player].weapons[weapon_names[other]] = res[player].weapons.get(weapon_names[other], 0) + num
+        for player, other, num in _count_pairs(players2[deaths], weapons[deaths], len(weapon_names)):
+            res[player].causes[weapon_names[other]] = res[player].causes.get(weapon_names[other], 0) + num
+        for player, other, num in _count_pairs(players[deaths], players2[deaths], num_players):
+            res[player]._victims[res[other]] = num
+        for player, other, num in _count_pairs(players2[deaths], players[deaths], num_players):
+            res[player]._nemeses[res[other]] = num
+
+        return res
+
+    def _get_streaks(self, num_players: int, indices: 'np.ndarray', players: 'np.ndarray', players2: 'np.ndarray',
+            kills: 'np.ndarray', deaths: 'np.ndarray', suicides: 'np.ndarray'):
+        """Returns the longest run of kills and deaths of each player, not
+        counting teamkills"""
+        event_players = np.concatenate((players[kills], players2[deaths], players[suicides]))
+        event_keys = np.concatenate((
+            indices[kills] * _STEP + _KILL_STEP,
+            indices[deaths] * _STEP + _DEATH_STEP,
+            indices[suicides] * _STEP + _KILL_STEP,
+        ))
+        is_kill = np.concatenate((
+            np.ones(np.count_nonzero(kills), dtype=bool),
+            np.zeros(np.count_nonzero(deaths) + np.count_nonzero(suicides), dtype=bool),
+        ))
+        order = np.lexsort((event_keys, event_players))
+        event_players = event_players[order]
+        is_kill = is_kill[order]
+
+        # Split the events of each player into runs of kills and of deaths
+        starts = _starts_of_groups(event_players)
+        starts[1:] |= is_kill[1:] != is_kill[:-1]
+        run_starts = np.flatnonzero(starts)
+        run_lengths = np.diff(np.append(run_starts, len(order)))
+
+        killstreaks = np.zeros(num_players, dtype=np.int64)
+        deathstreaks = np.zeros(num_players, dtype=np.int64)
+        run_kills = is_kill[run_starts]
+        np.maximum.at(killstreaks, event_players[run_starts][run_kills], run_lengths[run_kills])
+        np.maximum.at(deathstreaks, event_players[run_starts][~run_kills], run_lengths[~run_kills])
+        return dict(killstreak=killstreaks, deathstreak=deathstreaks)
+
+    def _get_player_states(self, num_players: int, indices: 'np.ndarray', types: 'np.ndarray', players: 'np.ndarray',
+            players2: 'np.ndarray', teams: 'np.ndarray', teams2: 'np.ndarray', killers: 'np.ndarray'):
+        """Returns the factions, scores and time played of each player.
+
+        These depend on the order in which things happened to a player, so
+        score updates, faction updates and players joining or leaving are
+        put in a single stream per player. Every faction update is one of
+        `MatchDataBuilder`'s calls to `PlayerData.update_faction`.
+        """
+        victims = (types == _KILL) | (types == _TEAMKILL)
+        switches = (types == _SWITCH_TEAM) & (teams >= 0)
+        score_logs = np.frombuffer(self.score_logs, dtype=np.int64)
+        session_logs = np.frombuffer(self.session_logs, dtype=np.int64)
+        scores = np.frombuffer(self.scores, dtype=np.int64).reshape(-1, 4)
+        num_faction_updates = np.count_nonzero(killers) + np.count_nonzero(victims) + np.count_nonzero(switches)
+
+        stream_players = np.concatenate((
+            players[score_logs], players[killers], players2[victims], players[switches], players[session_logs]))
+        stream_keys = np.concatenate((
+            score_logs * _STEP + _SCORE_STEP,
+            indices[killers] * _STEP + _KILLER_STEP,
+            indices[victims] * _STEP + _VICTIM_STEP,
+            indices[switches] * _STEP + _KILLER_STEP,
+            session_logs * _STEP + _SESSION_STEP,
+        ))
+        kinds = np.concatenate((
+            np.full(len(score_logs), _SCORE, dtype=np.int8),
+            np.full(num_faction_updates, _FACTION, dtype=np.int8),
+            np.full(len(session_logs), _SESSION, dtype=np.int8),
+        ))
+        # The faction given, or for players joining or leaving their row in
+        # the session arrays
+        args = np.concatenate((
+            teams[score_logs], teams[killers], teams2[victims], teams[switches],
+            np.arange(len(session_logs), dtype=np.int64),
+        ))
+
+        order = np.lexsort((stream_keys, stream_players))
+        stream_players = stream_players[order]
+        kinds = kinds[order]
+        args = args[order]
+        size = len(order)
+        positions = np.arange(size, dtype=np.int64)
+        group_start = np.maximum.accumulate(np.where(_starts_of_groups(stream_players), positions, 0))
+        group_end = _ends_of_groups(stream_players)
+
+        def last_before(mask: 'np.ndarray', inclusive: bool):
+            """The position of the last event matching the mask of the same
+            player, or -1 if there is none"""
+            last = np.maximum.accumulate(np.where(mask, positions, -1))
+            if not inclusive:
+                last = np.concatenate(([-1], last[:-1]))[:size]
+            return np.where(last >= group_start, last, -1)
+
+        # Faction updates change the faction of a player unless they are put
+        # on no faction in particular, while a score update only does so when
+        # the player was on none yet
+        is_faction = kinds == _FACTION
+        is_score = kinds == _SCORE
+        candidates = (is_faction | is_score) & (args > _ANY)
+        first_candidates = candidates & (last_before(candidates, inclusive=False) < 0)
+        assignments = (is_faction & candidates) | (is_score & first_candidates)
+
+        def faction_at(last: 'np.ndarray'):
+            return np.where(last >= 0, args[np.maximum(last, 0)], _ANY)
+
+        current = faction_at(last_before(assignments, inclusive=True))
+        previous = faction_at(last_before(assignments, inclusive=False))
+        last_factions = np.zeros(num_players, dtype=np.int64)
+        last_factions[stream_players[group_end]] = current[group_end]
+
+        # The faction shown for a player is the first one given, or Any once
+        # they were given another
+        faction_positions = np.flatnonzero(is_faction)
+        faction_players = stream_players[faction_positions]
+        first_positions = faction_positions[last_before(is_faction, inclusive=False)[faction_positions] < 0]
+        first_factions = np.full(num_players, -1, dtype=np.int64)
+        first_factions[stream_players[first_positions]] = args[first_positions]
+        mixed = np.zeros(num_players, dtype=bool)
+        mixed[faction_players[args[faction_positions] != first_factions[faction_players]]] = True
+
+        # Players joining and leaving are rare, so these are simply gone
+        # through in order. Players are online from the start of the match.
+        steam_ids = list(self.player_codes)
+        session_types = types[session_logs]
+        session_times = [(time - self.start) // _ONE_MICROSECOND for time in self.session_times]
+        session_positions = np.flatnonzero(kinds == _SESSION)
+        seconds_after = list()
+        online_after = list()
+        final_seconds = [0] * num_players
+        final_online: List[Union[int, None]] = [-1] * num_players
+        last_player = None
+        for position, player in zip(session_positions.tolist(), stream_players[session_positions].tolist()):
+            if player != last_player:
+                seconds_played = 0
+                online_since = -1
+                last_player = player
+            row = int(args[position])
+            if session_types[row] == _LEAVE:
+                if online_since is None:
+                    logging.warning('Player left but was already offline: %s', steam_ids[player])
+                else:
+                    since = session_times[online_since] if online_since >= 0 else 0
+                    seconds_played += (session_times[row] - since) / 10**6
+                online_since = None
+            else:
+                online_since = row
+            seconds_after.append(seconds_played)
+            online_after.append(online_since)
+            final_seconds[player] = seconds_played
+            final_online[player] = online_since
+
+        # A player's time played is marked whenever their faction is updated
+        # while they are on one, the time since the last mark going to the
+        # faction they were on. Until the match has ended this includes the
+        # time they are still to play, up until the end of the match.
+        marks = np.flatnonzero(is_faction & candidates & (previous > _ANY))
+        mark_players = stream_players[marks]
+        last_session = last_before(kinds == _SESSION, inclusive=False)[marks]
+        # Ends with the state of players not having joined or left yet
+        seconds_after.append(0)
+        online_after.append(-1)
+        session_rows = np.where(last_session >= 0, np.searchsorted(session_positions, last_session), len(session_positions))
+        mark_seconds = np.array(seconds_after, dtype=np.float64)[session_rows]
+        online = np.array([since is not None for since in online_after], dtype=bool)[session_rows]
+        online_since = np.array([session_times[since] if since is not None and since >= 0 else 0 for since in online_after],
+            dtype=np.int64)[session_rows]
+        match_end = (self.end - self.start) // _ONE_MICROSECOND
+        playtime = np.where(online, mark_seconds + (match_end - online_since) / 10**6, mark_seconds).astype(np.int64)
+        first_marks = _starts_of_groups(mark_players)
+        gained = playtime - np.where(first_marks, 0, np.concatenate(([0], playtime[:-1]))[:len(marks)])
+        mark_factions = previous[marks]
+        allied_seconds = np.zeros(num_players, dtype=np.int64)
+        axis_seconds = np.zeros(num_players, dtype=np.int64)
+        np.add.at(allied_seconds, mark_players[mark_factions == _ALLIES], gained[mark_factions == _ALLIES])
+        np.add.at(axis_seconds, mark_players[mark_factions == _AXIS], gained[mark_factions == _AXIS])
+        last_playtime = np.zeros(num_players, dtype=np.int64)
+        last_marks = _ends_of_groups(mark_players)
+        last_playtime[mark_players[last_marks]] = playtime[last_marks]
+
+        # Scores are sent as totals, which go back to zero once a player
+        # leaves. Each update adds what was gained since the one before.
+        is_leave = np.zeros(size, dtype=bool)
+        is_leave[session_positions] = session_types[args[session_positions]] == _LEAVE
+        num_leaves = np.cumsum(is_leave)
+        score_positions = np.flatnonzero(is_score)
+        score_players = stream_players[score_positions]
+        score_leaves = num_leaves[score_positions]
+        # Score updates come first in the stream before sorting
+        stream_scores = scores[order[score_positions]]
+        same_session = ~_starts_of_groups(score_players)
+        same_session[1:] &= score_leaves[1:] == score_leaves[:-1]
+        gains = stream_scores.copy()
+        gains[1:] -= np.where(same_session[1:, None], stream_scores[:-1], 0)
+        score_factions = current[score_positions]
+        total_scores = np.zeros((num_players, 4), dtype=np.int64)
+        allied_scores = np.zeros((num_players, 4), dtype=np.int64)
+        axis_scores = np.zeros((num_players, 4), dtype=np.int64)
+        np.add.at(total_scores, score_players, gains)
+        np.add.at(allied_scores, score_players[score_factions == _ALLIES], gains[score_factions == _ALLIES])
+        np.add.at(axis_scores, score_players[score_factions == _AXIS], gains[score_factions == _AXIS])
+
+        return dict(
+            faction=[None if first < 0 else _FACTIONS[_ANY if is_mixed else first]
+                for first, is_mixed in zip(first_factions.tolist(), mixed.tolist())],
+            _faction=[_FACTIONS[faction] for faction in last_factions.tolist()],
+            allied_seconds_played=allied_seconds.tolist(),
+            axis_seconds_played=axis_seconds.tolist(),
+            _last_seen_playtime=last_playtime.tolist(),
+            _seconds_played=final_seconds,
+            _sess_start=[None if since is None else self.start if since < 0 else self.session_times[since]
+                for since in final_online],
+            score=[ScoreVector(*values) for values in total_scores.tolist()],
+            allied_score=[ScoreVector(*values) for values in allied_scores.tolist()],
+            axis_score=[ScoreVector(*values) for values in axis_scores.tolist()],
+        )
+
+def _starts_of_groups(values: 'np.ndarray'):
+    """Whether each value of a sorted array is the first of its kind"""
+    starts = np.ones(len(values), dtype=bool)
+    starts[1:] = values[1:] != values[:-1]
+    return starts
+
+def _ends_of_groups(values: 'np.ndarray'):
+    """Whether each value of a sorted array is the last of its kind"""
+    ends = np.ones(len(values), dtype=bool)
+    ends[:-1] = values[1:] != values[:-1]
+    return ends
+
+def _count_pairs(keys: 'np.ndarray', others: 'np.ndarray', num_others: int):
+    """Count how often each combination of a key and another value occurs.
+    Yields the key, the other value and the count of each combination, in
+    the order they first occurred."""
+    combined = keys * num_others + others
+    unique, first, counts = np.unique(combined, return_index=True, return_counts=True)
+    order = np.argsort(first, kind='stable')
+    unique = unique[order]
+    return zip((unique // num_others).tolist(), (unique % num_others).tolist(), counts[order].tolist())
+
+class ColumnarGroupBuilder:
+    """Builds a `MatchGroup` from logs fed to it one at a time, like
+    `MatchGroupBuilder`, but stores the logs of each match as columns and
+    calculates the scores of all players at once when the match is built.
+    Requires numpy.
+
+    The resulting players are the same as those of `MatchGroupBuilder`,
+    except that they can not be fed any more logs afterwards.
+    """
+    def __init__(self):
+        self.matches: List[MatchData] = list()
+        self.current = MatchColumns()
+
+    def feed(self, log: 'LogRecord'):
+        type_code = _TYPE_CODES.get(log.type)
+        if type_code is None:
+            return
+
+        if type_code == _MATCH_STARTED:
+            if self.current.num_logs:
+                self.matches.append(self.current.build())
+                self.current = MatchColumns()
+
+        self.current.feed(log, type_code)
+
+    def build(self):
+        return MatchGroup(self.matches + [self.current.build()])
@@ -2,9 +2,9 @@ from inspect import isfunction
 import json
 from enum import Enum
 from datetime import datetime
-from typing import List, Union
+from typing import BinaryIO, Iterable, Iterator, Union
 
-from lib.storage import LogLine, HLU_VERSION
+from lib.storage import LogRecord, LOG_FIELDS, HLU_VERSION
 from lib.scores import MatchGroup, MatchData, create_scoreboard
 
 __all__ = (
@@ -14,6 +14,36 @@ __all__ = (
     'JSONConverter',
 )
 
+# How many lines are encoded and written at once
+WRITE_BATCH_SIZE = 1000
+
+def _json_default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+_JSON_ENCODER = json.JSONEncoder(indent=2, default=_json_default)
+
+def write_lines(lines: Iterable[str], fp: BinaryIO):
+    """Write lines separated by newlines to a binary file as UTF-8, a batch
+    at a time, so that only one batch is held in memory at once.
+
+    Returns
+    -------
+    int
+        The number of bytes written
+    """
+    num_bytes = 0
+    batch = list()
+    separator = ""
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= WRITE_BATCH_SIZE:
+            num_bytes += fp.write((separator + "\n".join(batch)).encode('utf-8'))
+            batch.clear()
+            separator = "\n"
+    if batch:
+        num_bytes += fp.write((separator + "\n".join(batch)).encode('utf-8'))
+    return num_bytes
+
 class Converter:
     player_join_server=...
     player_leave_server=...
@@ -43,9 +73,12 @@ class Converter:
     start_arty_cooldown=...
     cancel_arty_cooldown=...
 
+    # Roughly how many bytes a converted log takes up, for estimating the
+    # size of exports before converting them
+    bytes_per_log = 130
 
     @classmethod
-    def convert(cls, log: 'LogLine'):
+    def convert(cls, log: 'LogRecord'):
         converter = getattr(cls, log.type)
         if isfunction(converter):
             return str(converter(log))
@@ -63,25 +96,37 @@ class Converter:
         return None
     
     @classmethod
-    def convert_many(cls, logs: List['LogLine'], include_header=True):
-        lines = list()
-
+    def iter_lines(cls, logs: Iterable['LogRecord'], include_header=True) -> Iterator[str]:
         if include_header:
             header = cls.header()
             if header is not None:
-                lines.append(str(header))
+                yield str(header)
         
         for log in logs:
             line = cls.convert(log)
             if line is not None:
-                lines.append(str(line))
-        
-        return "\n".join(lines)
+                yield str(line)
+
+    @classmethod
+    def write_many(cls, logs: Iterable['LogRecord'], fp: BinaryIO, include_header=True):
+        """Same as `convert_many`, except that the output is written to a
+        binary file as it is converted. Returns the number of bytes written."""
+        return write_lines(cls.iter_lines(logs, include_header), fp)
+
+    @classmethod
+    def convert_many(cls, logs: Iterable['LogRecord'], include_header=True):
+        return "\n".join(cls.iter_lines(logs, include_header))
 
     @classmethod
     def create_scoreboard(cls, scores: Union['MatchData', 'MatchGroup']):
         return create_scoreboard(scores)
 
+    @classmethod
+    def write_scoreboard(cls, scores: Union['MatchData', 'MatchGroup'], fp: BinaryIO):
+        """Write the scoreboard to a binary file. Returns the number of
+        bytes written."""
+        return fp.write(cls.create_scoreboard(scores).encode('utf-8'))
+
 class TextConverter(Converter):
     player_join_server      = "CONNECTED           \t{player_name} ({player_steamid})"
     player_leave_server     = "DISCONNECTED        \t{player_name} ({player_steamid})"
@@ -111,20 +156,20 @@ class TextConverter(Converter):
     player_kicked           = "KICKED              \t{player_name} ({player_steamid}): {message}"
 
     @staticmethod
-    def player_message(log: 'LogLine'):
+    def player_message(log: 'LogRecord'):
         if log.squad_name:
             return f"CHAT[{log.team_name}][{log.squad_name}]".ljust(20) + f"\t{log.player_name}: {log.message} ({log.player_steamid})"
         else:
             return f"CHAT[{log.team_name}]".ljust(20) + f"\t{log.player_name}: {log.message} ({log.player_steamid})"
     
     @staticmethod
-    def squad_leader_change(log: 'LogLine'):
+    def squad_leader_change(log: 'LogRecord'):
         p1 = f"{log.player_name} ({log.player_steamid})" if log.player_name is not None else "None"
         p2 = f"{log.player2_name} ({log.player2_steamid})" if log.player2_name is not None else "None"
         return "OFFICER CHANGED".ljust(20) + f"\tOfficer for {log.squad_name} ({log.team_name}): {p2} -> {p1}"
     
     @staticmethod
-    def rule_violated(log: 'LogLine'):
+    def rule_violated(log: 'LogRecord'):
         msg = "RULE VIOLATED".ljust(20) + f"\t{log.player_name} ({log.player_team}/{log.player_steamid})"
         if log.player2_name:
             msg += f" -> {log.player2_name} ({log.player2_team}/{log.player2_steamid})"
@@ -139,37 +184,26 @@ class TextConverter(Converter):
         return f"-- Captured and exported using HLL Log Utilities {HLU_VERSION}"
     
     @classmethod
-    def convert(cls, log: 'LogLine'):
+    def convert(cls, log: 'LogRecord'):
         out = super().convert(log)
         if out is not None:
             out = log.event_time.strftime('%H:%M:%S - %a, %b %d\t') + out
         return out
 
-    @classmethod
-    def convert_many(cls, logs: List['LogLine'], include_header=True):
-        lines = list()
-
-        if include_header:
-            lines.append(cls.header())
-        
-        for log in logs:
-            line = cls.convert(log)
-            if line is not None:
-                lines.append(line)
-        
-        return "\n".join(lines)
 
 
 class CSVConverter(Converter):
+    bytes_per_log = 180
+
     @classmethod
-    def convert(cls, log: 'LogLine'):
+    def convert(cls, log: 'LogRecord'):
         values = list()
         values = ['"' + (str(val).replace('"', '""') if val is not None else '') + '"' for val in log.dict().values()]
         return ",".join(values)
     
     @staticmethod
     def header():
-        return ",".join(LogLine.__fields__.keys())
+        return ",".join(LOG_FIELDS)
     
     @staticmethod
     def ext():
@@ -181,27 +215,54 @@ class CSVConverter(Converter):
         return stats.to_csv()
 
 class JSONConverter(Converter):
+    bytes_per_log = 650
+
     @staticmethod
     def ext():
         return 'json'
 
     @classmethod
-    def convert(cls, log: 'LogLine'):
+    def convert(cls, log: 'LogRecord'):
         return log.dict()
     
     @classmethod
-    def convert_many(cls, logs: List['LogLine']):
-        converted = [log for log in [cls.convert(log) for log in logs] if log is not None]
-        obj = dict(
-            start_time=logs[0].event_time if converted else None,
-            end_time=logs[-1].event_time if converted else None,
-            logs=converted
-        )
-        return json.dumps(obj, indent=2, default=lambda x: x.isoformat() if isinstance(x, datetime) else str(x))
+    def iter_lines(cls, logs: Iterable['LogRecord'], include_header=True) -> Iterator[str]:
+        """Yields the lines of a JSON object holding the logs, indented the
+        same way as `json.dumps(obj, indent=2)` would. The time of the last
+        log is only known once all logs were converted, so the end time
+        comes after the logs."""
+        start_time = None
+        end_time = None
+        num_converted = 0
+        for log in logs:
+            if start_time is None:
+                start_time = log.event_time
+            end_time = log.event_time
+
+            out = cls.convert(log)
+            if out is None:
+                continue
+            if not num_converted:
+                yield "{"
+                yield '  "start_time": ' + _JSON_ENCODER.encode(start_time) + ","
+                yield '  "logs": ['
+            else:
+                yield "    },"
+            # Strip the closing bracket, so that a comma can follow it
+            yield "    " + _JSON_ENCODER.encode(out)[:-2].replace("\n", "\n    ")
+            num_converted += 1
+
+        if not num_converted:
+            yield json.dumps(dict(start_time=None, logs=[], end_time=None), indent=2)
+            return
+        yield "    }"
+        yield "  ],"
+        yield '  "end_time": ' + _JSON_ENCODER.encode(end_time)
+        yield "}"
     
     @classmethod
     def create_scoreboard(cls, scores: Union['MatchData', 'MatchGroup']):
-        return json.dumps(scores.to_dict(), indent=2, default=lambda x: x.isoformat() if isinstance(x, datetime) else str(x))
+        return json.dumps(scores.to_dict(), indent=2, default=_json_default)
 
 
 
@@ -1,4 +1,5 @@
 from typing import Union, Dict
+import logging
 
 from lib.storage import cursor, database
 from lib.exceptions import NotFound, TemporaryCredentialsError, CredentialsAlreadyCreatedError
@@ -59,6 +60,37 @@ class Credentials:
             autosession_enabled=bool(res[7]),
         )
     
+    @classmethod
+    def load_all_from_db(cls) -> Dict[int, 'Credentials']:
+        """Load all credentials used by sessions that have not been
+        deleted, as well as those with auto-session enabled, in a single
+        query. Credentials that are already loaded are kept as is.
+
+        Returns
+        -------
+        Dict[int, Credentials]
+            All loaded credentials, mapped by their ID
+        """
+        cursor.execute('SELECT ROWID, guild_id, name, address, port, password, default_modifiers, autosession_enabled FROM credentials'
+            ' WHERE autosession_enabled = 1 OR ROWID IN (SELECT credentials_id FROM sessions WHERE deleted = 0)')
+        for res in cursor.fetchall():
+            if int(res[0]) in CREDENTIALS:
+                continue
+            try:
+                cls(
+                    id=int(res[0]),
+                    guild_id=int(res[1]),
+                    name=str(res[2]),
+                    address=str(res[3]),
+                    port=int(res[4]),
+                    password=str(res[5]),
+                    default_modifiers=ModifierFlags(int(res[6])),
+                    autosession_enabled=bool(res[7]),
+                )
+            except:
+                logging.exception('Failed to load credentials %s', res[0])
+        return CREDENTIALS
+
     @staticmethod
     def _create_in_db(guild_id: int, name: str, address: str, port: int, password: str, default_modifiers: ModifierFlags = ModifierFlags()):
         cursor.execute('INSERT INTO credentials (guild_id, name, address, port, password, default_modifiers) VALUES (?,?,?,?,?,?)',
@@ -120,10 +152,9 @@ class Credentials:
                 )
     
     def get_sessions(self):
-        from lib.session import SESSIONS
-        for session in SESSIONS.values():
-            if session.credentials == self:
-                yield session
+        from lib.session import get_sessions_by_credentials
+        if not self.temporary:
+            yield from get_sessions_by_credentials(self.id)
     
     @property
     def temporary(self):
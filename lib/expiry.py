@@ -0,0 +1,210 @@
+from queue import Queue, Empty
+from threading import Thread
+from time import perf_counter, sleep
+import sqlite3
+import logging
+
+from lib.storage import (LogStorageFormat, DB_PATH, PARTITIONED_TABLE_NAME, ARCHIVE_TABLE_NAME, MATCH_SUMMARIES_TABLE_NAME,
+    MATCH_PLAYERS_TABLE_NAME, get_logs_table_name, seconds_since_last_insert)
+from utils import get_config
+
+EXPIRY_BATCH_SIZE = get_config().getint('Database', 'ExpiryBatchSize', fallback=5000)
+VACUUM_PAGES_PER_STEP = get_config().getint('Database', 'VacuumPagesPerStep', fallback=1024)
+
+# How many seconds no logs may have been inserted before the database is
+# considered quiet enough to reclaim space
+QUIET_AFTER_SECONDS = 15
+# How many seconds to wait in between vacuum steps
+SECONDS_BETWEEN_VACUUM_STEPS = 5
+# How many free pages there need to be before they are worth reclaiming
+MIN_FREE_PAGES = 256
+# Archived blocks are a lot bigger than logs, so fewer are deleted at once
+ARCHIVE_BATCH_SIZE_DIVISOR = 256
+# The main connection waits on the write lock from the event loop, so
+# batches and vacuum steps are resized to hold it for about this long
+MAX_SECONDS_PER_TRANSACTION = 0.05
+
+def _resize_batch(size: int, elapsed: float, max_size: int):
+    """Returns the size of the next batch, based on how long the last
+    one took"""
+    if elapsed > MAX_SECONDS_PER_TRANSACTION:
+        return max(1, size // 2)
+    elif elapsed < MAX_SECONDS_PER_TRANSACTION / 4:
+        return min(max_size, size * 2)
+    return size
+
+class ExpiryWorker(Thread):
+    """A thread removing the logs of deleted sessions and reclaiming the
+    space they took up, using its own connection to the database.
+
+    Logs are deleted in batches, each in their own transaction, so that
+    sessions writing to the database are never blocked for long. Batches
+    shrink whenever one holds the write lock for too long. Freed pages
+    are returned to the file system with incremental vacuums, one small
+    step at a time and only while no logs are being inserted.
+    """
+    def __init__(self, path: str = DB_PATH):
+        super().__init__(name="ExpiryWorker", daemon=True)
+        self.path = path
+        self._queue = Queue()
+        self._connection = None
+
+        self.num_logs_deleted = 0
+        self.bytes_reclaimed = 0
+        self.seconds_spent = 0.0
+
+        self._vacuum_pages = VACUUM_PAGES_PER_STEP
+
+        # Stats of the ongoing vacuum
+        self._vacuum_bytes = 0
+        self._vacuum_seconds = 0.0
+        self._vacuum_steps = 0
+
+    def expire(self, sess_id: int, log_format: LogStorageFormat):
+        """Queue the logs of a deleted session for removal"""
+        self._queue.put((int(sess_id), LogStorageFormat(log_format)))
+
+    def stop(self):
+        self._queue.put(None)
+
+    def run(self):
+        self._connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            self._queue_deleted_sessions()
+
+            while True:
+                try:
+                    item = self._queue.get(timeout=SECONDS_BETWEEN_VACUUM_STEPS)
+                except Empty:
+                    if seconds_since_last_insert() >= QUIET_AFTER_SECONDS:
+                        self._vacuum_step()
+                    continue
+
+                if item is None:
+                    break
+
+                sess_id, log_format = item
+                try:
+                    self._delete_logs(sess_id, log_format)
+                except:
+                    logging.exception('Failed to delete logs of session %s', sess_id)
+        finally:
+            self._connection.close()
+            self._connection = None
+
+    def _queue_deleted_sessions(self):
+        # Logs of sessions that were deleted right before a shutdown may
+        # not have been removed yet
+        deleted = 'SELECT ROWID FROM "sessions" WHERE "deleted" = 1'
+        for table_name, log_format in ((PARTITIONED_TABLE_NAME, LogStorageFormat.partitioned), (ARCHIVE_TABLE_NAME, LogStorageFormat.archived)):
+            cur = self._connection.execute(f'SELECT DISTINCT "session_id" FROM "{table_name}" WHERE "session_id" IN ({deleted})')
+            for (sess_id,) in cur.fetchall():
+                self.expire(sess_id, log_format)
+
+        deleted_ids = {sess_id for (sess_id,) in self._connection.execute(deleted).fetchall()}
+        cur = self._connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'session%'")
+        for (table_name,) in cur.fetchall():
+            try:
+                sess_id = int(table_name[7:])
+            except ValueError:
+                continue
+            if sess_id in deleted_ids:
+                self.expire(sess_id, LogStorageFormat.plain)
+
+    def _delete_logs(self, sess_id: int, log_format: LogStorageFormat):
+        if log_format == LogStorageFormat.partitioned:
+            table_name = PARTITIONED_TABLE_NAME
+            where = ' WHERE "session_id" = ?'
+            params = (sess_id,)
+            batch_size = EXPIRY_BATCH_SIZE
+        elif log_format == LogStorageFormat.archived:
+            table_name = ARCHIVE_TABLE_NAME
+            where = ' WHERE "session_id" = ?'
+            params = (sess_id,)
+            batch_size = max(1, EXPIRY_BATCH_SIZE // ARCHIVE_BATCH_SIZE_DIVISOR)
+        else:
+            table_name = get_logs_table_name(sess_id)
+            where = ''
+            params = ()
+            batch_size = EXPIRY_BATCH_SIZE
+
+        max_batch_size = batch_size
+        start = perf_counter()
+        num_deleted = 0
+        while True:
+            query = f'DELETE FROM "{table_name}" WHERE ROWID IN (SELECT ROWID FROM "{table_name}"{where} LIMIT {int(batch_size)})'
+            batch_start = perf_counter()
+            try:
+                with self._connection:
+                    deleted = self._connection.execute(query, params).rowcount
+            except sqlite3.OperationalError as e:
+                if str(e).startswith('no such table'):
+                    break
+                raise
+            batch_elapsed = perf_counter() - batch_start
+
+            num_deleted += deleted
+            if deleted < batch_size:
+                break
+            batch_size = _resize_batch(batch_size, batch_elapsed, max_batch_size)
+            # Let others have the write lock for at least as long
+            sleep(max(0.01, batch_elapsed))
+
+        if log_format in (LogStorageFormat.plain, LogStorageFormat.normalized):
+            with self._connection:
+                self._connection.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+
+        with self._connection:
+            for summary_table_name in (MATCH_SUMMARIES_TABLE_NAME, MATCH_PLAYERS_TABLE_NAME):
+                self._connection.execute(f'DELETE FROM "{summary_table_name}" WHERE "session_id" = ?', (sess_id,))
+
+        elapsed = perf_counter() - start
+        self.seconds_spent += elapsed
+        if num_deleted:
+            if log_format != LogStorageFormat.archived:
+                self.num_logs_deleted += num_deleted
+            logging.info('Deleted %s %s of session %s in %.2fs', num_deleted,
+                'blocks of logs' if log_format == LogStorageFormat.archived else 'logs', sess_id, elapsed)
+
+    def _vacuum_step(self):
+        auto_vacuum, = self._connection.execute('PRAGMA auto_vacuum').fetchone()
+        if auto_vacuum != 2:
+            # Incremental vacuums do nothing until it is enabled
+            return
+
+        free_pages, = self._connection.execute('PRAGMA freelist_count').fetchone()
+        if free_pages < (MIN_FREE_PAGES if not self._vacuum_steps else 1):
+            if self._vacuum_steps:
+                self._finish_vacuum()
+            return
+
+        start = perf_counter()
+        page_size, = self._connection.execute('PRAGMA page_size').fetchone()
+        pages_before, = self._connection.execute('PRAGMA page_count').fetchone()
+        # Every row returned is a page being freed
+        self._connection.execute(f'PRAGMA incremental_vacuum({int(self._vacuum_pages)})').fetchall()
+        self._connection.commit()
+        pages_after, = self._connection.execute('PRAGMA page_count').fetchone()
+        elapsed = perf_counter() - start
+        self._vacuum_pages = _resize_batch(self._vacuum_pages, elapsed, VACUUM_PAGES_PER_STEP)
+
+        self._vacuum_bytes += (pages_before - pages_after) * page_size
+        self._vacuum_seconds += elapsed
+        self._vacuum_steps += 1
+
+    def _finish_vacuum(self):
+        # The file itself only shrinks once the WAL is checkpointed
+        start = perf_counter()
+        self._connection.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+        self._vacuum_seconds += perf_counter() - start
+
+        self.bytes_reclaimed += self._vacuum_bytes
+        self.seconds_spent += self._vacuum_seconds
+        logging.info('Reclaimed %.1f MB in %.2fs over %s steps (%.1f MB reclaimed in total)',
+            self._vacuum_bytes / 1_000_000, self._vacuum_seconds, self._vacuum_steps, self.bytes_reclaimed / 1_000_000)
+
+        self._vacuum_bytes = 0
+        self._vacuum_seconds = 0.0
+        self._vacuum_steps = 0
+
+expiry_worker = ExpiryWorker()
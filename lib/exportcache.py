@@ -0,0 +1,100 @@
+from cachetools import LRUCache
+from typing import Dict, Hashable, Union
+
+from lib.exportfiles import RenderedExport
+from utils import get_config
+
+# How many megabytes of rendered exports are kept in memory at most
+EXPORT_CACHE_SIZE = get_config().getint('Session', 'ExportCacheSizeInMB', fallback=32) * 1024 * 1024
+
+def _get_size(output: Union[RenderedExport, None]):
+    return output.size if output else 0
+
+class ExportCache:
+    """Keeps rendered exports in memory, so that switching back to a
+    combination of options that was already rendered does not need the
+    logs to be read and converted again.
+
+    Exports are keyed by session ID, the logs version of the session as
+    returned by `lib.storage.get_logs_version`, and whatever else the
+    output depends on. Once the cache holds more bytes than its maximum
+    size, the least recently used exports are evicted. An output of
+    `None` stands for an export without any matching logs.
+    """
+    def __init__(self, max_size: int = EXPORT_CACHE_SIZE):
+        self._cache = LRUCache(max_size, getsizeof=_get_size)
+        self._versions: Dict[int, int] = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    @property
+    def size(self):
+        """How many bytes the cached exports take up"""
+        return self._cache.currsize
+
+    @property
+    def max_size(self):
+        return self._cache.maxsize
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def _is_current(self, sess_id: int, version: int):
+        """Whether a version is the latest seen of a session. Exports of
+        older versions are forgotten once a newer version is seen."""
+        known = self._versions.get(sess_id)
+        if known is None or known < version:
+            if known is not None:
+                self.invalidate(sess_id)
+            self._versions[sess_id] = version
+        return self._versions[sess_id] == version
+
+    def get(self, sess_id: int, version: int, *options: Hashable):
+        """Returns a tuple of whether the export is cached and its output"""
+        sess_id = int(sess_id)
+        if self._is_current(sess_id, version):
+            key = (sess_id, version) + options
+            if key in self._cache:
+                self.hits += 1
+                return True, self._cache[key]
+        self.misses += 1
+        return False, None
+
+    def put(self, sess_id: int, version: int, *options: Hashable, output: Union[RenderedExport, None]):
+        sess_id = int(sess_id)
+        if not self._is_current(sess_id, version):
+            return
+        try:
+            self._cache[(sess_id, version) + options] = output
+        except ValueError:
+            # Larger than the entire cache
+            pass
+
+    def invalidate(self, sess_id: int):
+        """Forget all exports of a session"""
+        sess_id = int(sess_id)
+        self._versions.pop(sess_id, None)
+        for key in [key for key in self._cache if key[0] == sess_id]:
+            del self._cache[key]
+
+    def clear(self):
+        """Forget all exports, without resetting the hit rate"""
+        self._cache.clear()
+        self._versions.clear()
+
+    def stats(self):
+        return dict(
+            entries=len(self._cache),
+            size=self.size,
+            max_size=self.max_size,
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=round(self.hit_rate, 3),
+        )
+
+EXPORT_CACHE = ExportCache()
@@ -0,0 +1,163 @@
+from contextlib import contextmanager
+from enum import Enum
+import gzip
+from io import BytesIO
+import time
+from typing import BinaryIO, Iterable, Iterator, List
+import zipfile
+
+from lib.converters import Converter
+from lib.storage import LogRecord
+
+# How many files can be attached to a single message
+MAX_ATTACHMENTS = 10
+# How many bytes a file may have when uploaded outside of a guild, where
+# there is no boost tier to take the limit from. This is the lowest limit
+# Discord has applied to such uploads.
+DEFAULT_MAX_FILE_SIZE = 8 * 1024 * 1024
+# Parts are closed once they come within this many bytes of the maximum
+# size, or half of it for small maximum sizes, since converters and
+# compressors hold on to some output before writing it
+PART_SIZE_MARGIN = 1024 * 1024
+# Exports are compressed right away once they are estimated to take up
+# more than this fraction of the maximum size
+COMPRESS_ABOVE = 0.8
+# The compression level used for both containers. Higher levels barely
+# make logs any smaller but take much longer.
+COMPRESSION_LEVEL = 6
+
+class ExportCompression(Enum):
+    none = None
+    zip = 'zip'
+    gzip = 'gz'
+
+    def get_filename(self, filename: str):
+        """Returns the name of the container holding a file"""
+        if self == ExportCompression.zip:
+            return filename.rsplit('.', 1)[0] + '.zip'
+        elif self == ExportCompression.gzip:
+            return filename + '.gz'
+        else:
+            return filename
+
+@contextmanager
+def open_compressed(fp: BinaryIO, compression: ExportCompression, filename: str) -> Iterator[BinaryIO]:
+    """Returns a binary file that compresses whatever is written to it
+    into a container holding a single file, written to `fp` as it goes.
+    The container is completed once the context exits."""
+    compression = ExportCompression(compression)
+    if compression == ExportCompression.zip:
+        with zipfile.ZipFile(fp, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=COMPRESSION_LEVEL) as container:
+            info = zipfile.ZipInfo(filename, date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with container.open(info, 'w') as out:
+                yield out
+    elif compression == ExportCompression.gzip:
+        with gzip.GzipFile(filename, 'wb', compresslevel=COMPRESSION_LEVEL, fileobj=fp) as out:
+            yield out
+    else:
+        yield fp
+
+class ExportPart:
+    """A file holding an export or a part of it"""
+    __slots__ = ('filename', 'data')
+
+    def __init__(self, filename: str, data: bytes):
+        self.filename = filename
+        self.data = data
+
+    def __repr__(self):
+        return f"<ExportPart {self.filename} {len(self.data)} bytes>"
+
+class RenderedExport:
+    """The files an export was rendered into, which is more than one when
+    it would not fit in a single file otherwise"""
+    __slots__ = ('parts', 'raw_size', 'compression')
+
+    def __init__(self, parts: List[ExportPart], raw_size: int, compression: ExportCompression = ExportCompression.none):
+        self.parts = parts
+        self.raw_size = raw_size
+        self.compression = compression
+
+    @property
+    def size(self):
+        """How many bytes the files take up together"""
+        return sum(len(part.data) for part in self.parts)
+
+class _PartLogs:
+    """Yields logs until the output they are written to grows too large"""
+    def __init__(self, logs: Iterator[LogRecord], fp: BinaryIO, max_size: int):
+        self.logs = logs
+        self.fp = fp
+        self.max_size = max_size
+        self.full = False
+
+    def __iter__(self):
+        for log in self.logs:
+            yield log
+            if self.fp.tell() >= self.max_size:
+                self.full = True
+                return
+
+def estimate_size(converter: Converter, num_logs: int):
+    """Estimate how many bytes an uncompressed export of a number of logs
+    takes up, without converting any of them"""
+    return converter.bytes_per_log * num_logs
+
+def choose_compression(converter: Converter, num_logs: int, max_size: int):
+    """Returns the compression to use for an export that should fit in
+    files of at most `max_size` bytes, based on its estimated size"""
+    if estimate_size(converter, num_logs) > max_size * COMPRESS_ABOVE:
+        return ExportCompression.zip
+    return ExportCompression.none
+
+def write_parts(converter: Converter, logs: Iterable[LogRecord], filename: str,
+        compression: ExportCompression = ExportCompression.none, max_size: int = None) -> RenderedExport:
+    """Convert logs into one or more files of at most about `max_size`
+    bytes each, compressing them on the fly.
+
+    Every part is a complete file of its own, holding the logs that follow
+    those of the previous part. Once there is more than one, all parts have
+    their number added to their name. The file inside the container of the
+    first part keeps its plain name, since it is written before it is
+    known whether any parts follow.
+    """
+    compression = ExportCompression(compression)
+    logs = iter(logs)
+    if max_size is not None:
+        max_size -= min(PART_SIZE_MARGIN, max_size // 2)
+
+    parts = list()
+    raw_size = 0
+    name, ext = filename.rsplit('.', 1)
+    while True:
+        part_name = filename if not parts else f"{name}_part{len(parts) + 1}.{ext}"
+        fp = BytesIO()
+        part_logs = logs if max_size is None else _PartLogs(logs, fp, max_size)
+        with open_compressed(fp, compression, part_name) as out:
+            raw_size += converter.write_many(part_logs, out)
+        parts.append(ExportPart(compression.get_filename(part_name), fp.getvalue()))
+
+        if max_size is None or not part_logs.full:
+            break
+        # The logs may have run out right as the part was full
+        try:
+            log = next(logs)
+        except StopIteration:
+            break
+        logs = _prepend(log, logs)
+
+    if len(parts) > 1:
+        parts[0].filename = compression.get_filename(f"{name}_part1.{ext}")
+    return RenderedExport(parts, raw_size, compression)
+
+def _prepend(item, iterator: Iterator):
+    yield item
+    yield from iterator
+
+def write_scoreboard(converter: Converter, scores, filename: str,
+        compression: ExportCompression = ExportCompression.none) -> RenderedExport:
+    fp = BytesIO()
+    with open_compressed(fp, compression, filename) as out:
+        raw_size = converter.write_scoreboard(scores, out)
+    return RenderedExport([ExportPart(ExportCompression(compression).get_filename(filename), fp.getvalue())], raw_size, compression)
@@ -5,7 +5,7 @@ from inspect import isclass
 from lib.info.types import *
 
 if TYPE_CHECKING:
-    from lib.storage import LogLine
+    from lib.storage import LogRecord
 
 class Player(InfoModel):
     __key_fields__ = ("steamid", "id", "name",)
@@ -925,7 +925,7 @@ class EventFlags(Flags):
         return 1 << 27
 
 
-    def filter_logs(self, logs: Sequence['LogLine']):
+    def filter_logs(self, logs: Sequence['LogRecord']):
         allowed_types = {type_ for type_, allowed in self if allowed}
         for log in logs:
             if log.type in allowed_types:
@@ -0,0 +1,132 @@
+import os
+import struct
+import time
+import zlib
+from pathlib import Path
+from typing import List, Sequence, Tuple, TYPE_CHECKING
+
+from lib.storage import LogRecord, get_journal_seq
+
+if TYPE_CHECKING:
+    from lib.session import HLLCaptureSession
+
+JOURNALS_FOLDER = Path('journals')
+if not JOURNALS_FOLDER.exists():
+    JOURNALS_FOLDER.mkdir()
+
+# Every record is prefixed with its sequence number and the length and
+# CRC32 checksum of its payload
+_RECORD_HEADER = struct.Struct('>QII')
+
+class LogJournal:
+    """An append-only file holding the logs of a session that have not
+    been pushed to the database yet, so that they can be recovered after
+    a crash.
+
+    Logs are written as length-prefixed JSON records. Records are flushed
+    to the OS on every write, but only synced to disk once every
+    `sync_interval` seconds, since that is by far the most expensive part.
+    A record that was only partially written is ignored when reading.
+
+    Every record is given a sequence number, which keeps increasing across
+    resets. Storing the sequence number of the last record that was pushed
+    along with the logs lets records that made it into the database be
+    skipped when reading the journal again.
+    """
+    def __init__(self, path: Path, sync_interval: float = 30.0, last_seq: int = 0):
+        self.path = Path(path)
+        self.sync_interval = sync_interval
+        self.last_seq = last_seq
+        self._file = None
+        self._last_sync = time.monotonic()
+
+    @classmethod
+    def for_session(cls, session: 'HLLCaptureSession', sync_interval: float = 30.0):
+        return cls(JOURNALS_FOLDER / f"sess{session.id}.journal", sync_interval=sync_interval,
+            last_seq=get_journal_seq(session.id))
+
+    @staticmethod
+    def find_all():
+        """Returns a dict of session IDs mapped to the paths of all
+        journals currently on disk."""
+        journals = dict()
+        for path in JOURNALS_FOLDER.glob("sess*.journal"):
+            try:
+                journals[int(path.stem[4:])] = path
+            except ValueError:
+                continue
+        return journals
+
+    def append(self, logs: Sequence['LogRecord']):
+        if not logs:
+            return
+
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+
+        buffer = bytearray()
+        seq = self.last_seq
+        for log in logs:
+            seq += 1
+            payload = log.json(exclude_none=True).encode('utf-8')
+            buffer += _RECORD_HEADER.pack(seq, len(payload), zlib.crc32(payload))
+            buffer += payload
+        self._file.write(buffer)
+        self._file.flush()
+        self.last_seq = seq
+
+        if time.monotonic() - self._last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+        self._last_sync = time.monotonic()
+
+    def read(self, after: int = 0) -> List[Tuple[int, 'LogRecord']]:
+        """Returns the sequence numbers and logs of all records in the
+        journal, skipping those with a sequence number up to `after`."""
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+
+        logs = list()
+        offset = 0
+        while offset + _RECORD_HEADER.size <= len(data):
+            seq, size, checksum = _RECORD_HEADER.unpack_from(data, offset)
+            start = offset + _RECORD_HEADER.size
+            payload = data[start:start + size]
+            if len(payload) != size or zlib.crc32(payload) != checksum:
+                # The record was not fully written, which can only happen
+                # to the very last one.
+                break
+            if seq > after:
+                logs.append((seq, LogRecord.parse_raw(payload)))
+            offset = start + size
+
+        return logs
+
+    def reset(self):
+        """Empty the journal. Should be called once all logs it holds are
+        safely stored in the database."""
+        if self._file is not None:
+            self._file.truncate(0)
+            self._file.flush()
+        elif self.path.exists():
+            with open(self.path, 'wb'):
+                pass
+        self.sync()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def delete(self):
+        self.close()
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
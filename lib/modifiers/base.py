@@ -33,10 +33,16 @@ class Modifier(Configurable):
     def __init__(self, session: 'HLLCaptureSession'):
         self.session = session
 
-        self.listeners: Dict[str, List[EventListener]] = dict()
-        for listener in self.walk_listeners():
-            for event_type in listener.events:
-                self.listeners.setdefault(event_type, list()).append(listener)
+        # Listeners are defined on the class, so they only need to be
+        # collected once. The mapping is shared and must not be altered.
+        listeners = type(self).__dict__.get('_listeners_by_event_type')
+        if listeners is None:
+            listeners = dict()
+            for listener in self.walk_listeners():
+                for event_type in listener.events:
+                    listeners.setdefault(event_type, list()).append(listener)
+            type(self)._listeners_by_event_type = listeners
+        self.listeners: Dict[str, List[EventListener]] = listeners
     
     @property
     def rcon(self):
@@ -4,7 +4,7 @@ import math
 from .base import Modifier
 from lib.info.events import on_iteration, add_condition
 from lib.info.models import IterationEvent
-from lib.storage import LogLine
+from lib.storage import LogRecord
 from lib.rcon import get_name_from_steam
 
 REPLACE_SYMBOL = '⊗'
@@ -104,7 +104,7 @@ class EnforceNameValidityModifier(Modifier):
                 if squad:
                     payload['squad_name'] = squad.name
 
-                log = LogLine(
+                log = LogRecord(
                     type="player_kicked",
                     event_time=datetime.now(tz=timezone.utc),
 
@@ -2,7 +2,7 @@ import asyncio
 from datetime import datetime, timezone
 
 from .base import Modifier
-from lib.storage import LogLine
+from lib.storage import LogRecord
 from lib.info.events import on_player_any_kill, PlayerKillEvent, add_condition, add_cooldown, CooldownType
 from lib.mappings import WEAPONS, VEHICLES
 
@@ -21,7 +21,7 @@ class NoPantherModifier(Modifier):
     async def punish_on_panther_usage(self, event: PlayerKillEvent):
         player = event.player
 
-        log = LogLine.from_event(event)
+        log = LogRecord.from_event(event)
         log.type = "rule_violated"
         log.event_time=datetime.now(tz=timezone.utc)
         log.message = "Used a Panther in combat"
@@ -7,7 +7,7 @@ from .base import Modifier
 from lib.info.events import (on_player_kill, on_player_any_kill, on_player_leave_server, on_player_join_server,
     add_condition, add_cooldown, CooldownType, event_listener)
 from lib.info.models import ActivationEvent, PlayerKillEvent, PlayerLeaveServerEvent, PlayerJoinServerEvent, Player, Team
-from lib.storage import LogLine
+from lib.storage import LogRecord
 from lib.mappings import WEAPONS, BASIC_CATEGORIES, VEHICLE_WEAPONS_FACTIONLESS
 from utils import get_config
 
@@ -136,7 +136,7 @@ class OneArtyModifier(Modifier):
 
         self.dap[team_id] = player.steamid
 
-        log = LogLine(
+        log = LogRecord(
             type="arty_assigned",
             event_time=datetime.now(tz=timezone.utc),
 
@@ -173,7 +173,7 @@ class OneArtyModifier(Modifier):
 
         await self.punish_ten_people(player, reason=reason)
 
-        log = LogLine(
+        log = LogRecord(
             type="rule_violated",
             event_time=datetime.now(tz=timezone.utc),
 
@@ -196,7 +196,7 @@ class OneArtyModifier(Modifier):
             payload = get_log_payload(player)
             payload["team_name"] = team.name
             
-            log = LogLine(
+            log = LogRecord(
                 type="start_arty_cooldown",
                 event_time=datetime.now(tz=timezone.utc),
 
@@ -218,7 +218,7 @@ class OneArtyModifier(Modifier):
             payload = get_log_payload(player)
             payload["team_name"] = team.name
             
-            log = LogLine(
+            log = LogRecord(
                 type="cancel_arty_cooldown",
                 event_time=datetime.now(tz=timezone.utc),
 
@@ -236,7 +236,7 @@ class OneArtyModifier(Modifier):
             payload = get_log_payload(player)
             payload["team_name"] = team.name
 
-            log = LogLine(
+            log = LogRecord(
                 type="arty_unassigned",
                 event_time=datetime.now(tz=timezone.utc),
 
@@ -267,7 +267,7 @@ class OneArtyModifier(Modifier):
             reason = "You are not allowed to kill the enemy's designated artillery player!"
             await self.punish_ten_people(player, reason=reason)
 
-            log = LogLine(
+            log = LogRecord(
                 type="rule_violated",
                 event_time=datetime.now(tz=timezone.utc),
 
@@ -287,7 +287,7 @@ class OneArtyModifier(Modifier):
             reason = "As an artillery player you are not allowed to use any firearms!"
             await self.punish_ten_people(player, reason=reason)
 
-            log = LogLine(
+            log = LogRecord(
                 type="rule_violated",
                 event_time=datetime.now(tz=timezone.utc),
 
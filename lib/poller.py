@@ -0,0 +1,334 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timezone
+from discord.ext import tasks
+
+from lib import profiling
+from lib.rcon import HLLRcon
+from lib.info.models import InfoHopper
+from utils import get_config
+
+from typing import Dict, Tuple, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from lib.credentials import Credentials
+    from lib.session import HLLCaptureSession
+
+SECONDS_BETWEEN_ITERATIONS = get_config().getint('Session', 'SecondsBetweenIterations')
+MIN_SECONDS_BETWEEN_ITERATIONS = min(SECONDS_BETWEEN_ITERATIONS,
+    get_config().getfloat('Session', 'MinSecondsBetweenIterations', fallback=SECONDS_BETWEEN_ITERATIONS))
+MAX_SECONDS_BETWEEN_ITERATIONS = max(SECONDS_BETWEEN_ITERATIONS,
+    get_config().getfloat('Session', 'MaxSecondsBetweenIterations', fallback=SECONDS_BETWEEN_ITERATIONS))
+
+# Iterations starting this fraction of the interval after they were due
+# are considered late
+LATE_AFTER = 0.2
+# Iterations taking this fraction of the interval cause the next ones to
+# skip optional work, until they take less than the second fraction again
+DEGRADE_AFTER = 0.8
+RESTORE_BELOW = 0.4
+
+POLLERS: Dict[Tuple[str, int, str], 'ServerPoller'] = dict()
+
+def get_poller(credentials: 'Credentials'):
+    """Returns the poller for the server these credentials point to,
+    creating one if there is none yet. Sessions on the same server using
+    the same password share a poller, even across guilds."""
+    key = (credentials.address, credentials.port, credentials.password)
+    poller = POLLERS.get(key)
+    if poller is None:
+        poller = ServerPoller(key, credentials)
+        POLLERS[key] = poller
+    return poller
+
+class GatherCadence:
+    """Decides how many seconds to wait in between iterations, based on
+    how much is going on on the server.
+
+    - Servers with hardly any players are polled at the maximum interval
+    - During warmup, after a match has ended or while there is little
+      fighting, the interval lies halfway between the base and maximum
+    - During heavy fighting, the minimum interval is used
+    - Otherwise, the base interval is used
+
+    Kill and event rates are smoothed over several iterations so that
+    a single burst does not cause the interval to flip back and forth.
+    Servers are never polled faster than twice the time an update takes.
+    """
+    # Below this many players a server is considered idle
+    MIN_ACTIVE_PLAYERS = 2
+    # From these many kills per minute a server is considered busy or quiet
+    BUSY_KILLS_PER_MINUTE = 40
+    QUIET_KILLS_PER_MINUTE = 5
+    # Weight of the latest iteration in the smoothed rates
+    SMOOTHING = 0.3
+
+    def __init__(self, base: float = SECONDS_BETWEEN_ITERATIONS, minimum: float = MIN_SECONDS_BETWEEN_ITERATIONS,
+            maximum: float = MAX_SECONDS_BETWEEN_ITERATIONS):
+        self.base = base
+        self.minimum = minimum
+        self.maximum = maximum
+        self.interval = base
+        self.mode = "normal"
+
+        self.kills_per_minute = None
+        self.events_per_minute = None
+        self.update_duration = None
+        # The smoothed time that actually passes in between iterations,
+        # which is how precise the timestamps of the logs are
+        self.precision = None
+        self._last_update = None
+
+    def __str__(self):
+        return "%s, %.0f kills/min, %.0f events/min, updates take %.2fs" % (
+            self.mode, self.kills_per_minute or 0, self.events_per_minute or 0, self.update_duration or 0)
+
+    def _smooth(self, old: Union[float, None], new: float):
+        if old is None:
+            return new
+        return old + self.SMOOTHING * (new - old)
+
+    def update(self, info: Union[InfoHopper, None], duration: float):
+        """Take the result of an iteration into account.
+
+        Parameters
+        ----------
+        info : Union[InfoHopper, None]
+            The gathered information, or `None` if the update failed
+        duration : float
+            How many seconds the update took
+
+        Returns
+        -------
+        bool
+            Whether the interval has changed
+        """
+        now = time.monotonic()
+        elapsed = (now - self._last_update) if self._last_update else None
+        self._last_update = now
+        self.update_duration = self._smooth(self.update_duration, duration)
+
+        if elapsed:
+            self.precision = self._smooth(self.precision, elapsed)
+
+        if info and elapsed:
+            num_kills = len(info.events.get('player_kill', ())) + len(info.events.get('player_teamkill', ()))
+            num_events = sum(1 for _ in info.events.flatten())
+            self.kills_per_minute = self._smooth(self.kills_per_minute, num_kills * 60 / elapsed)
+            self.events_per_minute = self._smooth(self.events_per_minute, num_events * 60 / elapsed)
+
+            server = info.get('server')
+            state = server.get('state') if server else None
+            num_players = len(info.get('players', ()))
+
+            if num_players < self.MIN_ACTIVE_PLAYERS:
+                self.mode = "idle"
+            elif state in ("warmup", "end_of_round") or self.kills_per_minute < self.QUIET_KILLS_PER_MINUTE:
+                self.mode = "quiet"
+            elif self.kills_per_minute >= self.BUSY_KILLS_PER_MINUTE:
+                self.mode = "busy"
+            else:
+                self.mode = "normal"
+
+        if self.mode == "idle":
+            interval = self.maximum
+        elif self.mode == "quiet":
+            interval = (self.base + self.maximum) / 2
+        elif self.mode == "busy":
+            interval = self.minimum
+        else:
+            interval = self.base
+        interval = min(max(interval, self.update_duration * 2), self.maximum)
+
+        # Ignore small changes caused by the update duration
+        if abs(interval - self.interval) < 0.5:
+            return False
+        self.interval = interval
+        return True
+
+class IterationHealth:
+    """Counts how many iterations ran on time, how many ran late and how
+    many were skipped to catch up after running late."""
+    __slots__ = ('on_time', 'late', 'skipped', 'over_budget', 'degraded')
+
+    def __init__(self):
+        self.on_time = 0
+        self.late = 0
+        self.skipped = 0
+        self.over_budget = 0
+        self.degraded = 0
+
+    def __str__(self):
+        return "%s on time, %s late, %s skipped, %s over budget, %s degraded" % (
+            self.on_time, self.late, self.skipped, self.over_budget, self.degraded)
+
+    def to_dict(self):
+        return {attr: getattr(self, attr) for attr in self.__slots__}
+
+class ServerPoller:
+    """Gathers information from a server on behalf of all sessions
+    capturing it.
+
+    Every iteration the server is updated once, after which the resulting
+    `InfoHopper` is handed to each subscribed session through its queue.
+    A failed update is handed over as `None`. The poller starts once its
+    first session subscribes and stops once its last one unsubscribes.
+
+    Each iteration has the interval as its budget. Iterations that take
+    up most of it make the next ones skip optional work, and those that
+    exceed it are logged along with how long each phase took. Once an
+    iteration overruns, iterations that were due in the meantime are
+    skipped instead of run back to back.
+    """
+    def __init__(self, key: Tuple[str, int, str], credentials: 'Credentials', loop: asyncio.AbstractEventLoop = None):
+        self.key = key
+        self.credentials = credentials
+        self.loop = loop or asyncio.get_running_loop()
+        self.rcon = HLLRcon(session=self)
+        self.info: Union[InfoHopper, None] = None
+        self.cadence = GatherCadence()
+        self.health = IterationHealth()
+        self._last_start = None
+        self._subscribers: Dict[int, Tuple['HLLCaptureSession', asyncio.Queue]] = dict()
+
+    def __str__(self):
+        return f"{self.key[0]}:{self.key[1]}"
+
+    def __repr__(self):
+        return f"<ServerPoller {self} subscribers={len(self._subscribers)}>"
+
+    @property
+    def profile_name(self):
+        return f"poller {self}"
+
+    @property
+    def logger(self):
+        # RCON messages end up in the logs of the first subscribed session
+        for session, _ in self._subscribers.values():
+            return session.logger
+        return logging.getLogger()
+
+    @property
+    def num_subscribers(self):
+        return len(self._subscribers)
+
+    def subscribe(self, session: 'HLLCaptureSession', queue: asyncio.Queue):
+        """Start handing updates to a session. Starts the poller if this
+        is its first session."""
+        self._subscribers[session.id] = (session, queue)
+        if len(self._subscribers) > 1:
+            self.logger.info('Sharing poller for %s with %s other sessions', self, len(self._subscribers) - 1)
+        if not self.poll.is_running():
+            self.poll.start()
+
+    def unsubscribe(self, session: 'HLLCaptureSession'):
+        """Stop handing updates to a session. Stops the poller if this was
+        its last session."""
+        if self._subscribers.pop(session.id, None) is None:
+            return
+        if not self._subscribers:
+            self.poll.stop()
+            if POLLERS.get(self.key) is self:
+                del POLLERS[self.key]
+
+    def _record(self, status: str):
+        for health in [self.health] + [session.health for session, _ in self._subscribers.values()]:
+            setattr(health, status, getattr(health, status) + 1)
+
+    @tasks.loop(seconds=SECONDS_BETWEEN_ITERATIONS)
+    async def poll(self):
+        budget = self.poll.seconds
+        start = time.perf_counter()
+
+        # An iteration that overran is followed by the iterations that were
+        # due in the meantime. Skip those, except for the first.
+        if self._last_start is not None and start - self._last_start < budget / 2:
+            self._record('skipped')
+            return
+        self._last_start = start
+
+        next_iteration = self.poll.next_iteration
+        if next_iteration:
+            lateness = (datetime.now(tz=timezone.utc) - next_iteration).total_seconds() + budget
+        else:
+            # The poller is stopping
+            lateness = 0.0
+        self._record('late' if lateness > budget * LATE_AFTER else 'on_time')
+        degraded = self.rcon.degraded
+        if degraded:
+            self._record('degraded')
+
+        info = await self.rcon.update()
+        phases = dict(self.rcon.phases) if info else dict()
+        allocations = dict(self.rcon.allocations) if info else dict()
+        phases['update'] = time.perf_counter() - start
+
+        if info:
+            blocks = profiling.allocated_blocks()
+            phase_start = time.perf_counter()
+            try:
+                if self.info:
+                    info.compare_older(self.info, event_time=self.rcon._logs_seen_time)
+            except Exception:
+                self.logger.exception('Failed to compare server info of %s', self)
+            self.info = info
+            phases['compare'] = time.perf_counter() - phase_start
+            allocations['compare'] = profiling.allocated_blocks() - blocks
+
+        if profiling.is_enabled():
+            # Sessions sharing this poller share the cost of its phases
+            names = [self.profile_name] + [session.profile_name for session, _ in self._subscribers.values()]
+            for phase, seconds in phases.items():
+                for name in names:
+                    profiling.record(name, phase, seconds, allocations.get(phase))
+
+        for session, queue in self._subscribers.values():
+            if queue.full():
+                # Don't let updates pile up for a session that fell behind
+                session.logger.warning('Dropping oldest update of %s queued for processing', queue.qsize())
+                queue.get_nowait()
+            queue.put_nowait(info)
+
+        duration = time.perf_counter() - start
+        if duration > budget:
+            self._record('over_budget')
+            self.logger.warning('Iteration overran its budget: %s', json.dumps(dict(
+                server=str(self),
+                budget=round(budget, 2),
+                duration=round(duration, 2),
+                lateness=round(max(lateness, 0), 2),
+                degraded=degraded,
+                players=len(info.get('players', ())) if info else None,
+                subscribers=len(self._subscribers),
+                phases={phase: round(seconds, 3) for phase, seconds in phases.items()},
+            )))
+
+        if not degraded and duration > budget * DEGRADE_AFTER:
+            self.rcon.degraded = True
+            self.logger.warning('Skipping optional work for %s, since iterations take %.1fs out of %.1fs', self, duration, budget)
+        elif degraded and duration < budget * RESTORE_BELOW:
+            self.rcon.degraded = False
+            self.logger.info('No longer skipping optional work for %s, iterations take %.1fs out of %.1fs', self, duration, budget)
+
+        old_interval = self.cadence.interval
+        if self.cadence.update(info, duration):
+            self.poll.change_interval(seconds=self.cadence.interval)
+            self.logger.info('Changed interval of %s from %.1fs to %.1fs (%s). Logs were precise to within %.1fs',
+                self, old_interval, self.cadence.interval, self.cadence, self.cadence.precision or old_interval)
+
+    @poll.before_loop
+    async def before_poll_start(self):
+        try:
+            await self.rcon.start(force=False)
+        except Exception:
+            self.logger.exception('Failed to start RCON')
+
+    @poll.after_loop
+    async def after_poll_stop(self):
+        self.logger.info('Stopping poller for %s. Iterations: %s', self, self.health)
+        try:
+            await self.rcon.stop(force=True)
+        except Exception:
+            self.logger.exception('Failed to stop RCON')
@@ -0,0 +1,150 @@
+import json
+import sys
+import time
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Union
+
+from utils import get_config
+
+# How many of the latest iterations to calculate percentiles over
+PROFILE_WINDOW = 500
+
+_enabled = get_config().getboolean('Session', 'ProfileIterations', fallback=False)
+
+def is_enabled():
+    return _enabled
+
+def set_enabled(enabled: bool):
+    global _enabled
+    _enabled = bool(enabled)
+
+def allocated_blocks():
+    """Returns the number of memory blocks currently allocated, or 0
+    while profiling is disabled"""
+    return sys.getallocatedblocks() if _enabled else 0
+
+def _percentile(values: list, fraction: float):
+    """Returns the value at a fraction of a sorted list"""
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+class PhaseStats:
+    """The durations and allocations of the latest iterations of a phase"""
+    __slots__ = ('durations', 'allocations', 'count')
+
+    def __init__(self, window: int = PROFILE_WINDOW):
+        self.durations = deque(maxlen=window)
+        self.allocations = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, seconds: float, blocks: int = None):
+        self.count += 1
+        self.durations.append(seconds)
+        if blocks is not None:
+            self.allocations.append(blocks)
+
+    def summary(self):
+        durations = sorted(self.durations)
+        summary = dict(
+            count=self.count,
+            p50_ms=round(_percentile(durations, 0.50) * 1000, 3),
+            p90_ms=round(_percentile(durations, 0.90) * 1000, 3),
+            p99_ms=round(_percentile(durations, 0.99) * 1000, 3),
+            max_ms=round(durations[-1] * 1000, 3),
+        )
+        if self.allocations:
+            allocations = sorted(self.allocations)
+            summary['p50_blocks'] = _percentile(allocations, 0.50)
+            summary['p90_blocks'] = _percentile(allocations, 0.90)
+        return summary
+
+class _Measurement:
+    __slots__ = ('stats', 'start', 'blocks')
+
+    def __init__(self, stats: PhaseStats):
+        self.stats = stats
+
+    def __enter__(self):
+        self.blocks = sys.getallocatedblocks()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        self.stats.add(elapsed, sys.getallocatedblocks() - self.blocks)
+
+class _NullMeasurement:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+_NULL_MEASUREMENT = _NullMeasurement()
+
+class Profile:
+    """Timings of each phase of the iterations of a session or poller.
+
+    Allocations are measured as the change in the number of memory blocks
+    allocated by the interpreter, and only for phases that do not await.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.phases: Dict[str, PhaseStats] = dict()
+
+    def get_phase(self, phase: str):
+        stats = self.phases.get(phase)
+        if stats is None:
+            stats = self.phases[phase] = PhaseStats()
+        return stats
+
+    def record(self, phase: str, seconds: float, blocks: int = None):
+        self.get_phase(phase).add(seconds, blocks)
+
+    def summary(self):
+        return {phase: stats.summary() for phase, stats in self.phases.items()}
+
+PROFILES: Dict[str, Profile] = dict()
+
+def get_profile(name: str):
+    profile = PROFILES.get(name)
+    if profile is None:
+        profile = PROFILES[name] = Profile(name)
+    return profile
+
+def measure(name: str, phase: str):
+    """Returns a context manager measuring how long the phase within it
+    takes. Does nothing while profiling is disabled.
+
+    Parameters
+    ----------
+    name : str
+        The name of the profile, such as "sess1"
+    phase : str
+        The name of the phase
+    """
+    if not _enabled:
+        return _NULL_MEASUREMENT
+    return _Measurement(get_profile(name).get_phase(phase))
+
+def record(name: str, phase: str, seconds: float, blocks: int = None):
+    """Record a phase that was timed elsewhere. Does nothing while
+    profiling is disabled."""
+    if _enabled:
+        get_profile(name).record(phase, seconds, blocks)
+
+def reset():
+    PROFILES.clear()
+
+def dump(path: Union[str, Path]):
+    """Write the summaries of all profiles to a JSON file"""
+    data = dict(
+        created_at=datetime.now(tz=timezone.utc).isoformat(),
+        window=PROFILE_WINDOW,
+        profiles={name: profile.summary() for name, profile in PROFILES.items()},
+    )
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
@@ -4,11 +4,14 @@ from datetime import datetime, timedelta
 from functools import wraps
 import re
 import math
+import time
+from cachetools.keys import hashkey
 
-from typing import List, TYPE_CHECKING
+from typing import Dict, List, Tuple, TYPE_CHECKING
 
 from lib.protocol import HLLRconProtocol
 from lib.exceptions import HLLConnectionError
+from lib.profiling import allocated_blocks
 from lib.mappings import SQUAD_LEADER_ROLES, TEAM_LEADER_ROLES, INFANTRY_ROLES, TANK_ROLES, RECON_ROLES, is_steamid
 from lib.info.models import *
 from utils import to_timedelta, ttl_cache, get_config
@@ -44,6 +47,16 @@ async def get_name_from_steam(steamid: str, __name: str = None) -> str:
         data = await res.json()
         return data['response']['players'][0]['personaname']
 
+def is_name_from_steam_cached(steamid: str, name: str = None):
+    return hashkey(steamid, name) in get_name_from_steam.cache
+
+async def prefetch_name_from_steam(steamid: str, name: str = None):
+    """Look up a name so that it is cached by the next time it is needed"""
+    try:
+        await get_name_from_steam(steamid, name)
+    except Exception:
+        pass
+
 
 # --- Wrappers to help manage the connection
 def start_method(func):
@@ -118,6 +131,17 @@ class HLLRcon:
         self.queue = asyncio.Queue()
         self._missed_gathers = 0
 
+        # When degraded, optional work is skipped to save time. Names are
+        # not looked up on Steam and only half of all players have their
+        # info refreshed, the info of the other half is reused.
+        self.degraded = False
+        # How long each phase of the last update took, in seconds, and for
+        # phases that do not await, how many memory blocks they allocated
+        self.phases: Dict[str, float] = dict()
+        self.allocations: Dict[str, int] = dict()
+        self._num_updates = 0
+        self._playerinfo_cache: Dict[str, Tuple[int, str]] = dict()
+
     @property
     def loop(self):
         return self.session.loop
@@ -180,6 +204,9 @@ class HLLRcon:
 
     @update_method
     async def update(self):
+        self._num_updates += 1
+        self.phases = dict()
+        self.allocations = dict()
         self._info = InfoHopper()
         await self._fetch_server_info()
         self.info = self._info
@@ -192,6 +219,13 @@ class HLLRcon:
             return True
 
 
+    async def _timed(self, phase: str, coro):
+        start = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            self.phases[phase] = self.phases.get(phase, 0.0) + (time.perf_counter() - start)
+
     async def _fetch_server_info(self):
         data = dict()
         res = await asyncio.gather(
@@ -199,8 +233,10 @@ class HLLRcon:
             # self.__fetch_server_settings(),
             self.__fetch_current_server_info(),
             # self.__fetch_player_roles(),
-            self.exec_command('showlog 1', multipart=True)
+            self._timed('showlog', self.exec_command('showlog 1', multipart=True))
         )
+        blocks = allocated_blocks()
+        start = time.perf_counter()
         logs = res.pop(-1)
         for d in res:
             if isinstance(d, dict):
@@ -288,9 +324,16 @@ class HLLRcon:
             elif team.id == 2:
                 team.score = int(data['team2_score'])
         
+        self.phases['build'] = time.perf_counter() - start
+        self.allocations['build'] = allocated_blocks() - blocks
+
+        blocks = allocated_blocks()
+        start = time.perf_counter()
         self.__parse_logs(logs)
         self._info.server.state = self._state
-        self._map = map            
+        self._map = map
+        self.phases['parse_logs'] = time.perf_counter() - start
+        self.allocations['parse_logs'] = allocated_blocks() - blocks
     
     async def exec_command(self, cmd, **kwargs) -> Union[str, list]:
         fut = self.loop.create_future()
@@ -317,11 +360,11 @@ class HLLRcon:
         return dict(zip(types+['profanity'], data))
 
     async def __fetch_current_server_info(self):
-        playerids, gamestate = await asyncio.gather(
+        playerids, gamestate = await self._timed('playerids', asyncio.gather(
             # self.exec_command("rotlist"),
             self.exec_command("get playerids", unpack_array=True),
             self.exec_command("get gamestate")
-        )
+        ))
         # rotation = rotation.split('\n')
 
         players = list()
@@ -347,8 +390,14 @@ class HLLRcon:
             if name.endswith(' '):
                 problematic = True
             elif name.endswith('?') and STEAM_API_KEY:
-                if is_steamid(steamid):
-                    full_name = await get_name_from_steam(steamid, name)
+                if not is_steamid(steamid):
+                    pass
+                elif self.degraded and not is_name_from_steam_cached(steamid, name):
+                    # Handle the name as if there was no Steam API key
+                    # for now, it will be known by the next iteration
+                    self.loop.create_task(prefetch_name_from_steam(steamid, name))
+                else:
+                    full_name = await self._timed('steam', get_name_from_steam(steamid, name))
                     chars = 0
                     for char in full_name:
                         char_size = math.ceil(len(char.encode()) / 3)
@@ -365,7 +414,31 @@ class HLLRcon:
             else:
                 playerids_normal[steamid] = name
 
-        playerinfos = await asyncio.gather(*[self.exec_command('playerinfo %s' % playerid, can_fail=True) for playerid in playerids_normal.values()])
+        cache = self._playerinfo_cache
+        if self.degraded:
+            # Refresh the players whose info is the oldest, new players first
+            steamids = sorted(playerids_normal, key=lambda steamid: cache[steamid][0] if steamid in cache else -1)
+            steamids = steamids[:math.ceil(len(steamids) / 2)]
+        else:
+            steamids = list(playerids_normal)
+
+        responses = await self._timed('playerinfo', asyncio.gather(
+            *[self.exec_command('playerinfo %s' % playerids_normal[steamid], can_fail=True) for steamid in steamids]
+        ))
+        fetched = dict(zip(steamids, responses))
+        playerinfos = list()
+        for steamid in playerids_normal:
+            if steamid in fetched:
+                playerinfo = fetched[steamid]
+                if playerinfo:
+                    cache[steamid] = (self._num_updates, playerinfo)
+            elif steamid in cache:
+                playerinfo = cache[steamid][1]
+            else:
+                continue
+            playerinfos.append(playerinfo)
+        self._playerinfo_cache = {steamid: cache[steamid] for steamid in playerids_normal if steamid in cache}
+
         for playerinfo in playerinfos:
             if not playerinfo:
                 # The command (most likely) failed
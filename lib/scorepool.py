@@ -0,0 +1,166 @@
+from collections import namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import logging
+import multiprocessing
+import operator
+import threading
+from typing import Iterable, List, Tuple, Union, TYPE_CHECKING
+
+from lib import columnar
+from lib.info.models import EventTypes
+from lib.scores import MatchData, MatchGroup
+from utils import get_config
+
+if TYPE_CHECKING:
+    from lib.storage import LogRecord
+
+# How many processes matches are built in at once. 0 builds them in the
+# calling thread instead.
+NUM_SCORING_PROCESSES = get_config().getint('Session', 'NumScoringProcesses', fallback=0)
+# Sessions with fewer logs than this are always built in the calling thread
+PARALLEL_SCORING_MIN_LOGS = get_config().getint('Session', 'ParallelScoringMinLogs', fallback=100000)
+
+# Only the fields that scores are calculated from are sent to the workers
+_CHUNK_FIELDS = ('event_time', 'type', 'player_name', 'player_steamid', 'player_team', 'player_combat_score',
+    'player_offense_score', 'player_defense_score', 'player_support_score', 'player2_name', 'player2_steamid',
+    'player2_team', 'weapon', 'old', 'new', 'message')
+_ChunkLog = namedtuple('_ChunkLog', _CHUNK_FIELDS)
+_get_chunk_values = operator.attrgetter(*_CHUNK_FIELDS)
+_KNOWN_TYPES = frozenset(log_type.name for log_type in EventTypes)
+
+_pool: Union[ProcessPoolExecutor, None] = None
+# Matches are built from executor threads, which may start or discard the
+# pool at the same time
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Returns the process pool to build matches in, starting it if it is
+    not running yet. Returns `None` if it can not be started."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            try:
+                # Workers are spawned rather than forked, since forking a process
+                # running other threads may copy locks those threads are holding
+                _pool = ProcessPoolExecutor(max_workers=NUM_SCORING_PROCESSES,
+                    mp_context=multiprocessing.get_context('spawn'))
+            except Exception:
+                logging.exception('Failed to start scoring processes, building matches one by one instead')
+        return _pool
+
+def _discard_pool(pool: Union[ProcessPoolExecutor, None]):
+    global _pool
+    if pool is None:
+        return
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+def create_group_builder():
+    """Returns a builder for the scores of a stream of logs. Matches of
+    large sessions are built in separate processes if enabled, and
+    otherwise using the configured scoring engine."""
+    if NUM_SCORING_PROCESSES > 0:
+        return ParallelGroupBuilder()
+    return columnar.create_group_builder()
+
+def build_group(logs: Iterable['LogRecord']) -> MatchGroup:
+    """Same as `MatchGroup.from_logs`, but building matches of large
+    sessions in separate processes if enabled, and otherwise using the
+    configured scoring engine"""
+    builder = create_group_builder()
+    for log in logs:
+        builder.feed(log)
+    return builder.build()
+
+def _build_chunk(chunk: List[tuple]) -> MatchData:
+    return columnar.build_group(_ChunkLog._make(values) for values in chunk).matches[-1]
+
+def _build_summary(chunk: List[tuple]) -> Tuple[dict, List[dict]]:
+    """Build the match of a chunk of logs in a worker. Matches themselves
+    can not be pickled, since their players refer to one another, so they
+    are sent back as summaries."""
+    match = _build_chunk(chunk)
+    return match.to_summary(), [player.to_summary() for player in match.players]
+
+class ParallelGroupBuilder:
+    """Builds a `MatchGroup` from logs fed to it one at a time, like
+    `MatchGroupBuilder`, but builds each match in a separate process.
+
+    Logs are split into chunks on each match start, with each chunk
+    holding only the fields needed for scores. Chunks are kept until
+    the session turns out to have enough logs and more than one match to
+    be worth sending to other processes. Matches of sessions that don't,
+    or that could not be built in another process, are built in the
+    calling thread instead.
+    """
+    def __init__(self, min_logs: int = PARALLEL_SCORING_MIN_LOGS):
+        self.min_logs = min_logs
+        self.num_logs = 0
+        self.chunks: List[Union[List[tuple], None]] = list()
+        self.futures: List[Union[Future, None]] = list()
+        self.current: List[tuple] = list()
+        self.pool: Union[ProcessPoolExecutor, None] = None
+
+    def feed(self, log: 'LogRecord'):
+        if log.type not in _KNOWN_TYPES:
+            return
+
+        if log.type == EventTypes.server_match_started.name and self.current:
+            self._close_chunk()
+
+        self.current.append(_get_chunk_values(log))
+        self.num_logs += 1
+
+    def _close_chunk(self):
+        self.chunks.append(self.current)
+        self.futures.append(None)
+        self.current = list()
+
+        if self.pool is None:
+            if self.num_logs < self.min_logs or len(self.chunks) < 2:
+                return
+            self.pool = get_pool()
+            if self.pool is None:
+                return
+        self._submit()
+
+    def _submit(self):
+        for i, (chunk, future) in enumerate(zip(self.chunks, self.futures)):
+            if future is not None:
+                # Chunks are kept in case the match needs to be built here
+                # after all, until it was built elsewhere
+                if future.done() and not future.exception():
+                    self.chunks[i] = None
+                continue
+            try:
+                self.futures[i] = self.pool.submit(_build_summary, chunk)
+            except Exception:
+                # The pool is shutting down or broke, build the rest here
+                logging.exception('Failed to hand match to scoring processes, building it in this thread instead')
+                _discard_pool(self.pool)
+                self.pool = None
+                return
+
+    def _get_match(self, chunk: Union[List[tuple], None], future: Union[Future, None]) -> MatchData:
+        if future is not None:
+            try:
+                data, players = future.result()
+            except BrokenProcessPool:
+                logging.exception('Scoring processes stopped unexpectedly, building match in this thread instead')
+                _discard_pool(self.pool)
+            except Exception:
+                logging.exception('Failed to build match in scoring process, building it in this thread instead')
+            else:
+                return MatchData.from_summary(data, players)
+        return _build_chunk(chunk)
+
+    def build(self):
+        if not self.chunks and not self.current:
+            return columnar.build_group(())
+        if self.current:
+            self._close_chunk()
+
+        return MatchGroup([self._get_match(chunk, future) for chunk, future in zip(self.chunks, self.futures)])
@@ -1,9 +1,10 @@
+from collections import Counter
+import copy
 import operator
 from datetime import datetime, timedelta
 from enum import Enum
 import operator
-from pydantic import BaseModel
-from typing import Dict, List, Union, TYPE_CHECKING
+from typing import Dict, Iterable, List, Sequence, Tuple, Union, TYPE_CHECKING
 import logging
 
 from lib import mappings
@@ -11,7 +12,7 @@ from lib.info.models import EventTypes
 from utils import toTable, side_by_side
 
 if TYPE_CHECKING:
-    from lib.storage import LogLine
+    from lib.storage import LogRecord
 
 def combine_dicts(a, b, op=operator.add):
     return dict(list(a.items()) + list(b.items()) +
@@ -25,20 +26,55 @@ class Faction(Enum):
     Axis = "Axis"
     Any = "Any"
 
-class PlayerScore(BaseModel):
-    combat: int = 0
-    offense: int = 0
-    defense: int = 0
-    support: int = 0
+class ScoreVector:
+    """The four scores of a player as plain integers.
 
-    def __add__(self, other: 'PlayerScore'):
-        if not isinstance(other, PlayerScore):
+    Scores are updated for nearly every log of a match, which is too often
+    to build a pydantic model each time. Adding to a vector in place changes
+    it, so vectors should not be shared between players.
+    """
+    __slots__ = ('combat', 'offense', 'defense', 'support')
+
+    def __init__(self, combat: int = 0, offense: int = 0, defense: int = 0, support: int = 0):
+        self.combat = combat
+        self.offense = offense
+        self.defense = defense
+        self.support = support
+
+    def __repr__(self):
+        return "ScoreVector(combat=%s, offense=%s, defense=%s, support=%s)" % (
+            self.combat, self.offense, self.defense, self.support)
+
+    def __eq__(self, other):
+        if not isinstance(other, ScoreVector):
+            return NotImplemented
+        return (self.combat == other.combat and self.offense == other.offense
+            and self.defense == other.defense and self.support == other.support)
+
+    def __add__(self, other: 'ScoreVector'):
+        if not isinstance(other, ScoreVector):
             return NotImplemented
-        return PlayerScore(**combine_dicts(self.dict(), other.dict()))
-    def __sub__(self, other: 'PlayerScore'):
-        if not isinstance(other, PlayerScore):
+        return ScoreVector(self.combat + other.combat, self.offense + other.offense,
+            self.defense + other.defense, self.support + other.support)
+    def __sub__(self, other: 'ScoreVector'):
+        if not isinstance(other, ScoreVector):
             return NotImplemented
-        return PlayerScore(**combine_dicts(self.dict(), other.dict(), op=operator.sub))
+        return ScoreVector(self.combat - other.combat, self.offense - other.offense,
+            self.defense - other.defense, self.support - other.support)
+    def __iadd__(self, other: 'ScoreVector'):
+        if not isinstance(other, ScoreVector):
+            return NotImplemented
+        self.combat += other.combat
+        self.offense += other.offense
+        self.defense += other.defense
+        self.support += other.support
+        return self
+
+    def copy(self):
+        return ScoreVector(self.combat, self.offense, self.defense, self.support)
+
+    def dict(self):
+        return dict(combat=self.combat, offense=self.offense, defense=self.defense, support=self.support)
 
 
 
@@ -54,29 +90,14 @@ class MatchGroup:
         return True
     
     @classmethod
-    def from_logs(cls, logs: List['LogLine']):
-        matches = list()
-        match_logs = list()
-        
-        while logs:
-            log = logs.pop(0)
-            try:
-                log_type = EventTypes(log.type)
-            except ValueError:
-                continue
-
-            if log_type == EventTypes.server_match_started:
-                if match_logs:
-                    match_data = MatchData.from_logs(match_logs)
-                    matches.append(match_data)
-                    match_logs.clear()
-
-            match_logs.append(log)
-        
-        match_data = MatchData.from_logs(match_logs)
-        matches.append(match_data)
-
-        return cls(matches=matches)
+    def from_logs(cls, logs: Iterable['LogRecord']):
+        """Build the matches in a stream of logs, splitting them on each
+        match start. Logs are consumed one at a time and never held on to,
+        so they must be in chronological order."""
+        builder = MatchGroupBuilder()
+        for log in logs:
+            builder.feed(log)
+        return builder.build()
                 
     def get_matches_for_player(self, player: Union['PlayerData', str]):
         if not isinstance(player, PlayerData):
@@ -140,17 +161,40 @@ class MatchGroup:
 class DataStore:
     """A storage to collect and access various stats
     from players.
+
+    Rollups over all players, such as the weapons killed with, are
+    calculated once and kept, so the players of a store should not change
+    after it is created.
     """
     def __init__(self, duration: timedelta, players: List["PlayerData"]):
         self.duration = duration
         self.players = list(players)
+        self._rollups: Dict[str, Counter] = dict()
     
     @classmethod
     def union(cls, *data):
-        res = cls(timedelta(), list())
-        for match in data:
-            res += match
-        return res
+        """Combine the stats of several stores, adding up the stats of
+        players that appear in more than one"""
+        duration = timedelta()
+        players: Dict[str, List[PlayerData]] = dict()
+        for store in data:
+            duration += store.duration
+            for player in store.players:
+                players.setdefault(player.steam_id, []).append(player)
+        return DataStore(duration, [
+            same[0] if len(same) == 1 else PlayerData.union(*same)
+            for same in players.values()
+        ])
+
+    def _rollup(self, attr: str) -> Counter:
+        """Returns the dicts of all players under an attribute, such as
+        their weapons, added together"""
+        rollup = self._rollups.get(attr)
+        if rollup is None:
+            rollup = self._rollups[attr] = Counter()
+            for player in self.players:
+                rollup.update(getattr(player, attr))
+        return rollup
 
     @property
     def total_kills(self):
@@ -166,7 +210,7 @@ class DataStore:
         return sum(p.suicides for p in self.players)
     @property
     def total_score(self):
-        return sum((p.score for p in self.players), start=PlayerScore())
+        return sum((p.score for p in self.players), start=ScoreVector())
     @property
     def total_time_played(self):
         return timedelta(seconds=sum(p.seconds_played for p in self.players))
@@ -191,11 +235,11 @@ class DataStore:
     def total_axis_deaths(self):
         return sum(p.axis_deaths for p in self.players)
     @property
-    def total_allied_score(self) -> 'PlayerScore':
-        return sum((p.allied_score for p in self.players), start=PlayerScore())
+    def total_allied_score(self) -> ScoreVector:
+        return sum((p.allied_score for p in self.players), start=ScoreVector())
     @property
-    def total_axis_score(self) -> 'PlayerScore':
-        return sum((p.axis_score for p in self.players), start=PlayerScore())
+    def total_axis_score(self) -> ScoreVector:
+        return sum((p.axis_score for p in self.players), start=ScoreVector())
     @property
     def total_allied_time_played(self):
         return timedelta(seconds=sum(p.allied_seconds_played for p in self.players))
@@ -249,14 +293,10 @@ class DataStore:
         return res
 
     def weapons_killed_with(self, *mappings, skip_unmapped=False):
-        all_weapons = dict()
-        for player in self.players:
-            all_weapons = combine_dicts(all_weapons, player.weapons)
+        all_weapons = dict(self._rollup('weapons'))
         return self.map_weapons(all_weapons, *mappings, skip_unmapped=skip_unmapped)
     def weapons_died_to(self, *mappings, skip_unmapped=False):
-        all_weapons = dict()
-        for player in self.players:
-            all_weapons = combine_dicts(all_weapons, player.causes)
+        all_weapons = dict(self._rollup('causes'))
         return self.map_weapons(all_weapons, *mappings, skip_unmapped=skip_unmapped)
     def weapons_teamkilled_with(self, *mappings, skip_unmapped=False):
         all_weapons = {
@@ -277,9 +317,7 @@ class DataStore:
         if not isinstance(other, DataStore):
             return NotImplemented
         
-        duration = self.duration + other.duration
-        players = combine_dicts({p.steam_id: p for p in self.players}, {p.steam_id: p for p in other.players})
-        return DataStore(duration, players.values())
+        return DataStore.union(self, other)
     
     def __radd__(self, other):
         return self + other
@@ -298,13 +336,13 @@ class DataStore:
             ['RANK', 'STEAMID', 'PLAYED', 'NAME', 'KILLS', 'DEATHS', 'K/D', 'TKS', 'SUIC', 'STREAK', 'WEAPON', 'VICTIM', 'NEMESIS', 'COMB', 'OFF', 'DEF', 'SUPP', 'PLAYTIME', 'K/MIN']
 
         if single_match:
-            output = "{: <5} {: <25} {: <6} {: <6} {: <5} {: <5} {: <5} {: <6} {: <27} {: <25} {: <25} {: <4} {: <4} {: <4} {: <4} {}".format(*headers)
+            lines = ["{: <5} {: <25} {: <6} {: <6} {: <5} {: <5} {: <5} {: <6} {: <27} {: <25} {: <25} {: <4} {: <4} {: <4} {: <4} {}".format(*headers)]
         else:
-            output = "{: <6} {: <13} {: <6}  {: <25} {: <6} {: <6} {: <5} {: <5} {: <5} {: <6} {: <27} {: <25} {: <25} {: <4} {: <4} {: <4} {: <4} {: <9} {}".format(*headers)
+            lines = ["{: <6} {: <13} {: <6}  {: <25} {: <6} {: <6} {: <5} {: <5} {: <5} {: <6} {: <27} {: <25} {: <25} {: <4} {: <4} {: <4} {: <4} {: <9} {}".format(*headers)]
         for i, player in enumerate(data):
-            output = output + '\n' + player.to_string(i+1, single_match)
+            lines.append(player.to_string(i+1, single_match))
         
-        return output
+        return '\n'.join(lines)
     
     def to_csv(self, single_match: bool = False):
         data = sorted(
@@ -317,22 +355,22 @@ class DataStore:
         )
     
         if single_match:
-            output = ",".join([
+            lines = [",".join([
                 'rank', 'steamid', 'name', 'kills', 'deaths', 'teamkills', 'suicides', 'top_killstreak', 'top_weapon_name',
                 'top_weapon_kills', 'top_victim_name', 'top_victim_kills', 'top_nemesis_name', 'top_nemesis_deaths', 'combat_score',
                 'offense_score', 'defense_score', 'support_score', 'seconds_played'
-            ])
+            ])]
         else:
-            output = ",".join([
+            lines = [",".join([
                 'rank', 'steamid', 'name', 'matches_played', 'kills', 'deaths', 'teamkills', 'suicides', 'top_killstreak',
                 'top_weapon_name', 'top_weapon_kills', 'top_victim_name', 'top_victim_kills', 'top_nemesis_name', 'top_nemesis_deaths',
                 'combat_score', 'offense_score', 'defense_score', 'support_score', 'seconds_played'
-            ])
+            ])]
 
         for i, player in enumerate(data):
-            output = output + '\n' + player.to_csv(i+1, single_match)
+            lines.append(player.to_csv(i+1, single_match))
         
-        return output
+        return '\n'.join(lines)
 
     def to_dict(self):
         return dict(
@@ -354,114 +392,42 @@ class MatchData(DataStore):
         DataStore.__init__(self, duration, players)
     
     @classmethod
-    def from_logs(cls, logs: List['LogLine']):
-        if not logs:
-            return cls(
-                players=[],
-                duration=timedelta()
-            )
-
-        data = dict()
-        logs_start, logs_end = sorted((logs[0].event_time, logs[-1].event_time))
-        if logs_start != logs[0].event_time: # Logs are reversed
-            logs.reverse()
-
-        match_ended = None
-        map_name = None
+    def from_logs(cls, logs: Sequence['LogRecord']):
+        """Build a match from its logs, which may be in either chronological
+        or reverse chronological order. The sequence is left untouched."""
+        builder = MatchDataBuilder()
+        if logs and logs[0].event_time > logs[-1].event_time: # Logs are reversed
+            logs = reversed(logs)
         for log in logs:
-            log_type = EventTypes(log.type)
+            builder.feed(log)
+        return builder.build()
 
-            # Look for map name
-            if log_type == EventTypes.server_map_changed:
-                map_name = mappings.parse_layer(log.new).pretty()
-                continue
-
-            elif log_type == EventTypes.server_match_started:
-                if not map_name:
-                    map_name = " ".join(mappings.get_map_and_mode(log.new))
-                continue
-
-            elif log_type == EventTypes.server_match_ended:
-                if not map_name:
-                    map_name = " ".join(mappings.get_map_and_mode(log.new))
-                match_ended = log
-                continue
+    def to_summary(self) -> dict:
+        """Returns this match without its players as a JSON serializable
+        dict, to be stored in a match summary"""
+        return dict(
+            map=self.map,
+            duration=self.duration.total_seconds(),
+            team1_score=self.team1_score,
+            team2_score=self.team2_score,
+        )
 
-            # Get or create killer and victim data
-            if log.player_steamid in data.keys():
-                killer_data = data[log.player_steamid]
-            else:
-                killer_data = PlayerData(log.player_steamid, log.player_name, logs_start, logs_end)
-                data[log.player_steamid] = killer_data
-            
-            if log.player2_steamid in data.keys():
-                victim_data = data[log.player2_steamid]
-            elif log.player2_steamid:
-                victim_data = PlayerData(log.player2_steamid, log.player2_name, logs_start, logs_end)
-                data[log.player2_steamid] = victim_data
-            else:
-                victim_data = None
-            
-            killer_faction = Faction(log.player_team) if log.player_team else Faction.Any
-            victim_faction = Faction(log.player2_team) if log.player2_team else Faction.Any
-            
-            # Get weapon
-            weapon = log.weapon
-            if weapon:
-                if weapon not in mappings.WEAPONS:
-                    logging.warn('Weapon "%s" is not mapped', weapon)
-                else:
-                    weapon = mappings.WEAPONS[weapon]
-
-            # Update player score
-            if log.player_combat_score is not None:
-                killer_data.update_score(log)
-
-            # Process event
-            if log_type == EventTypes.player_kill:
-                killer_data.update_faction(killer_faction)
-                victim_data.update_faction(victim_faction)
-                killer_data.kill(victim_data, weapon, killer_faction)
-                victim_data.death(killer_data, weapon, victim_faction)
-            
-            elif log_type == EventTypes.player_teamkill:
-                killer_data.update_faction(killer_faction)
-                victim_data.update_faction(victim_faction)
-                killer_data.teamkill(victim_data, weapon, killer_faction)
-                victim_data.death(killer_data, weapon, victim_faction)
-            
-            elif log_type == EventTypes.player_suicide:
-                killer_data.update_faction(killer_faction)
-                killer_data.suicide(killer_faction)
-
-            elif log_type == EventTypes.player_join_server:
-                killer_data.join(log.event_time)
-            elif log_type == EventTypes.player_leave_server:
-                killer_data.leave(log.event_time)
-
-            # Update player faction
-            elif log_type == EventTypes.player_switch_team:
-                if all([log.old, log.new]):
-                    killer_data.update_faction(Faction.Any)
-                elif log.new:
-                    killer_data.update_faction(Faction(log.new))
-
-        duration = logs_end - logs_start
-
-        if match_ended:
-            return cls(
-                players=data.values(),
-                duration=duration,
-                map=map_name,
-                team1_score=match_ended.message.split(' - ')[0],
-                team2_score=match_ended.message.split(' - ')[1],
-            )
-        else:
-            return cls(
-                players=data.values(),
-                duration=duration,
-                map=map_name,
-            )
+    @classmethod
+    def from_summary(cls, data: dict, players: Sequence[dict]):
+        """The opposite of `to_summary` and `PlayerData.to_summary`"""
+        restored = [PlayerData.from_summary(player) for player in players]
+        by_steam_id = {player.steam_id: player for player in restored}
+        for player, player_data in zip(restored, players):
+            player._victims = {by_steam_id[steam_id]: n for steam_id, n in player_data['victims']}
+            player._nemeses = {by_steam_id[steam_id]: n for steam_id, n in player_data['nemeses']}
+
+        return cls(
+            players=restored,
+            duration=timedelta(seconds=data['duration']),
+            map=data['map'],
+            team1_score=data['team1_score'],
+            team2_score=data['team2_score'],
+        )
 
     @property
     def winner(self):
@@ -508,6 +474,182 @@ class MatchData(DataStore):
         out.update(super().to_dict())
         return out
 
+class MatchDataBuilder:
+    """Builds a `MatchData` from logs fed to it one at a time, without
+    holding on to them. Logs must be fed in chronological order.
+
+    When the match ends is not known until its last log has been fed, so
+    the time players spent on each faction is only settled once the match
+    is built.
+    """
+    def __init__(self):
+        self.players: Dict[str, 'PlayerData'] = dict()
+        self.map_name: str = None
+        self.match_ended: 'LogRecord' = None
+        self.start: datetime = None
+        self.end: datetime = None
+        self.num_logs = 0
+
+    def feed(self, log: 'LogRecord', log_type: EventTypes = None):
+        if log_type is None:
+            log_type = EventTypes(log.type)
+
+        if self.start is None:
+            self.start = log.event_time
+        self.end = log.event_time
+        self.num_logs += 1
+
+        # Look for map name
+        if log_type == EventTypes.server_map_changed:
+            self.map_name = mappings.parse_layer(log.new).pretty()
+            return
+
+        elif log_type == EventTypes.server_match_started:
+            if not self.map_name:
+                self.map_name = " ".join(mappings.get_map_and_mode(log.new))
+            return
+
+        elif log_type == EventTypes.server_match_ended:
+            if not self.map_name:
+                self.map_name = " ".join(mappings.get_map_and_mode(log.new))
+            self.match_ended = log
+            return
+
+        data = self.players
+
+        # Get or create killer and victim data
+        killer_data = data.get(log.player_steamid)
+        if killer_data is None:
+            killer_data = PlayerData(log.player_steamid, log.player_name, self.start, None)
+            data[log.player_steamid] = killer_data
+        
+        if log.player2_steamid in data:
+            victim_data = data[log.player2_steamid]
+        elif log.player2_steamid:
+            victim_data = PlayerData(log.player2_steamid, log.player2_name, self.start, None)
+            data[log.player2_steamid] = victim_data
+        else:
+            victim_data = None
+        
+        killer_faction = Faction(log.player_team) if log.player_team else Faction.Any
+        victim_faction = Faction(log.player2_team) if log.player2_team else Faction.Any
+        
+        # Get weapon
+        weapon = log.weapon
+        if weapon:
+            if weapon not in mappings.WEAPONS:
+                logging.warn('Weapon "%s" is not mapped', weapon)
+            else:
+                weapon = mappings.WEAPONS[weapon]
+
+        # Update player score
+        if log.player_combat_score is not None:
+            killer_data.update_score(log)
+
+        # Process event
+        if log_type == EventTypes.player_kill:
+            killer_data.update_faction(killer_faction)
+            victim_data.update_faction(victim_faction)
+            killer_data.kill(victim_data, weapon, killer_faction)
+            victim_data.death(killer_data, weapon, victim_faction)
+        
+        elif log_type == EventTypes.player_teamkill:
+            killer_data.update_faction(killer_faction)
+            victim_data.update_faction(victim_faction)
+            killer_data.teamkill(victim_data, weapon, killer_faction)
+            victim_data.death(killer_data, weapon, victim_faction)
+        
+        elif log_type == EventTypes.player_suicide:
+            killer_data.update_faction(killer_faction)
+            killer_data.suicide(killer_faction)
+
+        elif log_type == EventTypes.player_join_server:
+            killer_data.join(log.event_time)
+        elif log_type == EventTypes.player_leave_server:
+            killer_data.leave(log.event_time)
+
+        # Update player faction
+        elif log_type == EventTypes.player_switch_team:
+            if all([log.old, log.new]):
+                killer_data.update_faction(Faction.Any)
+            elif log.new:
+                killer_data.update_faction(Faction(log.new))
+
+    def snapshot(self):
+        """Build the match as it currently stands, while more logs can
+        still be fed afterwards"""
+        builder = copy.copy(self)
+        builder.players = {steamid: player._copy() for steamid, player in self.players.items()}
+        for player in builder.players.values():
+            player._victims = {builder.players[p.steam_id]: n for p, n in player._victims.items()}
+            player._nemeses = {builder.players[p.steam_id]: n for p, n in player._nemeses.items()}
+        return builder.build()
+
+    def build(self):
+        if not self.num_logs:
+            return MatchData(
+                players=[],
+                duration=timedelta()
+            )
+
+        for player in self.players.values():
+            player.settle_playtime(self.end)
+
+        duration = self.end - self.start
+
+        if self.match_ended:
+            return MatchData(
+                players=self.players.values(),
+                duration=duration,
+                map=self.map_name,
+                team1_score=self.match_ended.message.split(' - ')[0],
+                team2_score=self.match_ended.message.split(' - ')[1],
+            )
+        else:
+            return MatchData(
+                players=self.players.values(),
+                duration=duration,
+                map=self.map_name,
+            )
+
+class MatchGroupBuilder:
+    """Builds a `MatchGroup` from logs fed to it one at a time, splitting
+    them on each match start. Logs must be fed in chronological order.
+
+    A match is only built once the next one starts, since logs following
+    the end of a match, like players leaving, still belong to it. Until
+    then, `snapshot` builds a copy of the ongoing match, which is reused
+    until more logs are fed.
+    """
+    def __init__(self):
+        self.matches: List['MatchData'] = list()
+        self.current = MatchDataBuilder()
+        self._snapshot: Union['MatchData', None] = None
+
+    def feed(self, log: 'LogRecord'):
+        try:
+            log_type = EventTypes(log.type)
+        except ValueError:
+            return
+
+        if log_type == EventTypes.server_match_started:
+            if self.current.num_logs:
+                self.matches.append(self.current.build())
+                self.current = MatchDataBuilder()
+
+        self.current.feed(log, log_type)
+        self._snapshot = None
+
+    def snapshot(self):
+        """Returns the matches fed so far, without preventing more logs
+        from being fed"""
+        if self._snapshot is None:
+            self._snapshot = self.current.snapshot()
+        return MatchGroup(self.matches + [self._snapshot])
+
+    def build(self):
+        return MatchGroup(self.matches + [self.current.build()])
+
 class PlayerData:
     def __init__(self, steam_id: str, name: str, match_start: datetime, match_end: datetime):
         self.steam_id: str = steam_id
@@ -530,10 +672,10 @@ class PlayerData:
         self.deathstreak: int = 0
         self._victims: Dict[str, int] = {}
         self._nemeses: Dict[str, int] = {}
-        self._last_seen_score: PlayerScore = PlayerScore()
-        self.allied_score: PlayerScore = PlayerScore()
-        self.axis_score: PlayerScore = PlayerScore()
-        self.score: PlayerScore = PlayerScore()
+        self._last_seen_score: ScoreVector = ScoreVector()
+        self.allied_score: ScoreVector = ScoreVector()
+        self.axis_score: ScoreVector = ScoreVector()
+        self.score: ScoreVector = ScoreVector()
         self._seconds_played: int = 0
         self._last_seen_playtime: int = 0
         self._sess_start: datetime = match_start
@@ -541,38 +683,114 @@ class PlayerData:
         self.allied_seconds_played: int = 0
         self.axis_seconds_played: int = 0
         self.num_matches_played: int = 1
+        # While the end of the match is unknown, the time played on a
+        # faction is settled later, from these (faction, seconds played,
+        # session start) marks
+        self._playtime_marks: List[Tuple[Faction, float, datetime]] = []
     
     def __add__(self, other):
         if not isinstance(other, PlayerData):
             return NotImplemented
-        
-        res = PlayerData(self.steam_id, self.name, None, self._match_end)
-
-        for attr in ('kills', 'deaths', 'allied_kills', 'axis_kills', 'allied_deaths',
-                     'axis_deaths', 'teamkills', 'suicides', 'allied_score', 'axis_score',
-                     'score', 'allied_seconds_played', 'axis_seconds_played', 'num_matches_played'):
-            res.__setattr__(attr, self.__getattribute__(attr) + other.__getattribute__(attr))
-        
-        for attr in ('weapons', 'causes'):
-            _new_attr = combine_dicts(self.__getattribute__(attr), other.__getattribute__(attr))
-            res.__setattr__(attr, _new_attr if _new_attr else {'None': 0})
-        
-        for attr in ('_victims', '_nemeses'):
-            _new_attr = combine_dicts(self.__getattribute__(attr), other.__getattribute__(attr))
-            res.__setattr__(attr, _new_attr if _new_attr is not None else {})
-        
-        res._seconds_played = self.seconds_played + other.seconds_played
-        res.killstreak = max(self.killstreak, other.killstreak)
-        res.deathstreak = max(self.deathstreak, other.deathstreak)
-        res.names = combine_dicts(self.names, other.names)
+        return PlayerData.union(self, other)
 
-        res.faction = self.faction
-        res.update_faction(other.faction)
-        
+    @classmethod
+    def union(cls, *players: 'PlayerData'):
+        """Add up the stats of the same player across several matches.
+        Gives the same result as adding them together one by one, but
+        without building a new player for every addition."""
+        first = players[0]
+        res = cls(first.steam_id, first.name, None, first._match_end)
+        res.names = dict()
+        res.weapons = dict()
+        res.causes = dict()
+        res.num_matches_played = 0
+        res.faction = first.faction
+
+        for player in players:
+            for attr in ('kills', 'deaths', 'allied_kills', 'axis_kills', 'allied_deaths',
+                         'axis_deaths', 'teamkills', 'suicides', 'allied_score', 'axis_score',
+                         'score', 'allied_seconds_played', 'axis_seconds_played', 'num_matches_played'):
+                setattr(res, attr, getattr(res, attr) + getattr(player, attr))
+
+            for attr in ('names', 'weapons', 'causes', '_victims', '_nemeses'):
+                counts = getattr(res, attr)
+                for key, value in getattr(player, attr).items():
+                    counts[key] = counts.get(key, 0) + value
+
+            res._seconds_played += player.seconds_played
+            res.killstreak = max(res.killstreak, player.killstreak)
+            res.deathstreak = max(res.deathstreak, player.deathstreak)
+
+            if player is not first:
+                if res.faction is None:
+                    res.faction = player.faction
+                elif res.faction != Faction.Any and res.faction != player.faction:
+                    res.faction = Faction.Any
+
+        if not res.weapons:
+            res.weapons = {'None': 0}
+        if not res.causes:
+            res.causes = {'None': 0}
         return res
 
     def __radd__(self, other):
         return self + other
+
+    def to_summary(self) -> dict:
+        """Returns the final stats of this player as a JSON serializable
+        dict, to be stored in a match summary. Victims and nemeses are
+        referred to by their Steam ID."""
+        return dict(
+            steam_id=self.steam_id,
+            names=self.names,
+            faction=self.faction.value if self.faction else None,
+            kills=self.kills,
+            deaths=self.deaths,
+            allied_kills=self.allied_kills,
+            axis_kills=self.axis_kills,
+            allied_deaths=self.allied_deaths,
+            axis_deaths=self.axis_deaths,
+            weapons=self.weapons,
+            causes=self.causes,
+            teamkills=self.teamkills,
+            suicides=self.suicides,
+            killstreak=self.killstreak,
+            deathstreak=self.deathstreak,
+            victims=[[p.steam_id, n] for p, n in self._victims.items()],
+            nemeses=[[p.steam_id, n] for p, n in self._nemeses.items()],
+            allied_score=self.allied_score.dict(),
+            axis_score=self.axis_score.dict(),
+            score=self.score.dict(),
+            seconds_played=self.seconds_played,
+            allied_seconds_played=self.allied_seconds_played,
+            axis_seconds_played=self.axis_seconds_played,
+        )
+
+    @classmethod
+    def from_summary(cls, data: dict):
+        """The opposite of `to_summary`. Victims and nemeses still need to
+        be linked to the other players of the match afterwards."""
+        res = cls(data['steam_id'], None, None, None)
+        res.names = data['names']
+        res.faction = Faction(data['faction']) if data['faction'] else None
+        for attr in ('kills', 'deaths', 'allied_kills', 'axis_kills', 'allied_deaths', 'axis_deaths', 'weapons',
+                     'causes', 'teamkills', 'suicides', 'killstreak', 'deathstreak', 'allied_seconds_played',
+                     'axis_seconds_played'):
+            setattr(res, attr, data[attr])
+        for attr in ('allied_score', 'axis_score', 'score'):
+            setattr(res, attr, ScoreVector(**data[attr]))
+        res._seconds_played = data['seconds_played']
+        return res
+
+    def _copy(self):
+        res = copy.copy(self)
+        for attr in ('names', 'weapons', 'causes', '_victims', '_nemeses'):
+            setattr(res, attr, dict(getattr(self, attr)))
+        # Scores are added to in place
+        for attr in ('allied_score', 'axis_score', 'score'):
+            setattr(res, attr, getattr(self, attr).copy())
+        res._playtime_marks = list(self._playtime_marks)
+        return res
     
     def __hash__(self):
         return hash(self.steam_id)
@@ -589,28 +807,46 @@ class PlayerData:
         
         if faction != Faction.Any:
 
-            if self._faction == Faction.Allies:
-                self.allied_seconds_played += self.seconds_played - self._last_seen_playtime
-                self._last_seen_playtime = self.seconds_played
-            
-            elif self._faction == Faction.Axis:
-                self.axis_seconds_played += self.seconds_played - self._last_seen_playtime
-                self._last_seen_playtime = self.seconds_played
+            if self._faction in (Faction.Allies, Faction.Axis):
+                if self._match_end is None:
+                    # Marks only differ once the player joins or leaves
+                    mark = (self._seconds_played, self._sess_start)
+                    if not self._playtime_marks or self._playtime_marks[-1][1:] != mark:
+                        self._playtime_marks.append((self._faction,) + mark)
+                else:
+                    self._add_playtime(self._faction, self.seconds_played)
             
             self._faction = faction
         
         return self.faction
+
+    def _add_playtime(self, faction: Faction, seconds_played: int):
+        if faction == Faction.Allies:
+            self.allied_seconds_played += seconds_played - self._last_seen_playtime
+        elif faction == Faction.Axis:
+            self.axis_seconds_played += seconds_played - self._last_seen_playtime
+        self._last_seen_playtime = seconds_played
+
+    def settle_playtime(self, match_end: datetime):
+        """Set when the match ended and settle the time played on each
+        faction up until then"""
+        self._match_end = match_end
+        for faction, seconds_played, sess_start in self._playtime_marks:
+            if sess_start:
+                seconds_played += (match_end - sess_start).total_seconds()
+            self._add_playtime(faction, int(seconds_played))
+        self._playtime_marks.clear()
     
-    def update_score(self, log: 'LogLine'):
+    def update_score(self, log: 'LogRecord'):
         faction = self._faction
         if faction == Faction.Any and log.player_team:
             faction = Faction(log.player_team)
 
-        score = PlayerScore(
-            combat=log.player_combat_score,
-            offense=log.player_offense_score,
-            defense=log.player_defense_score,
-            support=log.player_support_score
+        score = ScoreVector(
+            log.player_combat_score,
+            log.player_offense_score,
+            log.player_defense_score,
+            log.player_support_score
         )
         score_diff = score - self._last_seen_score
 
@@ -695,7 +931,7 @@ class PlayerData:
         else:
             self._seconds_played += (time - self._sess_start).total_seconds()
         self._sess_start = None
-        self._last_seen_score = PlayerScore()
+        self._last_seen_score = ScoreVector()
     
     @property
     def name(self):
@@ -730,10 +966,12 @@ class PlayerData:
         return max(self.causes, key=self.causes.get)
     @property
     def victim(self):
-        return max(self.victims, key=self.victims.get)
+        victims = self.victims
+        return max(victims, key=victims.get)
     @property
     def nemesis(self):
-        return max(self.nemeses, key=self.nemeses.get)
+        nemeses = self.nemeses
+        return max(nemeses, key=nemeses.get)
 
     @property
     def seconds_played(self):
@@ -753,8 +991,10 @@ class PlayerData:
         weapon = self.weapon
         weapon = mappings.VEHICLE_WEAPONS_FACTIONLESS.get(weapon, mappings.FACTIONLESS.get(weapon, weapon))
         weapons = DataStore.map_weapons(self.weapons, mappings.VEHICLE_WEAPONS_FACTIONLESS, mappings.FACTIONLESS)
-        victim = self.victim
-        nemesis = self.nemesis
+        victims = self.victims
+        victim = max(victims, key=victims.get)
+        nemeses = self.nemeses
+        nemesis = max(nemeses, key=nemeses.get)
         playtime = self.seconds_played
         seconds = playtime % 60
         minutes = int(playtime / 60) % 60
@@ -770,8 +1010,8 @@ class PlayerData:
                 self.suicides,
                 self.killstreak,
                 f"{weapon}({weapons[weapon]})",
-                f"{victim}({self.victims[victim]})",
-                f"{nemesis}({self.nemeses[nemesis]})",
+                f"{victim}({victims[victim]})",
+                f"{nemesis}({nemeses[nemesis]})",
                 self.score.combat,
                 self.score.offense,
                 self.score.defense,
@@ -791,8 +1031,8 @@ class PlayerData:
                 self.suicides,
                 self.killstreak,
                 f"{weapon}({weapons[weapon]})",
-                f"{victim}({self.victims[victim]})",
-                f"{nemesis}({self.nemeses[nemesis]})",
+                f"{victim}({victims[victim]})",
+                f"{nemesis}({nemeses[nemesis]})",
                 self.score.combat,
                 self.score.offense,
                 self.score.defense,
@@ -805,8 +1045,10 @@ class PlayerData:
         weapon = self.weapon
         weapon = mappings.VEHICLE_WEAPONS_FACTIONLESS.get(weapon, mappings.FACTIONLESS.get(weapon, weapon))
         weapons = DataStore.map_weapons(self.weapons, mappings.VEHICLE_WEAPONS_FACTIONLESS, mappings.FACTIONLESS)
-        victim = self.victim
-        nemesis = self.nemesis
+        victims = self.victims
+        victim = max(victims, key=victims.get)
+        nemeses = self.nemeses
+        nemesis = max(nemeses, key=nemeses.get)
 
         if single_match:
             values = (
@@ -821,9 +1063,9 @@ class PlayerData:
                 weapon,
                 weapons[weapon],
                 victim,
-                self.victims[victim],
+                victims[victim],
                 nemesis,
-                self.nemeses[nemesis],
+                nemeses[nemesis],
                 self.score.combat,
                 self.score.offense,
                 self.score.defense,
@@ -844,9 +1086,9 @@ class PlayerData:
                 weapon,
                 weapons[weapon],
                 victim,
-                self.victims[victim],
+                victims[victim],
                 nemesis,
-                self.nemeses[nemesis],
+                nemeses[nemesis],
                 self.score.combat,
                 self.score.offense,
                 self.score.defense,
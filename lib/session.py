@@ -2,44 +2,136 @@ import asyncio
 from datetime import datetime, timedelta, timezone
 from discord.ext import tasks
 from pypika import Query, Table, Column
-from typing import Union, Dict, Tuple, Sequence
+from typing import Union, Dict, List, Tuple, Sequence, Iterator
+import bisect
+import logging
 import re
 
-from lib.rcon import HLLRcon
+from lib import profiling, scorepool
+from lib.poller import ServerPoller, IterationHealth, get_poller, SECONDS_BETWEEN_ITERATIONS, MAX_SECONDS_BETWEEN_ITERATIONS
 from lib.credentials import Credentials
-from lib.storage import LogLine, database, cursor, insert_many_logs, delete_logs
+from lib.journal import LogJournal
+from lib.expiry import expiry_worker
+from lib.exportcache import EXPORT_CACHE
+from lib.storage import (LogRecord, LogStorageFormat, database, cursor, create_logs_table, insert_many_logs, select_logs, iter_logs, migrate_logs,
+    get_logs_version, count_logs, prepare_migration, apply_migration, encode_logs,
+    get_journal_seq, set_journal_seq)
 from lib.exceptions import NotFound, SessionDeletedError, SessionAlreadyRunningError, SessionMissingCredentialsError
+from lib.scores import MatchGroup, MatchGroupBuilder
+from lib.summaries import (SessionSummary, RANGE_FLAGS, RANGE_FIELDS, get_all_ranges, build_summary, load_summary, summary_to_rows,
+    insert_summary_rows)
 from lib.modifiers import ModifierFlags, Modifier, INTERNAL_MODIFIERS
 from lib.info.models import EventFlags, EventModel, ActivationEvent, IterationEvent, DeactivationEvent, InfoHopper, PrivateEventModel
 from lib.info.events import EventListener
 from utils import get_config, schedule_coro, get_logger
 
-SECONDS_BETWEEN_ITERATIONS = get_config().getint('Session', 'SecondsBetweenIterations')
 NUM_LOGS_REQUIRED_FOR_INSERT = get_config().getint('Session', 'NumLogsRequiredForInsert')
+SECONDS_BETWEEN_JOURNAL_SYNCS = get_config().getint('Session', 'SecondsBetweenJournalSyncs', fallback=30)
 DELETE_SESSION_AFTER = timedelta(days=get_config().getint('Session', 'DeleteAfterDays'))
+ARCHIVE_SESSION_AFTER = timedelta(hours=get_config().getint('Session', 'ArchiveAfterHours', fallback=24))
 KICK_INCOMPATIBLE_NAMES = get_config().getboolean('Session', 'KickIncompatibleNames')
+LOG_STORAGE_FORMAT = LogStorageFormat[get_config().get('Session', 'LogStorageFormat', fallback='partitioned')]
 
 MAX_AUTOSESSION_DURATION_MINUTES = get_config().getint('AutoSession', 'MaxDurationInMinutes')
 MIN_PLAYERS_UNTIL_AUTOSESSION_STOP = get_config().getint('AutoSession', 'MinPlayersUntilStop')
-MIN_PLAYERS_ITERATIONS_UNTIL_STOP = 10
+# How long too few players need to be online before an auto-session is
+# stopped. Iterations are spaced further apart while the server is quiet,
+# so this is measured in time rather than iterations.
+LOW_PLAYERS_DURATION_UNTIL_STOP = timedelta(seconds=SECONDS_BETWEEN_ITERATIONS * 10)
+
+# How many updates may wait for a session to process them, after which
+# the oldest ones are dropped
+MAX_QUEUED_UPDATES = 60
+# How long a session waits for an update before checking on its poller
+SECONDS_UNTIL_UPDATE_TIMEOUT = MAX_SECONDS_BETWEEN_ITERATIONS * 3
+# Put on the queue of a session to wake it up when it is being stopped
+_STOP_UPDATES = object()
 
 SESSIONS: Dict[int, 'HLLCaptureSession'] = dict()
 
+class _SessionIndex:
+    """A list of sessions kept sorted by their start time"""
+    __slots__ = ('keys', 'sessions')
+
+    def __init__(self):
+        self.keys: List[Tuple[datetime, int]] = list()
+        self.sessions: List['HLLCaptureSession'] = list()
+
+    def add(self, key: Tuple[datetime, int], session: 'HLLCaptureSession'):
+        i = bisect.bisect(self.keys, key)
+        self.keys.insert(i, key)
+        self.sessions.insert(i, session)
+
+    def remove(self, key: Tuple[datetime, int]):
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            del self.keys[i]
+            del self.sessions[i]
+
+_SESSIONS_BY_GUILD: Dict[int, _SessionIndex] = dict()
+_SESSIONS_BY_CREDENTIALS: Dict[int, _SessionIndex] = dict()
+# The sessions that are currently active for each set of credentials, by
+# their ID in the order they were activated in. Normally there is only one.
+_ACTIVE_SESSIONS: Dict[int, Dict[int, 'HLLCaptureSession']] = dict()
+
 def get_sessions(guild_id: int):
-    return sorted([sess for sess in SESSIONS.values() if sess.guild_id == guild_id], key=lambda sess: sess.start_time)
+    """Returns all sessions of a guild, ordered by their start time"""
+    index = _SESSIONS_BY_GUILD.get(guild_id)
+    return list(index.sessions) if index else list()
+
+def get_sessions_by_credentials(credentials_id: int):
+    """Returns all sessions using a set of credentials, ordered by their
+    start time"""
+    index = _SESSIONS_BY_CREDENTIALS.get(credentials_id)
+    return list(index.sessions) if index else list()
+
+def get_active_session(credentials_id: int):
+    """Returns the session that is currently active for a set of
+    credentials, if any"""
+    sessions = _ACTIVE_SESSIONS.get(credentials_id)
+    if sessions:
+        # Prefer the session that was activated last
+        for session in reversed(list(sessions.values())):
+            if session.active_in() is True:
+                return session
+    return None
+
+def _get_other_active_autosession(session: 'HLLCaptureSession'):
+    """Returns an auto-session other than the given session that is
+    currently active for the same credentials, if any"""
+    sessions = _ACTIVE_SESSIONS.get(session.credentials.id)
+    if sessions:
+        for other in reversed(list(sessions.values())):
+            if other is not session and other.is_auto_session and other.active_in() is True:
+                return other
+    return None
+
+def _set_active(session: 'HLLCaptureSession', credentials_id: int):
+    _ACTIVE_SESSIONS.setdefault(credentials_id, dict())[session.id] = session
+
+def _unset_active(session: 'HLLCaptureSession', credentials_id: int):
+    sessions = _ACTIVE_SESSIONS.get(credentials_id)
+    if sessions and sessions.get(session.id) is session:
+        del sessions[session.id]
+        if not sessions:
+            del _ACTIVE_SESSIONS[credentials_id]
 
 class HLLCaptureSession:
     def __init__(self, id: int, guild_id: int, name: str, start_time: datetime, end_time: Union[datetime, None],
-            credentials: Credentials, modifiers: ModifierFlags = ModifierFlags(), loop: asyncio.AbstractEventLoop = None):
+            credentials: Credentials, modifiers: ModifierFlags = ModifierFlags(), log_format: LogStorageFormat = LogStorageFormat.plain,
+            loop: asyncio.AbstractEventLoop = None):
         self.id = id
         self.guild_id = guild_id
         self.name = name
         self.start_time = start_time
         self.end_time = end_time
         self.credentials = credentials
+        self.log_format = LogStorageFormat(log_format)
         self.loop = loop or asyncio.get_running_loop()
         self._logs = list()
-        self._session_expiration_count = 0
+        self._num_logs_journaled = 0
+        self._low_players_since: Union[datetime, None] = None
+        self._deleted = False
 
         if not self.end_time:
             self.is_auto_session = True
@@ -50,16 +142,23 @@ class HLLCaptureSession:
         if self.id in SESSIONS:
             raise SessionAlreadyRunningError("A session with ID %s is already running")
 
-        self.logger = get_logger(self)
+        self._logger = None
+        self.journal = LogJournal.for_session(self, sync_interval=SECONDS_BETWEEN_JOURNAL_SYNCS)
 
-        self.rcon = None
+        self.poller: Union[ServerPoller, None] = None
         self.info = None
+        self._updates = None
+        self.health = IterationHealth()
+        # Only kept while every log of the session has passed through it
+        self.scoreboard: Union[MatchGroupBuilder, None] = None
 
         self.modifiers = [modifier(self) for modifier in INTERNAL_MODIFIERS] + [modifier(self) for modifier in modifiers.get_modifier_types()]
         self.modifier_flags = modifiers.copy()
-        self.logger.info("Installed modifiers: %s", ", ".join([modifier.config.name for modifier in self.modifiers]))
         
+        # Sessions that have already ended do not need to be scheduled,
+        # nor a logger until something is logged.
         if self.active_in():
+            self.logger.info("Installed modifiers: %s", ", ".join([modifier.config.name for modifier in self.modifiers]))
             self._start_task = schedule_coro(self.start_time, self.activate, error_logger=self.logger)
             self._stop_task = schedule_coro(self.end_time, self.deactivate, error_logger=self.logger)
         else:
@@ -71,10 +170,12 @@ class HLLCaptureSession:
         self.sent_helo_prompt_indices = list()
 
         SESSIONS[self.id] = self
+        self._index_key = None
+        self._index()
         
     @classmethod
     def load_from_db(cls, id: int):
-        cursor.execute('SELECT ROWID, guild_id, name, start_time, end_time, deleted, credentials_id, modifiers FROM sessions WHERE ROWID = ?', (id,))
+        cursor.execute('SELECT ROWID, guild_id, name, start_time, end_time, deleted, credentials_id, modifiers, log_format FROM sessions WHERE ROWID = ?', (id,))
         res = cursor.fetchone()
 
         if not res:
@@ -93,6 +194,36 @@ class HLLCaptureSession:
             except NotFound:
                 credentials = None
 
+        return cls._from_row(res[:5] + res[7:], credentials)
+
+    @classmethod
+    def load_all_from_db(cls):
+        """Load all sessions that have not been deleted, along with their
+        credentials. Sessions that are already loaded are skipped.
+
+        Unlike calling `load_from_db` for every session, this only needs
+        one query for all sessions and one for all credentials.
+
+        Returns
+        -------
+        List[HLLCaptureSession]
+            The sessions that were loaded
+        """
+        credentials = Credentials.load_all_from_db()
+
+        cursor.execute('SELECT ROWID, guild_id, name, start_time, end_time, modifiers, log_format, credentials_id FROM sessions WHERE deleted = 0')
+        sessions = list()
+        for res in cursor.fetchall():
+            if res[0] in SESSIONS:
+                continue
+            try:
+                sessions.append(cls._from_row(res[:7], credentials.get(res[7])))
+            except:
+                logging.exception('Failed to load session %s', res[0])
+        return sessions
+
+    @classmethod
+    def _from_row(cls, res: tuple, credentials: Union[Credentials, None]):
         return cls(
             id=int(res[0]),
             guild_id=int(res[1]),
@@ -100,7 +231,8 @@ class HLLCaptureSession:
             start_time=datetime.fromisoformat(res[3]),
             end_time=datetime.fromisoformat(res[4]) if res[4] else None,
             credentials=credentials,
-            modifiers=ModifierFlags(int(res[7]))
+            modifiers=ModifierFlags(int(res[5])),
+            log_format=LogStorageFormat(int(res[6])),
         )
     
     @classmethod
@@ -108,13 +240,13 @@ class HLLCaptureSession:
         if end_time is not None and datetime.now(tz=timezone.utc) > end_time:
             raise ValueError('This capture session would have already ended')
 
-        cursor.execute('INSERT INTO sessions (guild_id, name, start_time, end_time, credentials_id, modifiers) VALUES (?,?,?,?,?,?)',
-            (guild_id, name, start_time, end_time, credentials.id, modifiers.value))
+        log_format = LOG_STORAGE_FORMAT
+        cursor.execute('INSERT INTO sessions (guild_id, name, start_time, end_time, credentials_id, modifiers, log_format) VALUES (?,?,?,?,?,?,?)',
+            (guild_id, name, start_time, end_time, credentials.id, modifiers.value, log_format.value))
         id_ = cursor.lastrowid
 
         # Create the table if needed
-        sess_name = f"session{id_}"
-        cursor.execute(LogLine._get_create_query(sess_name))
+        create_logs_table(id_, log_format)
         database.commit()
 
         self = cls(
@@ -124,11 +256,22 @@ class HLLCaptureSession:
             start_time=start_time,
             end_time=end_time,
             credentials=credentials,
-            modifiers=modifiers
+            modifiers=modifiers,
+            log_format=log_format,
         )
         self.logger.info("Created new session: %s", self)
         return self
 
+    @property
+    def logger(self):
+        if self._logger is None:
+            self._logger = get_logger(self)
+        return self._logger
+
+    @property
+    def profile_name(self):
+        return f"session {self.id}"
+
     @property
     def duration(self):
         return self.end_time - self.start_time
@@ -154,6 +297,31 @@ class HLLCaptureSession:
              self.modifier_flags.value, self.id))
         database.commit()
 
+    def _index(self):
+        """Add the session to the indexes used by `get_sessions`,
+        `get_sessions_by_credentials` and `get_active_session`. Has to
+        be called again whenever its start time or credentials change."""
+        self._unindex()
+
+        credentials_id = self.credentials.id if self.credentials else None
+        key = (self.start_time, self.id)
+        _SESSIONS_BY_GUILD.setdefault(self.guild_id, _SessionIndex()).add(key, self)
+        if credentials_id is not None:
+            _SESSIONS_BY_CREDENTIALS.setdefault(credentials_id, _SessionIndex()).add(key, self)
+            if self.active_in() is True:
+                _set_active(self, credentials_id)
+        self._index_key = (key, credentials_id)
+
+    def _unindex(self):
+        if self._index_key is None:
+            return
+        key, credentials_id = self._index_key
+        _SESSIONS_BY_GUILD[self.guild_id].remove(key)
+        if credentials_id is not None:
+            _SESSIONS_BY_CREDENTIALS[credentials_id].remove(key)
+            _unset_active(self, credentials_id)
+        self._index_key = None
+
     def active_in(self) -> Union[timedelta, bool]:
         """Returns how long until the session should start. Otherwise
         returns whether the session should currently be active or not.
@@ -175,23 +343,36 @@ class HLLCaptureSession:
     def should_delete(self):
         return datetime.now(tz=timezone.utc) > (self.end_time + DELETE_SESSION_AFTER)
 
+    def should_archive(self):
+        if not ARCHIVE_SESSION_AFTER or self.log_format == LogStorageFormat.archived:
+            return False
+        if self.gatherer.is_running():
+            return False
+        return datetime.now(tz=timezone.utc) > (self.end_time + ARCHIVE_SESSION_AFTER)
+
     async def activate(self):
         if not self.credentials:
             raise SessionMissingCredentialsError(f"Session with ID {self.id} does not have server credentials")
         
-        autosession = next((
-            session for session in get_sessions(self.credentials.guild_id)
-            if session.credentials == self.credentials and session != self and session.is_auto_session
-        ), None)
+        # Sessions are indexed as active as soon as their start time has
+        # passed, so this session may already be the active one
+        autosession = _get_other_active_autosession(self)
         if autosession:
             autosession.credentials.autosession.logger.info("Disabling active session since a manual session was started")
             await autosession.stop()
 
-        if self.rcon is None:
-            self.rcon = HLLRcon(session=self)
+        _set_active(self, self.credentials.id)
         self.gatherer.start()
     async def deactivate(self):
+        if self.credentials:
+            _unset_active(self, self.credentials.id)
         self.gatherer.stop()
+        if self._updates is not None and self.gatherer.is_running():
+            # Don't wait for the next update to stop
+            try:
+                self._updates.put_nowait(_STOP_UPDATES)
+            except asyncio.QueueFull:
+                pass
         # self.push_to_db()   This is handled by the gather after_loop
 
     async def stop(self):
@@ -205,64 +386,114 @@ class HLLCaptureSession:
             self.save()
         else:
             self.start_time = self.end_time = datetime.now(tz=timezone.utc)
+            self._index()
             self.save()
         
         await self.deactivate()
         self._clear_tasks()
 
-    @tasks.loop(seconds=SECONDS_BETWEEN_ITERATIONS)
+    @property
+    def rcon(self):
+        return self.poller.rcon if self.poller else None
+
+    def _subscribe_to_poller(self):
+        poller = get_poller(self.credentials)
+        if self.poller and self.poller is not poller:
+            self.poller.unsubscribe(self)
+        self.poller = poller
+        # Subscribe again even to the same poller, since the queue is
+        # replaced every time the session starts
+        poller.subscribe(self, self._updates)
+
+    # The pace is set by the poller, which hands over a new update
+    # every iteration
+    @tasks.loop()
     async def gatherer(self):
-        info = await self.rcon.update()
+        try:
+            info = await asyncio.wait_for(self._updates.get(), timeout=SECONDS_UNTIL_UPDATE_TIMEOUT)
+        except asyncio.TimeoutError:
+            if self.poller and not self.poller.poll.is_running():
+                self.logger.warning('Poller for %s stopped unexpectedly, restarting it', self.poller)
+                self.poller.poll.start()
+            else:
+                self.logger.warning('Received no update for %s seconds', SECONDS_UNTIL_UPDATE_TIMEOUT)
+            return
+        if info is _STOP_UPDATES:
+            return
 
         if info:
-            if self.info:
-                info.compare_older(self.info, event_time=self.rcon._logs_seen_time)
-
             self.info = info
             
             events = list(info.events.flatten())
             events.insert(0, IterationEvent(info))
-            for event in events:
-                if not isinstance(event, PrivateEventModel):
-                    try:
-                        log = LogLine.from_event(event)
-                        # print(event.to_dict(exclude_unset=True))
-                    except:
-                        self.logger.exception('Failed to cast event to log line: %s %s' % (type(event).__name__, event.to_dict(exclude_unset=True)))
-                    else:
-                        self._logs.append(log)
-                
-                for modifier in self.modifiers:
-                    for listener in modifier.get_listeners_for_event(event):
-                        asyncio.create_task(listener.invoke(modifier, event))
+            with profiling.measure(self.profile_name, 'convert'):
+                logs = list()
+                for event in events:
+                    if not isinstance(event, PrivateEventModel):
+                        try:
+                            log = LogRecord.from_event(event, validate=True)
+                            # print(event.to_dict(exclude_unset=True))
+                        except:
+                            self.logger.exception('Failed to cast event to log line: %s %s' % (type(event).__name__, event.to_dict(exclude_unset=True)))
+                        else:
+                            logs.append(log)
+
+                # Events come grouped by type, but logs are stored and read
+                # back ordered by time. Feed them to the scoreboard in the
+                # same order, so that it matches one built from the logs.
+                logs.sort(key=lambda l: l.event_time)
+                self._logs.extend(logs)
+                for log in logs:
+                    if not self.scoreboard:
+                        break
+                    self._update_scoreboard(log)
+
+            # Listeners only run once this iteration yields, so dispatching
+            # them after all events were converted does not change their order
+            with profiling.measure(self.profile_name, 'dispatch'):
+                for event in events:
+                    for modifier in self.modifiers:
+                        for listener in modifier.get_listeners_for_event(event):
+                            asyncio.create_task(listener.invoke(modifier, event))
                 
             if len(self._logs) > NUM_LOGS_REQUIRED_FOR_INSERT:
-                self.push_to_db()
+                with profiling.measure(self.profile_name, 'push'):
+                    self.push_to_db()
+            else:
+                with profiling.measure(self.profile_name, 'journal'):
+                    self.write_to_journal()
         
         if self.is_auto_session:
             playercount = len(info.get('players', [])) if info else 0
+            now = datetime.now(tz=timezone.utc)
             if playercount < MIN_PLAYERS_UNTIL_AUTOSESSION_STOP:
-                self._session_expiration_count += 1
-                self.credentials.autosession.logger.info("%s/%s players online, session will expire after %s more iterations",
-                    playercount, MIN_PLAYERS_UNTIL_AUTOSESSION_STOP, MIN_PLAYERS_ITERATIONS_UNTIL_STOP - self._session_expiration_count)
+                if self._low_players_since is None:
+                    self._low_players_since = now
+                remaining = LOW_PLAYERS_DURATION_UNTIL_STOP - (now - self._low_players_since)
+                self.credentials.autosession.logger.info("%s/%s players online, session will expire in %s seconds",
+                    playercount, MIN_PLAYERS_UNTIL_AUTOSESSION_STOP, max(0, round(remaining.total_seconds())))
             else:
-                if self._session_expiration_count != 0:
+                if self._low_players_since is not None:
                     self.credentials.autosession.logger.info("%s/%s players online, session expiration has been cancelled",
                         playercount, MIN_PLAYERS_UNTIL_AUTOSESSION_STOP)
-                self._session_expiration_count = 0
+                self._low_players_since = None
             
-            if self._session_expiration_count >= MIN_PLAYERS_ITERATIONS_UNTIL_STOP:
+            if self._low_players_since is not None and now - self._low_players_since >= LOW_PLAYERS_DURATION_UNTIL_STOP:
                 self.logger.info("The session has expired and will be stopped")
                 await self.stop()
 
     @gatherer.before_loop
     async def before_gatherer_start(self):
-        try:
-            await self.rcon.start(force=False)
-        except Exception:
-            self.logger.exception('Failed to start RCON')
+        self._updates = asyncio.Queue(maxsize=MAX_QUEUED_UPDATES)
+        self.health = IterationHealth()
+        self._subscribe_to_poller()
         
-        self._session_expiration_count = 0
+        self._low_players_since = None
+
+        # Sessions that already have logs, for instance because the bot
+        # restarted halfway through, rebuild their scoreboard when exported
+        if self.scoreboard is None and not self._logs and not self.has_logs():
+            self.scoreboard = MatchGroupBuilder()
 
         event = ActivationEvent(InfoHopper())
         await self.invoke_event(event)
@@ -272,11 +503,67 @@ class HLLCaptureSession:
         event = DeactivationEvent(self.info)
         await self.invoke_event(event)
 
-        try:
-            await self.rcon.stop(force=True)
-        except Exception:
-            self.logger.exception('Failed to stop RCON')
+        if self.poller:
+            self.poller.unsubscribe(self)
+        self.logger.info('Iterations: %s', self.health)
         self.push_to_db()
+        self.journal.close()
+
+    def _update_scoreboard(self, log: LogRecord):
+        try:
+            self.scoreboard.feed(log)
+        except:
+            self.logger.exception('Failed to update scoreboard, it will be rebuilt from the logs instead')
+            self.scoreboard = None
+
+    def get_scores(self) -> Union[MatchGroup, None]:
+        """Returns the scores of all matches in this session as they
+        currently stand, or `None` if they were not kept up to date while
+        capturing and need to be built from the logs instead"""
+        if self.scoreboard is None:
+            return None
+        return self.scoreboard.snapshot()
+
+    async def fetch_scores(self) -> MatchGroup:
+        """Same as `get_scores`, except that scores that were not kept
+        up to date are built from the logs in a separate thread"""
+        scores = self.get_scores()
+        if scores is None:
+            scores = await self.loop.run_in_executor(None, scorepool.build_group, self.iter_logs())
+        return scores
+
+    async def fetch_summary(self, with_scores: bool = True) -> SessionSummary:
+        """Returns the ranges and, unless `with_scores` is `False`, the
+        scores of the matches in this session.
+
+        Once a session has ended its summary is stored in the database, so
+        that its logs only need to be gone through once. Summaries are
+        forgotten whenever logs are added or removed afterwards.
+        """
+        if self.gatherer.is_running() or self.active_in() is not False:
+            logs = self.iter_logs(filter=RANGE_FLAGS, fields=RANGE_FIELDS)
+            ranges = await self.loop.run_in_executor(None, get_all_ranges, logs)
+            scores = await self.fetch_scores() if with_scores else None
+            return SessionSummary(ranges, scores)
+
+        summary = await self.loop.run_in_executor(None, load_summary, self.id)
+        if summary is None:
+            version = self.get_logs_version()
+            scores = self.get_scores()
+            if scores is None:
+                summary = await self.loop.run_in_executor(None, build_summary, self.iter_logs())
+            else:
+                logs = self.iter_logs(filter=RANGE_FLAGS, fields=RANGE_FIELDS)
+                ranges = await self.loop.run_in_executor(None, get_all_ranges, logs)
+                summary = SessionSummary(ranges, scores)
+            rows = await self.loop.run_in_executor(None, summary_to_rows, self.id, summary)
+
+            # The session may have been deleted or its logs changed while
+            # the summary was being built
+            if rows is not None and not self._deleted and get_logs_version(self.id) == version:
+                insert_summary_rows(self.id, rows)
+                self.logger.info('Stored summary of %s matches', len(summary.scores.matches))
+        return summary
 
     def _clear_tasks(self):
         if self._start_task and not self._start_task.done():
@@ -319,40 +606,155 @@ class HLLCaptureSession:
         if coros:
             await asyncio.gather(*coros)
 
+    def write_to_journal(self):
+        """Append all logs that were gathered since the last call to the
+        session's journal, so they can be recovered after a crash."""
+        logs = self._logs[self._num_logs_journaled:]
+        if logs:
+            try:
+                self.journal.append(logs)
+            except:
+                self.logger.exception('Failed to write %s logs to the journal', len(logs))
+            self._num_logs_journaled += len(logs)
+
+    def recover_from_journal(self):
+        """Push any logs left behind in the session's journal to the DB.
+        This should only be done before the session is activated.
+
+        Returns
+        -------
+        int
+            The number of logs that were recovered
+        """
+        # Logs up to the stored sequence number were already pushed right
+        # before the journal could be reset
+        records = self.journal.read(after=get_journal_seq(self.id))
+        if records:
+            self.logger.info('Recovering %s logs from the journal', len(records))
+            last_seq = records[-1][0]
+            set_journal_seq(self.id, last_seq, commit=False)
+            insert_many_logs(sess_id=self.id, logs=[log for _, log in records], log_format=self.log_format)
+            EXPORT_CACHE.invalidate(self.id)
+            self.journal.last_seq = max(self.journal.last_seq, last_seq)
+        self.journal.delete()
+        return len(records)
+
     def push_to_db(self):
+        if self._deleted:
+            self._logs = list()
+            return
         self.logger.info('Pushing %s logs to the DB', len(self._logs))
         if self._logs:
-            insert_many_logs(sess_id=self.id, logs=self._logs)
+            if self._num_logs_journaled:
+                # Committed along with the logs, so that the journal is
+                # not replayed on top of them if we crash before resetting it
+                set_journal_seq(self.id, self.journal.last_seq, commit=False)
+            insert_many_logs(sess_id=self.id, logs=self._logs, log_format=self.log_format)
+            EXPORT_CACHE.invalidate(self.id)
         self._logs = list()
+        if self._num_logs_journaled:
+            self.journal.reset()
+            self._num_logs_journaled = 0
 
     def get_logs(self, from_: datetime = None, to: datetime = None, filter: EventFlags = None, limit: int = None):
         self.push_to_db()
+        return select_logs(sess_id=self.id, log_format=self.log_format, from_=from_, to=to, filter=filter, limit=limit)
+
+    async def fetch_logs(self, from_: datetime = None, to: datetime = None, filter: EventFlags = None, limit: int = None,
+            fields: Sequence[str] = None):
+        """Same as `get_logs`, except that the logs are read in a separate
+        thread using a read-only connection, so that large reads neither
+        block the event loop nor the sessions writing to the database."""
+        logs = self.iter_logs(from_=from_, to=to, filter=filter, limit=limit, fields=fields)
+        return await self.loop.run_in_executor(None, list, logs)
+
+    def iter_logs(self, from_: datetime = None, to: datetime = None, filter: EventFlags = None, limit: int = None,
+            fields: Sequence[str] = None) -> Iterator[LogRecord]:
+        """Returns a generator that lazily reads the logs of this session
+        in pages, without ever holding all of them in memory.
+
+        Logs still in memory are pushed when this is called, so this should
+        be called on the event loop. The generator itself only uses
+        read-only connections and may be consumed in any thread.
+        """
+        self.push_to_db()
+        return iter_logs(sess_id=self.id, log_format=self.log_format, from_=from_, to=to, filter=filter, limit=limit,
+                         fields=fields)
 
-        sess_name = f"session{self.id}"
-        columns = tuple(LogLine.__fields__)
+    def get_logs_version(self):
+        """Returns a number that changes whenever logs are added to or
+        removed from this session. Logs still in memory are pushed first."""
+        self.push_to_db()
+        return get_logs_version(self.id)
 
-        table = Table(sess_name)
-        query = table.select(*columns)
+    def has_logs(self, from_: datetime = None, to: datetime = None, filter: EventFlags = None):
+        """Whether this session holds any logs matching the given criteria"""
+        return next(self.iter_logs(from_=from_, to=to, filter=filter, limit=1, fields=()), None) is not None
 
-        if from_:
-            query = query.where(table.event_time >= from_)
-        if to:
-            query = query.where(table.event_time < to)
-        if filter is not None:
-            query = query.where(table.type.isin([k for k, v in filter if v]))
-        if limit:
-            query = query.limit(limit)
-        
-        cursor.execute(str(query))
-        return [LogLine(
-            **{k: v for k, v in zip(columns, record) if v is not None}
-        ) for record in cursor.fetchall()]
+    def count_logs(self, from_: datetime = None, to: datetime = None, filter: EventFlags = None):
+        """How many logs this session holds matching the given criteria.
+        For archived sessions this is an upper bound."""
+        self.push_to_db()
+        return count_logs(sess_id=self.id, log_format=self.log_format, from_=from_, to=to, filter=filter)
+
+    def migrate_logs(self, log_format: LogStorageFormat = LogStorageFormat.partitioned):
+        """Move the logs of this session to a different storage format.
+
+        Parameters
+        ----------
+        log_format : LogStorageFormat, optional
+            The format to migrate to, by default partitioned
+
+        Returns
+        -------
+        int
+            The number of logs that were migrated
+        """
+        log_format = LogStorageFormat(log_format)
+        if log_format == self.log_format:
+            return 0
+
+        self.push_to_db()
+        num_logs = migrate_logs(sess_id=self.id, from_format=self.log_format, to_format=log_format)
+        self.logger.info('Migrated %s logs from %s to %s format', num_logs, self.log_format, log_format)
+        self.log_format = log_format
+        return num_logs
+
+    async def migrate_logs_async(self, log_format: LogStorageFormat = LogStorageFormat.partitioned):
+        """Same as `migrate_logs`, except that the logs are read and packed
+        in a separate thread, so that only writing them blocks the event
+        loop. If logs are added or removed in the meantime, nothing is
+        migrated and 0 is returned."""
+        log_format = LogStorageFormat(log_format)
+        from_format = self.log_format
+        if log_format == from_format:
+            return 0
+
+        version = self.get_logs_version()
+        records = None
+        if from_format == LogStorageFormat.plain:
+            # Encoding may add lookup values, which can only be written from
+            # the main thread
+            logs = await self.fetch_logs()
+            records = encode_logs(logs)
+        migration = await self.loop.run_in_executor(None, prepare_migration, self.id, from_format, log_format, records)
+
+        if self._deleted or self.log_format != from_format or get_logs_version(self.id) != version:
+            self.logger.info('Logs changed while migrating them to %s format, trying again later', log_format)
+            return 0
+        num_logs = apply_migration(migration)
+        self.logger.info('Migrated %s logs from %s to %s format', num_logs, from_format, log_format)
+        self.log_format = log_format
+        return num_logs
 
     def delete(self):
         self.logger.info('Deleting session...')
         schedule_coro(datetime.now(tz=timezone.utc), self.deactivate, error_logger=self.logger)
         self._clear_tasks()
-        delete_logs(sess_id=self.id)
+        self._deleted = True
+        self.scoreboard = None
+        self.journal.delete()
+        EXPORT_CACHE.invalidate(self.id)
 
         table = Table("sessions")
         update_query = table.update().set(table.deleted, True).where(table.ROWID == self.id)
@@ -360,6 +762,9 @@ class HLLCaptureSession:
         database.commit()
         
         del SESSIONS[self.id]
+        self._unindex()
+        # Removing the logs themselves can take a while
+        expiry_worker.expire(self.id, self.log_format)
 
     async def edit(self,
         start_time: datetime = None,
@@ -400,6 +805,9 @@ class HLLCaptureSession:
         else:
             force_reconnect = False
 
+        if start_time or credentials:
+            self._index()
+
         # Start or stop if needed
         await self.reevalute_start_stop(force_reconnect)
 
@@ -426,8 +834,9 @@ class HLLCaptureSession:
         is_activated = self.gatherer.is_running()
         active_in = self.active_in()
         
-        if force_reconnect and self.rcon:
-            await self.rcon.stop(force=False)
+        if force_reconnect and is_activated:
+            # Move over to the poller of the new server
+            self._subscribe_to_poller()
 
         self._start_task = None
         self._stop_task = None
@@ -1,14 +1,41 @@
 from pydantic import BaseModel, validator
+from contextlib import contextmanager
 from datetime import datetime
-from pypika import Table, Query, Column
+from enum import IntEnum
+from pypika import Table, Query, Column, Parameter, functions as fn
+from queue import Queue, Empty
+import threading
+import operator
 import sqlite3
 import logging
+import time
+import json
+import lzma
+import zlib
 
 from lib.info.models import *
+from utils import get_config
 
-DB_VERSION = 6
+DB_VERSION = 8
 HLU_VERSION = "v2.2.8"
 
+class LogStorageFormat(IntEnum):
+    def __str__(self):
+        return self.name
+
+    plain = 0
+    """Each session has its own table, with all values stored as text"""
+    normalized = 1
+    """Each session has its own table, with players, roles, weapons and
+    event types stored as keys into shared lookup tables"""
+    partitioned = 2
+    """All sessions share a single table keyed by session ID and event
+    time, with values encoded the same way as the normalized format"""
+    archived = 3
+    """Logs are encoded the same way as the normalized format and packed
+    into compressed blocks of columns, ordered by time. Meant for sessions
+    that have ended."""
+
 class LogLine(BaseModel):
     event_time: datetime = None
     type: str = None
@@ -48,74 +75,10 @@ class LogLine(BaseModel):
     
     @classmethod
     def from_event(cls, event: EventModel):
-        player = event.get('player')
-        player2 = event.get('other')
-        squad = event.get('squad') or (player.get('squad') if player else None)
-        team = event.get('team') or (squad.get('team') if squad else None) or (player.get('team') if player else None)
-
-        old = event.get('old')
-        new = event.get('new') or event.get('map')
-        message = event.get('message')
-
-        if isinstance(event, SquadLeaderChangeEvent):
-            player = event.new
-            player2 = event.old
-            old = None
-            new = None
-        elif isinstance(event, (PlayerSwitchSquadEvent, PlayerSwitchTeamEvent)):
-            old = event.old.name if event.old else None
-            new = event.new.name if event.new else None
-        elif isinstance(event, PlayerScoreUpdateEvent):
-            # Bit confusing, but cba to add two new columns to the table for this event alone
-            new = event.player.get('kills', 0)
-            message = event.player.get('deaths', 0)
-        elif isinstance(event, (ServerMatchEndedEvent, ObjectiveCaptureEvent)):
-            message = event.score
-        
-        if isinstance(event, PlayerMessageEvent):
-            if isinstance(event.channel, Squad):
-                squad = event.channel
-                team = event.channel.team
-            else:
-                team = event.channel
-        
-        payload = dict()
-        if player:
-            player_team = player.get('team', team)
-            payload.update(
-                player_name=player.name,
-                player_steamid=player.steamid,
-                player_team=player_team.name if player_team else None,
-                player_role=player.get('role'),
-            )
-            if player.has('score'):
-                payload.update(
-                    player_combat_score=player.score.combat,
-                    player_offense_score=player.score.offense,
-                    player_defense_score=player.score.defense,
-                    player_support_score=player.score.support,
-                )
-        if player2:
-            player2_team = player2.get('team')
-            payload.update(
-                player2_name=player2.name,
-                player2_steamid=player2.steamid,
-                player2_team=player2_team.name if player2_team else None,
-                player2_role=player2.get('role'),
-            )
-        if team:
-            payload['team_name'] = team.name
-        if squad:
-            payload['squad_name'] = squad.name
+        return cls(**LogRecord.from_event(event).dict(exclude_none=True))
 
-        payload['old'] = old
-        payload['new'] = new
-        payload['message'] = message
-        
-        payload['weapon'] = event.get('weapon')
-
-        payload.setdefault('type', str(EventTypes(event.__class__)))
-        return cls(event_time=event.event_time, **{k: v for k, v in payload.items() if v is not None})
+    def to_record(self) -> 'LogRecord':
+        return LogRecord(**self.dict())
 
     @staticmethod
     def _get_create_query(table_name: str, _explicit_fields: Sequence = None):
@@ -136,9 +99,364 @@ class LogLine(BaseModel):
         ])
         return str(query)
 
-database = sqlite3.connect('sessions.db')
+LOG_FIELDS: Tuple[str, ...] = tuple(LogLine.__fields__)
+_TEAM_NAMES = frozenset({'Allies', 'Axis'})
+_get_log_values = operator.attrgetter(*LOG_FIELDS)
+
+class LogRecord:
+    """A lightweight log, holding the same fields as a LogLine.
+
+    Unlike LogLine, values are neither parsed nor validated when a record
+    is created, which makes records many times cheaper to create. Sessions
+    and storage use these internally. Values can be checked with
+    `validate()`, and `to_model()` returns the equivalent LogLine.
+    """
+    __slots__ = LOG_FIELDS
+
+    def __init__(self, event_time: datetime = None, type: str = None, player_name: str = None,
+            player_steamid: str = None, player_team: str = None, player_role: str = None,
+            player_combat_score: int = None, player_offense_score: int = None, player_defense_score: int = None,
+            player_support_score: int = None, player2_name: str = None, player2_steamid: str = None,
+            player2_team: str = None, player2_role: str = None, weapon: str = None, old: str = None,
+            new: str = None, team_name: str = None, squad_name: str = None, message: str = None):
+        self.event_time = event_time
+        self.type = type
+        self.player_name = player_name
+        self.player_steamid = player_steamid
+        self.player_team = player_team
+        self.player_role = player_role
+        self.player_combat_score = player_combat_score
+        self.player_offense_score = player_offense_score
+        self.player_defense_score = player_defense_score
+        self.player_support_score = player_support_score
+        self.player2_name = player2_name
+        self.player2_steamid = player2_steamid
+        self.player2_team = player2_team
+        self.player2_role = player2_role
+        self.weapon = weapon
+        self.old = old
+        self.new = new
+        self.team_name = team_name
+        self.squad_name = squad_name
+        self.message = message
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, ", ".join(
+            f"{k}={v!r}" for k, v in self.dict(exclude_none=True).items()
+        ))
+
+    def __eq__(self, other):
+        if isinstance(other, (LogRecord, LogLine)):
+            return self.dict() == other.dict()
+        return NotImplemented
+
+    __hash__ = None
+
+    def values(self) -> tuple:
+        return _get_log_values(self)
+
+    def dict(self, exclude_none: bool = False) -> Dict[str, Any]:
+        if exclude_none:
+            return {k: v for k, v in zip(LOG_FIELDS, _get_log_values(self)) if v is not None}
+        return dict(zip(LOG_FIELDS, _get_log_values(self)))
+
+    def json(self, exclude_none: bool = False) -> str:
+        payload = self.dict(exclude_none=exclude_none)
+        if self.event_time is not None:
+            payload['event_time'] = self.event_time.isoformat()
+        return json.dumps(payload)
+
+    @classmethod
+    def parse_raw(cls, data: Union[str, bytes], validate: bool = False):
+        payload = json.loads(data)
+        event_time = payload.get('event_time')
+        if isinstance(event_time, str):
+            payload['event_time'] = datetime.fromisoformat(event_time)
+        record = cls(**payload)
+        if validate:
+            record.validate()
+        return record
+
+    def copy(self):
+        return LogRecord(*_get_log_values(self))
+
+    def validate(self):
+        """Check the values of this record the same way LogLine would,
+        without converting any of them.
+
+        Raises
+        ------
+        ValueError
+            A value is not valid
+        """
+        if self.event_time is not None and not isinstance(self.event_time, datetime):
+            raise ValueError("%s is not a valid event time" % self.event_time)
+        if self.type is not None and not isinstance(self.type, str):
+            raise ValueError("%s is not a valid log type" % self.type)
+        for team in (self.player_team, self.player2_team, self.team_name):
+            if team is not None and team not in _TEAM_NAMES:
+                raise ValueError("%s is not a valid team name" % team)
+        return self
+
+    def to_model(self) -> LogLine:
+        return LogLine(**self.dict(exclude_none=True))
+
+    @classmethod
+    def from_event(cls, event: EventModel, validate: bool = False):
+        try:
+            converter = _LOG_CONVERTERS[event.__class__]
+        except KeyError:
+            converter = _LOG_CONVERTERS[event.__class__] = _create_log_converter(event.__class__)
+
+        record = converter(event)
+        if validate:
+            record.validate()
+        return record
+
+def _to_str(value):
+    if value is None or isinstance(value, str):
+        return value
+    return str(value)
+
+def _create_log_converter(event_class: Type[EventModel]) -> Callable[[EventModel], LogRecord]:
+    """Creates a function that turns events of the given class into log
+    records. Everything that only depends on the class of the event, like
+    which fields it has and which special cases apply, is decided here
+    once instead of for every event."""
+    fields = event_class.__fields__
+    log_type = str(EventTypes(event_class))
+
+    has_player = 'player' in fields
+    has_other = 'other' in fields
+    has_squad = 'squad' in fields
+    has_team = 'team' in fields
+    has_old = 'old' in fields
+    has_new = 'new' in fields
+    has_map = 'map' in fields
+    has_message = 'message' in fields
+    has_weapon = 'weapon' in fields
+
+    is_leader_change = issubclass(event_class, SquadLeaderChangeEvent)
+    is_switch = issubclass(event_class, (PlayerSwitchSquadEvent, PlayerSwitchTeamEvent))
+    is_score_update = issubclass(event_class, PlayerScoreUpdateEvent)
+    has_score = issubclass(event_class, (ServerMatchEndedEvent, ObjectiveCaptureEvent))
+    has_channel = issubclass(event_class, PlayerMessageEvent)
+
+    def convert(event: EventModel):
+        get = event.get
+        player = get('player') if has_player else None
+        player2 = get('other') if has_other else None
+        # Resolved once here since it is needed twice
+        player_team = player.get('team', Unset) if player else Unset
+
+        squad = (get('squad') if has_squad else None) or (player.get('squad') if player else None)
+        team = (get('team') if has_team else None) or (squad.get('team') if squad else None) or (player_team or None)
+
+        old = get('old') if has_old else None
+        new = (get('new') if has_new else None) or (get('map') if has_map else None)
+        message = get('message') if has_message else None
+
+        if is_leader_change:
+            player = new
+            player2 = old
+            player_team = player.get('team', Unset) if player else Unset
+            old = None
+            new = None
+        elif is_switch:
+            old = old.name if old else None
+            new = new.name if new else None
+        elif is_score_update:
+            # Bit confusing, but cba to add two new columns to the table for this event alone
+            new = player.get('kills', 0)
+            message = player.get('deaths', 0)
+        elif has_score:
+            message = event.score
+
+        if has_channel:
+            channel = event.channel
+            if isinstance(channel, Squad):
+                squad = channel
+                team = channel.team
+            else:
+                team = channel
+
+        record = LogRecord(event_time=event.event_time, type=log_type)
+        if player:
+            if player_team is Unset:
+                player_team = team
+            record.player_name = player.name
+            record.player_steamid = player.steamid
+            record.player_team = player_team.name if player_team else None
+            record.player_role = player.get('role')
+            if player.has('score'):
+                score = player.score
+                record.player_combat_score = score.combat
+                record.player_offense_score = score.offense
+                record.player_defense_score = score.defense
+                record.player_support_score = score.support
+        if player2:
+            player2_team = player2.get('team')
+            record.player2_name = player2.name
+            record.player2_steamid = player2.steamid
+            record.player2_team = player2_team.name if player2_team else None
+            record.player2_role = player2.get('role')
+        if team:
+            record.team_name = team.name
+        if squad:
+            record.squad_name = squad.name
+
+        record.old = _to_str(old)
+        record.new = _to_str(new)
+        record.message = _to_str(message)
+        if has_weapon:
+            record.weapon = get('weapon')
+        return record
+
+    return convert
+
+_LOG_CONVERTERS: Dict[Type[EventModel], Callable[[EventModel], LogRecord]] = {
+    event_type.value: _create_log_converter(event_type.value) for event_type in EventTypes.public()
+}
+
+# Columns of a normalized logs table and the log fields they are
+# decoded into. Lookup columns hold the ROWID of a row in the given
+# lookup table.
+NORMALIZED_COLUMNS = (
+    ('event_time', 'TEXT'),
+    ('type_id', 'INTEGER'),
+    ('player_id', 'INTEGER'),
+    ('player_team', 'TEXT'),
+    ('player_role_id', 'INTEGER'),
+    ('player_combat_score', 'INTEGER'),
+    ('player_offense_score', 'INTEGER'),
+    ('player_defense_score', 'INTEGER'),
+    ('player_support_score', 'INTEGER'),
+    ('player2_id', 'INTEGER'),
+    ('player2_team', 'TEXT'),
+    ('player2_role_id', 'INTEGER'),
+    ('weapon_id', 'INTEGER'),
+    ('old', 'TEXT'),
+    ('new', 'TEXT'),
+    ('team_name', 'TEXT'),
+    ('squad_name', 'TEXT'),
+    ('message', 'TEXT'),
+)
+
+def _get_normalized_create_query(table_name: str):
+    query = Query.create_table(table_name).columns(*[
+        Column(column_name, column_type) for column_name, column_type in NORMALIZED_COLUMNS
+    ])
+    return str(query)
+
+def get_logs_table_name(sess_id: int):
+    return f"session{int(sess_id)}"
+
+PARTITIONED_TABLE_NAME = "logs"
+ARCHIVE_TABLE_NAME = "log_archive_blocks"
+MATCH_SUMMARIES_TABLE_NAME = "match_summaries"
+MATCH_PLAYERS_TABLE_NAME = "match_players"
+# How many logs are packed together in a single archived block
+ARCHIVE_BLOCK_SIZE = 4096
+ARCHIVE_CODECS = {
+    'zlib': (lambda data: zlib.compress(data, 9), zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+# How many logs are fetched at once when reading logs lazily
+LOGS_PAGE_SIZE = 2000
+
+DB_PATH = 'sessions.db'
+NUM_READ_CONNECTIONS = get_config().getint('Database', 'NumReadConnections', fallback=4)
+WAL_AUTOCHECKPOINT_PAGES = get_config().getint('Database', 'WALAutoCheckpointPages', fallback=4000)
+WAL_SIZE_LIMIT = get_config().getint('Database', 'WALSizeLimitInMB', fallback=64) * 1024 * 1024
+ARCHIVE_CODEC = get_config().get('Database', 'ArchiveCompression', fallback='zlib').lower()
+if ARCHIVE_CODEC not in ARCHIVE_CODECS:
+    logging.warning('Unknown archive compression "%s", using zlib instead', ARCHIVE_CODEC)
+    ARCHIVE_CODEC = 'zlib'
+
+database = sqlite3.connect(DB_PATH)
 cursor = database.cursor()
 
+# Lets freed pages be returned to the file system bit by bit. This only
+# takes effect right away for new databases, see below for existing ones.
+cursor.execute('PRAGMA auto_vacuum=INCREMENTAL;')
+
+# In WAL mode, readers and the writer no longer block each other
+cursor.execute('PRAGMA journal_mode=WAL;')
+cursor.execute('PRAGMA synchronous=NORMAL;')
+cursor.execute(f'PRAGMA wal_autocheckpoint={int(WAL_AUTOCHECKPOINT_PAGES)};')
+cursor.execute(f'PRAGMA journal_size_limit={int(WAL_SIZE_LIMIT)};')
+
+
+class ReadConnectionPool:
+    """A pool of read-only connections to the database. Unlike the main
+    connection, these may be used from other threads, which allows
+    expensive reads to happen outside of the event loop.
+
+    Connections are opened lazily, up to `size` at once. Borrowing a
+    connection while all of them are in use blocks until one is returned.
+    """
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = max(1, size)
+        self._idle = Queue()
+        self._num_opened = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        try:
+            return sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, check_same_thread=False, timeout=10)
+        except:
+            with self._lock:
+                self._num_opened -= 1
+            raise
+
+    @contextmanager
+    def cursor(self):
+        try:
+            connection = self._idle.get_nowait()
+        except Empty:
+            # Claim a slot before opening, so that threads borrowing at the
+            # same time can not open more than `size` connections
+            with self._lock:
+                can_open = self._num_opened < self.size
+                if can_open:
+                    self._num_opened += 1
+            if can_open:
+                connection = self._connect()
+            else:
+                connection = self._idle.get()
+
+        try:
+            yield connection.cursor()
+        finally:
+            # Make sure no read transaction is left open, which would
+            # stop checkpoints from completing
+            connection.rollback()
+            self._idle.put(connection)
+
+read_pool = ReadConnectionPool(DB_PATH, NUM_READ_CONNECTIONS)
+
+def read_cursor():
+    """Borrow a cursor from the pool of read-only connections"""
+    return read_pool.cursor()
+
+def checkpoint_database(mode: str = 'PASSIVE'):
+    """Copy the contents of the WAL file back into the database. Using
+    TRUNCATE mode also resets the WAL file, but only succeeds if no
+    readers are active.
+
+    Returns
+    -------
+    Tuple[bool, int, int]
+        Whether the checkpoint was blocked, the number of pages in the
+        WAL file, and the number of pages that were checkpointed
+    """
+    if mode.upper() not in {'PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'}:
+        raise ValueError('%s is not a valid checkpoint mode' % mode)
+    cursor.execute(f'PRAGMA wal_checkpoint({mode.upper()});')
+    busy, log_pages, checkpointed_pages = cursor.fetchone()
+    return bool(busy), log_pages, checkpointed_pages
+
 cursor.execute("""
 CREATE TABLE IF NOT EXISTS "db_version" (
 	"format_version"	INTEGER DEFAULT 1 NOT NULL
@@ -172,6 +490,105 @@ CREATE TABLE IF NOT EXISTS "sessions" (
 );
 """)
 
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS "log_players" (
+	"steamid"	VARCHAR(17),
+	"name"	VARCHAR(40)
+);
+""")
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS "log_roles" (
+	"name"	VARCHAR(30) NOT NULL
+);
+""")
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS "log_weapons" (
+	"name"	VARCHAR(60) NOT NULL
+);
+""")
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS "log_types" (
+	"name"	VARCHAR(30) NOT NULL
+);
+""")
+
+cursor.execute(Query.create_table(PARTITIONED_TABLE_NAME).if_not_exists().columns(
+    Column('session_id', 'INTEGER', nullable=False),
+    *[Column(column_name, column_type) for column_name, column_type in NORMALIZED_COLUMNS]
+).get_sql())
+# Covers lookups of a session's logs by time range, which is what nearly
+# all reads and deletes come down to. Since index entries end with the
+# ROWID, logs with the same event time are kept in insertion order.
+cursor.execute(f"""
+CREATE INDEX IF NOT EXISTS "{PARTITIONED_TABLE_NAME}_session_time" ON "{PARTITIONED_TABLE_NAME}" (
+	"session_id", "event_time"
+);
+""")
+
+# Blocks of archived logs. The start and end time of each block are
+# stored alongside it, so that reading a time range only needs to
+# decompress the blocks overlapping with it.
+cursor.execute(f"""
+CREATE TABLE IF NOT EXISTS "{ARCHIVE_TABLE_NAME}" (
+	"session_id"	INTEGER NOT NULL,
+	"start_time"	TEXT NOT NULL,
+	"end_time"	TEXT NOT NULL,
+	"num_logs"	INTEGER NOT NULL,
+	"codec"	VARCHAR(10) NOT NULL,
+	"data"	BLOB NOT NULL
+);
+""")
+cursor.execute(f"""
+CREATE INDEX IF NOT EXISTS "{ARCHIVE_TABLE_NAME}_session_time" ON "{ARCHIVE_TABLE_NAME}" (
+	"session_id", "start_time"
+);
+""")
+
+# Summaries of the matches of sessions that have ended, so that exports do
+# not need to go through all logs of a session every time. There is one
+# row for every range of a session, which refers to the match it covers
+# if any, and one row for every player of each match.
+cursor.execute(f"""
+CREATE TABLE IF NOT EXISTS "{MATCH_SUMMARIES_TABLE_NAME}" (
+	"session_id"	INTEGER NOT NULL,
+	"range_index"	INTEGER NOT NULL,
+	"match_index"	INTEGER,
+	"start_time"	TEXT,
+	"end_time"	TEXT,
+	"unload_time"	TEXT,
+	"map_name"	VARCHAR(80),
+	"match_map"	VARCHAR(80),
+	"team1_score"	INTEGER,
+	"team2_score"	INTEGER,
+	"duration"	REAL
+);
+""")
+cursor.execute(f"""
+CREATE INDEX IF NOT EXISTS "{MATCH_SUMMARIES_TABLE_NAME}_session" ON "{MATCH_SUMMARIES_TABLE_NAME}" (
+	"session_id", "range_index"
+);
+""")
+cursor.execute(f"""
+CREATE TABLE IF NOT EXISTS "{MATCH_PLAYERS_TABLE_NAME}" (
+	"session_id"	INTEGER NOT NULL,
+	"match_index"	INTEGER NOT NULL,
+	"steamid"	VARCHAR(17),
+	"name"	VARCHAR(40),
+	"faction"	VARCHAR(10),
+	"kills"	INTEGER NOT NULL,
+	"deaths"	INTEGER NOT NULL,
+	"teamkills"	INTEGER NOT NULL,
+	"suicides"	INTEGER NOT NULL,
+	"seconds_played"	INTEGER NOT NULL,
+	"details"	TEXT NOT NULL
+);
+""")
+cursor.execute(f"""
+CREATE INDEX IF NOT EXISTS "{MATCH_PLAYERS_TABLE_NAME}_session" ON "{MATCH_PLAYERS_TABLE_NAME}" (
+	"session_id", "match_index"
+);
+""")
+
 cursor.execute("""
 INSERT INTO "db_version" ("format_version")
     SELECT 1 WHERE NOT EXISTS(
@@ -288,32 +705,751 @@ elif db_version < DB_VERSION:
 
         database.commit()
 
+    if db_version < 7:
+        # Add a "log_format" column to the "sessions" table. Existing sessions
+        # all use the plain format.
+        cursor.execute('ALTER TABLE "sessions" ADD "log_format" INTEGER DEFAULT 0 NOT NULL;')
+        # Add a "journal_seq" column to the "sessions" table, holding the
+        # sequence number of the last journaled log that was stored
+        cursor.execute('ALTER TABLE "sessions" ADD "journal_seq" INTEGER DEFAULT 0 NOT NULL;')
+
+    if db_version < 8:
+        # Index the event time of all session logs tables
+        cursor.execute('SELECT name FROM sqlite_master WHERE type = "table" AND name LIKE "session%";')
+        for (table_name,) in cursor.fetchall():
+            try:
+                int(table_name[7:])
+            except ValueError:
+                continue
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS "{table_name}_time" ON "{table_name}" ("event_time");')
 
     cursor.execute('UPDATE "db_version" SET "format_version" = ?', (DB_VERSION,))
     database.commit()
     logging.info('Migrated database to format version %s!', DB_VERSION)
 
+def is_incremental_vacuum_enabled():
+    cursor.execute('PRAGMA auto_vacuum;')
+    return cursor.fetchone()[0] == 2
+
+def enable_incremental_vacuum():
+    """Rebuild the database so that freed pages can be reclaimed bit by
+    bit. This is needed once for databases created before incremental
+    vacuuming was enabled, and holds the write lock until it is done."""
+    if is_incremental_vacuum_enabled():
+        return False
+    logging.info('Enabling incremental vacuuming, this may take a while...')
+    database.commit()
+    cursor.execute('PRAGMA auto_vacuum=INCREMENTAL;')
+    cursor.execute('VACUUM;')
+    logging.info('Enabled incremental vacuuming!')
+    return True
+
+if not is_incremental_vacuum_enabled():
+    # Changing the auto-vacuum mode of an existing database requires it to
+    # be rebuilt, which takes too long to do on startup
+    logging.warning('Incremental vacuuming is not enabled, space freed by deleted sessions will not be reclaimed. '
+                    'Use the enablevacuum command to enable it.')
 
-def insert_many_logs(sess_id: int, logs: Sequence['LogLine'], sort: bool = True):
-    sess_name = f"session{int(sess_id)}"
+
+class LookupTable:
+    """A table of interned values, shared between all normalized logs
+    tables. Values are identified by their ROWID, which is what gets
+    stored in place of the value itself.
+
+    Both directions of the mapping are cached in memory after first use.
+    Values are decoded from any thread, so the cache is only changed while
+    holding a lock. Lookups of cached values do not need it.
+    """
+    def __init__(self, table_name: str, *columns: str):
+        self.table_name = table_name
+        self.columns = columns
+        self._keys: Dict[tuple, int] = None
+        self._values: Dict[int, tuple] = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        # This may be called from any thread when decoding logs, so only
+        # use pooled connections, and merge rather than replace the cache
+        # so interned values that are not yet committed are not lost.
+        keys = dict()
+        values = dict()
+
+        query = Query.from_(self.table_name).select('ROWID', *self.columns)
+        with read_cursor() as cur:
+            cur.execute(str(query))
+            records = cur.fetchall()
+        for (key, *value) in records:
+            value = tuple(value)
+            values[key] = value
+            keys.setdefault(value, key)
+
+        with self._lock:
+            if self._values is None:
+                self._keys = keys
+                self._values = values
+            else:
+                self._values.update(values)
+                for value, key in keys.items():
+                    self._keys.setdefault(value, key)
+            return self._keys, self._values
+
+    def get(self, *value) -> Union[int, None]:
+        """Returns the key of a value, or None if the value was
+        never interned."""
+        keys = self._keys
+        if keys is None:
+            keys, _ = self._load()
+        return keys.get(value)
+
+    def encode(self, *value) -> Union[int, None]:
+        """Returns the key of a value, interning the value first if
+        it is not known yet. A value consisting of only None is not
+        interned and is encoded as None."""
+        if all(v is None for v in value):
+            return None
+
+        key = self.get(*value)
+        if key is None:
+            query = Query.into(self.table_name).columns(*self.columns).insert(*value)
+            cursor.execute(str(query))
+            key = cursor.lastrowid
+            with self._lock:
+                self._keys[value] = key
+                self._values[key] = value
+        return key
+
+    def reset(self):
+        """Forget the cached mapping, so that it is read from the database
+        again the next time it is needed. Must be done whenever interned
+        values are rolled back, since their keys may be handed out again."""
+        with self._lock:
+            self._keys = None
+            self._values = None
+
+    def decode(self, key: Union[int, None]) -> tuple:
+        """Returns the value belonging to a key."""
+        if key is None:
+            return (None,) * len(self.columns)
+        values = self._values
+        if values is None or key not in values:
+            _, values = self._load()
+        return values[key]
+
+LOG_PLAYERS = LookupTable('log_players', 'steamid', 'name')
+LOG_ROLES = LookupTable('log_roles', 'name')
+LOG_WEAPONS = LookupTable('log_weapons', 'name')
+LOG_TYPES = LookupTable('log_types', 'name')
+LOOKUP_TABLES = (LOG_PLAYERS, LOG_ROLES, LOG_WEAPONS, LOG_TYPES)
+
+def rollback():
+    """Roll back the transaction of the main connection, along with any
+    lookup values that were interned during it"""
+    database.rollback()
+    for table in LOOKUP_TABLES:
+        table.reset()
+
+def _encode_log(log: 'LogRecord'):
+    return (
+        log.event_time.isoformat(),
+        LOG_TYPES.encode(log.type),
+        LOG_PLAYERS.encode(log.player_steamid, log.player_name),
+        log.player_team,
+        LOG_ROLES.encode(log.player_role),
+        log.player_combat_score,
+        log.player_offense_score,
+        log.player_defense_score,
+        log.player_support_score,
+        LOG_PLAYERS.encode(log.player2_steamid, log.player2_name),
+        log.player2_team,
+        LOG_ROLES.encode(log.player2_role),
+        LOG_WEAPONS.encode(log.weapon),
+        log.old,
+        log.new,
+        log.team_name,
+        log.squad_name,
+        log.message,
+    )
+
+# Lookup columns of a normalized logs table, mapped to the log fields
+# they decode into and the lookup table their keys refer to
+_LOOKUP_COLUMNS = {
+    'type_id': (('type',), LOG_TYPES),
+    'player_id': (('player_steamid', 'player_name'), LOG_PLAYERS),
+    'player_role_id': (('player_role',), LOG_ROLES),
+    'player2_id': (('player2_steamid', 'player2_name'), LOG_PLAYERS),
+    'player2_role_id': (('player2_role',), LOG_ROLES),
+    'weapon_id': (('weapon',), LOG_WEAPONS),
+}
+_FIELD_COLUMNS = {
+    field_name: column_name
+    for column_name, (field_names, _) in _LOOKUP_COLUMNS.items()
+    for field_name in field_names
+}
+_NORMALIZED_COLUMN_NAMES = tuple(column_name for column_name, _ in NORMALIZED_COLUMNS)
+
+def encode_logs(logs: Iterable['LogRecord']) -> List[tuple]:
+    """Encode logs into rows of a normalized logs table. This may add
+    values to the lookup tables, without committing them."""
+    return [_encode_log(log) for log in logs]
+
+def _decode_log(record: tuple, columns: Sequence[str] = _NORMALIZED_COLUMN_NAMES):
+    log = LogRecord()
+    for column_name, value in zip(columns, record):
+        if value is None:
+            continue
+        lookup = _LOOKUP_COLUMNS.get(column_name)
+        if lookup:
+            field_names, lookup_table = lookup
+            for field_name, field_value in zip(field_names, lookup_table.decode(value)):
+                setattr(log, field_name, field_value)
+        else:
+            setattr(log, column_name, value)
+    log.event_time = _parse_event_time(log.event_time)
+    return log
+
+def _decode_plain_log(record: tuple, columns: Sequence[str]):
+    log = LogRecord(**dict(zip(columns, record)))
+    log.event_time = _parse_event_time(log.event_time)
+    return log
+
+def _parse_event_time(value: Union[str, datetime, None]):
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+def _get_log_columns(log_format: LogStorageFormat, fields: Sequence[str] = None) -> List[str]:
+    """Returns the columns of a logs table that need to be selected to
+    retrieve the given log fields. The event time is always included."""
+    if fields is None:
+        fields = LOG_FIELDS
+    elif not set(fields).issubset(LOG_FIELDS):
+        raise ValueError("Unknown log fields: %s" % ", ".join(set(fields) - set(LOG_FIELDS)))
+
+    columns = ['event_time']
+    for field_name in fields:
+        if log_format != LogStorageFormat.plain:
+            field_name = _FIELD_COLUMNS.get(field_name, field_name)
+        if field_name not in columns:
+            columns.append(field_name)
+    return columns
+
+def create_logs_table(sess_id: int, log_format: LogStorageFormat = LogStorageFormat.plain):
+    sess_name = get_logs_table_name(sess_id)
+
+    if log_format in (LogStorageFormat.partitioned, LogStorageFormat.archived):
+        # All sessions share the same table
+        pass
+    elif log_format == LogStorageFormat.normalized:
+        cursor.execute(_get_normalized_create_query(sess_name))
+        _create_logs_table_index(sess_name)
+    else:
+        cursor.execute(LogLine._get_create_query(sess_name))
+        _create_logs_table_index(sess_name)
+
+def _create_logs_table_index(table_name: str):
+    # Lets logs be read in pages ordered by time without sorting the
+    # entire table for every page
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS "{table_name}_time" ON "{table_name}" ("event_time");')
+
+_last_insert_time = 0.0
+
+def seconds_since_last_insert():
+    return time.monotonic() - _last_insert_time
+
+_logs_versions: Dict[int, int] = dict()
+
+def get_logs_version(sess_id: int):
+    """Returns a number that changes whenever logs are added to or removed
+    from a session. It starts over when the bot restarts."""
+    return _logs_versions.get(int(sess_id), 0)
+
+def _bump_logs_version(sess_id: int):
+    sess_id = int(sess_id)
+    _logs_versions[sess_id] = _logs_versions.get(sess_id, 0) + 1
+
+def get_journal_seq(sess_id: int) -> int:
+    """Returns the sequence number of the last journaled log of a session
+    that was stored in the database"""
+    cursor.execute('SELECT "journal_seq" FROM "sessions" WHERE ROWID = ?', (int(sess_id),))
+    res = cursor.fetchone()
+    return int(res[0]) if res else 0
+
+def set_journal_seq(sess_id: int, seq: int, commit: bool = True):
+    """Mark all journaled logs of a session up to the given sequence number
+    as stored. Should be committed along with the logs themselves."""
+    cursor.execute('UPDATE "sessions" SET "journal_seq" = ? WHERE ROWID = ?', (int(seq), int(sess_id)))
+    if commit:
+        database.commit()
+
+def insert_many_logs(sess_id: int, logs: Sequence['LogRecord'], sort: bool = True, log_format: LogStorageFormat = LogStorageFormat.plain,
+        commit: bool = True):
+    sess_name = get_logs_table_name(sess_id)
     table = Table(sess_name)
 
+    global _last_insert_time
+    _last_insert_time = time.monotonic()
+
     if sort:
         logs = sorted(logs, key=lambda l: l.event_time)
 
-    # Insert the logs
-    insert_query = table
-    for log in logs:
-        insert_query = insert_query.insert(*log.dict().values())
-    cursor.execute(str(insert_query))
+    if logs:
+        delete_match_summary(sess_id, commit=False)
+        _bump_logs_version(sess_id)
+
+    if log_format != LogStorageFormat.plain:
+        _insert_encoded_logs(sess_id, [_encode_log(log) for log in logs], log_format)
+
+    elif logs:
+        # Insert the logs
+        insert_query = table
+        for log in logs:
+            insert_query = insert_query.insert(*log.dict().values())
+        cursor.execute(str(insert_query))
     
-    database.commit()
+    if commit:
+        database.commit()
+
+def _insert_encoded_logs(sess_id: int, records: Sequence[tuple], log_format: LogStorageFormat):
+    """Insert logs that are already encoded, in any format but plain"""
+    if log_format == LogStorageFormat.partitioned:
+        query = Query.into(PARTITIONED_TABLE_NAME).columns(
+            'session_id', *_NORMALIZED_COLUMN_NAMES
+        ).insert(*[Parameter('?')] * (len(NORMALIZED_COLUMNS) + 1))
+        cursor.executemany(str(query), [(int(sess_id), *record) for record in records])
+
+    elif log_format == LogStorageFormat.archived:
+        _append_archive_blocks(sess_id, records)
+
+    elif log_format == LogStorageFormat.normalized:
+        query = Table(get_logs_table_name(sess_id)).insert(*[Parameter('?')] * len(NORMALIZED_COLUMNS))
+        cursor.executemany(str(query), records)
+
+    else:
+        raise ValueError("Plain logs can not be inserted encoded")
+
+def _select_encoded_logs(sess_id: int, log_format: LogStorageFormat) -> List[tuple]:
+    """Select all logs of a session in their encoded form, ordered by
+    time. Plain logs are encoded first, which may write to the lookup
+    tables. Logs in any other format are read from pooled connections."""
+    if log_format == LogStorageFormat.plain:
+        return [_encode_log(log) for log in iter_logs(sess_id, log_format)]
+
+    elif log_format == LogStorageFormat.archived:
+        with read_cursor() as cur:
+            cur.execute(str(_get_archive_blocks_query(sess_id, 'codec', 'data')))
+            blocks = cur.fetchall()
+        return [record for codec, data in blocks for record in _unpack_archive_block(data, codec)]
+
+    if log_format == LogStorageFormat.partitioned:
+        table = Table(PARTITIONED_TABLE_NAME)
+        query = table.select(*_NORMALIZED_COLUMN_NAMES).where(table.session_id == int(sess_id))
+    else:
+        table = Table(get_logs_table_name(sess_id))
+        query = table.select(*_NORMALIZED_COLUMN_NAMES)
+    with read_cursor() as cur:
+        cur.execute(str(query.orderby(table.event_time, table.ROWID)))
+        return cur.fetchall()
+
+def _filter_query(query, table: Table, log_format: LogStorageFormat, from_: datetime = None, to: datetime = None,
+        filter: EventFlags = None):
+    if filter is not None:
+        if log_format == LogStorageFormat.plain:
+            query = query.where(table.type.isin([k for k, v in filter if v]))
+        else:
+            type_ids = [LOG_TYPES.get(k) for k, v in filter if v]
+            query = query.where(table.type_id.isin([type_id for type_id in type_ids if type_id is not None]))
+    if from_:
+        query = query.where(table.event_time >= from_)
+    if to:
+        query = query.where(table.event_time < to)
+    return query
+
+def iter_logs(sess_id: int, log_format: LogStorageFormat = LogStorageFormat.plain, from_: datetime = None,
+        to: datetime = None, filter: EventFlags = None, limit: int = None, fields: Sequence[str] = None,
+        chunk_size: int = LOGS_PAGE_SIZE) -> Iterator['LogRecord']:
+    """Lazily read the logs of a session, ordered by time.
+
+    Logs are fetched in pages of `chunk_size`, each continuing where the
+    previous page left off rather than using an offset, so that reading
+    any page costs the same. A pooled connection is only borrowed while a
+    page is being fetched, so the generator can be consumed slowly and
+    from any thread without blocking checkpoints.
+
+    Parameters
+    ----------
+    fields : Sequence[str], optional
+        The log fields to retrieve. The event time is always
+        included. By default all fields are retrieved.
+    """
+    log_format = LogStorageFormat(log_format)
+    if log_format == LogStorageFormat.archived:
+        yield from _iter_archived_logs(sess_id, from_=from_, to=to, filter=filter, limit=limit, fields=fields)
+        return
+
+    columns = _get_log_columns(log_format, fields)
+
+    if log_format == LogStorageFormat.partitioned:
+        table = Table(PARTITIONED_TABLE_NAME)
+        query = table.select(*columns, table.ROWID).where(table.session_id == int(sess_id))
+    else:
+        table = Table(get_logs_table_name(sess_id))
+        query = table.select(*columns, table.ROWID)
+
+    query = _filter_query(query, table, log_format, from_=from_, to=to, filter=filter)
+    query = query.orderby(table.event_time, table.ROWID)
+
+    remaining = limit
+    last_record = None
+    while True:
+        page_size = chunk_size if remaining is None else min(chunk_size, remaining)
+        page = query
+        if last_record is not None:
+            last_time = last_record[0]
+            last_rowid = last_record[-1]
+            page = page.where(table.event_time >= last_time).where(
+                (table.event_time > last_time) | (table.ROWID > last_rowid)
+            )
+
+        with read_cursor() as cur:
+            cur.execute(str(page.limit(page_size)))
+            records = cur.fetchall()
+
+        for record in records:
+            if log_format == LogStorageFormat.plain:
+                yield _decode_plain_log(record, columns)
+            else:
+                yield _decode_log(record, columns)
+
+        if remaining is not None:
+            remaining -= len(records)
+        if len(records) < page_size or remaining == 0:
+            break
+        last_record = records[-1]
+
+def count_logs(sess_id: int, log_format: LogStorageFormat = LogStorageFormat.plain, from_: datetime = None,
+        to: datetime = None, filter: EventFlags = None) -> int:
+    """Count the logs of a session. Archived logs are counted per block
+    without unpacking them, so for those this is an upper bound that
+    ignores the filter and counts entire blocks overlapping the range."""
+    log_format = LogStorageFormat(log_format)
+    with read_cursor() as cur:
+        if log_format == LogStorageFormat.archived:
+            cur.execute(str(_get_archive_blocks_query(sess_id, 'num_logs', from_=from_, to=to)))
+            return sum(num_logs for num_logs, in cur.fetchall())
+
+        if log_format == LogStorageFormat.partitioned:
+            table = Table(PARTITIONED_TABLE_NAME)
+            query = Query.from_(table).select(fn.Count('*')).where(table.session_id == int(sess_id))
+        else:
+            table = Table(get_logs_table_name(sess_id))
+            query = Query.from_(table).select(fn.Count('*'))
+
+        cur.execute(str(_filter_query(query, table, log_format, from_=from_, to=to, filter=filter)))
+        return cur.fetchone()[0]
+
+def select_logs(sess_id: int, log_format: LogStorageFormat = LogStorageFormat.plain, from_: datetime = None,
+        to: datetime = None, filter: EventFlags = None, limit: int = None, fields: Sequence[str] = None):
+    return list(iter_logs(sess_id, log_format, from_=from_, to=to, filter=filter, limit=limit, fields=fields))
+
+def select_logs_across_sessions(sess_ids: Sequence[int], from_: datetime = None, to: datetime = None,
+        filter: EventFlags = None, limit: int = None) -> List[Tuple[int, 'LogRecord']]:
+    """Select logs from multiple sessions at once, ordered by time.
 
-def delete_logs(sess_id: int):
-    sess_name = f"session{int(sess_id)}"
+    Only sessions using the partitioned format are included. Each
+    session is resolved with a range scan over the same index.
+
+    Returns
+    -------
+    List[Tuple[int, LogRecord]]
+        Pairs of session IDs and their logs
+    """
+    table = Table(PARTITIONED_TABLE_NAME)
+    query = table.select('session_id', *[column_name for column_name, _ in NORMALIZED_COLUMNS]).where(
+        table.session_id.isin([int(sess_id) for sess_id in sess_ids])
+    ).orderby(table.event_time, table.ROWID)
+
+    query = _filter_query(query, table, LogStorageFormat.partitioned, from_=from_, to=to, filter=filter)
+    if limit:
+        query = query.limit(limit)
+
+    with read_cursor() as cur:
+        cur.execute(str(query))
+        records = cur.fetchall()
+    return [(record[0], _decode_log(record[1:])) for record in records]
+
+def delete_logs(sess_id: int, log_format: LogStorageFormat = LogStorageFormat.plain, from_: datetime = None,
+        to: datetime = None, commit: bool = True):
+    """Delete the logs of a session. If no time range is given, all logs
+    of the session are removed, including its table if it has one.
+
+    Deleting a time range forgets the session's match summary. Deleting
+    all logs does not, since that happens when logs are migrated to
+    another format, and deleted sessions have their summary removed
+    along with their logs."""
+    if from_ or to:
+        delete_match_summary(sess_id, commit=False)
+        _bump_logs_version(sess_id)
+
+    if log_format == LogStorageFormat.partitioned:
+        table = Table(PARTITIONED_TABLE_NAME)
+        query = Query.from_(table).delete().where(table.session_id == int(sess_id))
+        query = _filter_query(query, table, log_format, from_=from_, to=to)
+        cursor.execute(str(query))
 
-    # Drop the table
-    drop_query = Query.drop_table(sess_name)
-    cursor.execute(str(drop_query))
+    elif log_format == LogStorageFormat.archived:
+        _delete_archived_logs(sess_id, from_=from_, to=to)
+
+    elif from_ or to:
+        table = Table(get_logs_table_name(sess_id))
+        query = _filter_query(Query.from_(table).delete(), table, log_format, from_=from_, to=to)
+        cursor.execute(str(query))
+
+    else:
+        # Drop the table
+        drop_query = Query.drop_table(get_logs_table_name(sess_id)).if_exists()
+        cursor.execute(str(drop_query))
     
+    if commit:
+        database.commit()
+
+def delete_match_summary(sess_id: int, commit: bool = True):
+    """Forget the match summary of a session, so that it is built from
+    its logs again the next time it is needed"""
+    cursor.execute(f'DELETE FROM "{MATCH_SUMMARIES_TABLE_NAME}" WHERE "session_id" = ?', (int(sess_id),))
+    cursor.execute(f'DELETE FROM "{MATCH_PLAYERS_TABLE_NAME}" WHERE "session_id" = ?', (int(sess_id),))
+    if commit:
+        database.commit()
+
+def _pack_archive_block(records: Sequence[tuple]) -> bytes:
+    # Values are stored column by column, since values of the same column
+    # look a lot alike and thus compress a lot better
+    columns = [list(column) for column in zip(*records)]
+    data = json.dumps(columns, separators=(',', ':')).encode('utf-8')
+    compress, _ = ARCHIVE_CODECS[ARCHIVE_CODEC]
+    return compress(data)
+
+def _unpack_archive_block(data: bytes, codec: str) -> Iterator[tuple]:
+    _, decompress = ARCHIVE_CODECS[codec]
+    columns = json.loads(decompress(data))
+    return zip(*columns)
+
+def _pack_archive_blocks(sess_id: int, records: Sequence[tuple]) -> List[tuple]:
+    """Pack encoded logs into rows of the archive table. The logs should
+    be ordered by time. This does not touch the database."""
+    blocks = list()
+    for i in range(0, len(records), ARCHIVE_BLOCK_SIZE):
+        block = records[i:i + ARCHIVE_BLOCK_SIZE]
+        event_times = [record[0] for record in block]
+        blocks.append((int(sess_id), min(event_times), max(event_times), len(block), ARCHIVE_CODEC, _pack_archive_block(block)))
+    return blocks
+
+def _insert_packed_blocks(blocks: Sequence[tuple]):
+    query = Query.into(ARCHIVE_TABLE_NAME).columns(
+        'session_id', 'start_time', 'end_time', 'num_logs', 'codec', 'data'
+    ).insert(*[Parameter('?')] * 6)
+    cursor.executemany(str(query), blocks)
+
+def _insert_archive_blocks(sess_id: int, records: Sequence[tuple]):
+    """Pack encoded logs into blocks and store them. The logs should be
+    ordered by time and not overlap with any blocks already stored."""
+    _insert_packed_blocks(_pack_archive_blocks(sess_id, records))
+
+def _append_archive_blocks(sess_id: int, records: Sequence[tuple]):
+    """Add logs to the blocks of a session. Blocks are read in order of
+    their start time, so blocks overlapping with the new logs are packed
+    again together with them. So is the last block when it is not full,
+    which stops every append from leaving a tiny block behind."""
+    if not records:
+        return
+    table = Table(ARCHIVE_TABLE_NAME)
+    start_time = min(record[0] for record in records)
+    cursor.execute(str(_get_archive_blocks_query(sess_id, 'ROWID', 'num_logs', 'codec', 'data', from_=start_time)))
+    blocks = cursor.fetchall()
+    cursor.execute(f'SELECT ROWID, "num_logs", "codec", "data" FROM "{ARCHIVE_TABLE_NAME}" WHERE "session_id" = ? '
+        'ORDER BY "start_time" DESC, ROWID DESC LIMIT 1', (int(sess_id),))
+    last_block = cursor.fetchone()
+    if last_block and last_block[1] < ARCHIVE_BLOCK_SIZE and last_block[0] not in {block[0] for block in blocks}:
+        blocks.append(last_block)
+
+    merged = [record for _, _, codec, data in blocks for record in _unpack_archive_block(data, codec)]
+    merged.extend(records)
+    # Sorting is stable, so logs already stored stay ahead of new logs
+    # with the same time
+    merged.sort(key=lambda record: record[0])
+
+    if blocks:
+        cursor.execute(str(Query.from_(table).delete().where(table.ROWID.isin([block[0] for block in blocks]))))
+    _insert_archive_blocks(sess_id, merged)
+
+def _get_archive_blocks_query(sess_id: int, *columns, from_: datetime = None, to: datetime = None):
+    table = Table(ARCHIVE_TABLE_NAME)
+    query = table.select(*columns).where(table.session_id == int(sess_id))
+    if from_:
+        query = query.where(table.end_time >= from_)
+    if to:
+        query = query.where(table.start_time < to)
+    return query.orderby(table.start_time, table.ROWID)
+
+def _iter_archived_logs(sess_id: int, from_: datetime = None, to: datetime = None, filter: EventFlags = None,
+        limit: int = None, fields: Sequence[str] = None) -> Iterator['LogRecord']:
+    # Blocks hold all columns, so only the ones needed are decoded
+    columns = _get_log_columns(LogStorageFormat.archived, fields)
+    indices = [_NORMALIZED_COLUMN_NAMES.index(column_name) for column_name in columns]
+
+    with read_cursor() as cur:
+        cur.execute(str(_get_archive_blocks_query(sess_id, 'ROWID', 'codec', from_=from_, to=to)))
+        blocks = cur.fetchall()
+
+    # Event times are stored in ISO format, so they can be compared as text
+    from_ = from_.isoformat() if from_ else None
+    to = to.isoformat() if to else None
+    type_ids = {LOG_TYPES.get(k) for k, v in filter if v} if filter is not None else None
+
+    remaining = limit
+    for block_id, codec in blocks:
+        if remaining is not None and remaining <= 0:
+            break
+
+        # Only hold on to a connection while fetching a single block
+        with read_cursor() as cur:
+            cur.execute(f'SELECT "data" FROM "{ARCHIVE_TABLE_NAME}" WHERE ROWID = ?', (block_id,))
+            res = cur.fetchone()
+        if not res:
+            continue
+
+        for record in _unpack_archive_block(res[0], codec):
+            if from_ and record[0] < from_:
+                continue
+            if to and record[0] >= to:
+                continue
+            if type_ids is not None and record[1] not in type_ids:
+                continue
+
+            yield _decode_log([record[i] for i in indices], columns)
+
+            if remaining is not None:
+                remaining -= 1
+                if remaining <= 0:
+                    break
+
+def _delete_archived_logs(sess_id: int, from_: datetime = None, to: datetime = None):
+    table = Table(ARCHIVE_TABLE_NAME)
+    if not (from_ or to):
+        cursor.execute(str(Query.from_(table).delete().where(table.session_id == int(sess_id))))
+        return
+
+    # Blocks overlapping with the range are unpacked, and whatever logs
+    # are left are packed again
+    cursor.execute(str(_get_archive_blocks_query(sess_id, 'ROWID', 'codec', 'data', from_=from_, to=to)))
+    blocks = cursor.fetchall()
+    if not blocks:
+        return
+
+    from_ = from_.isoformat() if from_ else None
+    to = to.isoformat() if to else None
+    records = list()
+    for _, codec, data in blocks:
+        for record in _unpack_archive_block(data, codec):
+            if (from_ and record[0] < from_) or (to and record[0] >= to):
+                records.append(record)
+
+    cursor.execute(str(Query.from_(table).delete().where(table.ROWID.isin([block_id for block_id, _, _ in blocks]))))
+    records.sort(key=lambda record: record[0])
+    _insert_archive_blocks(sess_id, records)
+
+class PreparedMigration:
+    """The logs of a session, read and encoded for the storage format they
+    are migrated to"""
+    __slots__ = ('sess_id', 'from_format', 'to_format', 'num_logs', 'rows')
+
+    def __init__(self, sess_id: int, from_format: LogStorageFormat, to_format: LogStorageFormat, num_logs: int, rows: List[tuple]):
+        self.sess_id = int(sess_id)
+        self.from_format = from_format
+        self.to_format = to_format
+        self.num_logs = num_logs
+        self.rows = rows
+
+def prepare_migration(sess_id: int, from_format: LogStorageFormat, to_format: LogStorageFormat = LogStorageFormat.partitioned,
+        records: Sequence[tuple] = None) -> PreparedMigration:
+    """Read and encode the logs of a session for another storage format,
+    which is the slow part of a migration. Nothing is written, so unless
+    the logs still need to be encoded, this can run in any thread.
+
+    Parameters
+    ----------
+    records : Sequence[tuple], optional
+        The logs of the session, already encoded. Plain logs can only be
+        encoded in the main thread, since that may add lookup values.
+    """
+    from_format = LogStorageFormat(from_format)
+    to_format = LogStorageFormat(to_format)
+    if to_format not in (LogStorageFormat.partitioned, LogStorageFormat.archived):
+        raise ValueError("Logs can only be migrated to the %s or %s format, not %s" % (
+            LogStorageFormat.partitioned, LogStorageFormat.archived, to_format))
+
+    # Logs are moved in their encoded form, which saves decoding and
+    # encoding them all over again
+    if records is None:
+        records = _select_encoded_logs(sess_id, from_format)
+    if to_format == LogStorageFormat.archived:
+        rows = _pack_archive_blocks(sess_id, records)
+    else:
+        rows = [(int(sess_id), *record) for record in records]
+    return PreparedMigration(sess_id, from_format, to_format, len(records), rows)
+
+def apply_migration(migration: PreparedMigration):
+    """Replace the logs of a session with those of a prepared migration
+    and update the session's recorded format. This happens in a single
+    transaction. The logs must not have changed since the migration was
+    prepared.
+
+    Returns
+    -------
+    int
+        The number of logs that were migrated
+    """
+    sess_id, from_format, to_format = migration.sess_id, migration.from_format, migration.to_format
+    try:
+        # Remove leftovers in case an earlier attempt was interrupted
+        delete_logs(sess_id, to_format, commit=False)
+        if to_format == LogStorageFormat.archived:
+            _insert_packed_blocks(migration.rows)
+        else:
+            query = Query.into(PARTITIONED_TABLE_NAME).columns(
+                'session_id', *_NORMALIZED_COLUMN_NAMES
+            ).insert(*[Parameter('?')] * (len(NORMALIZED_COLUMNS) + 1))
+            cursor.executemany(str(query), migration.rows)
+        delete_logs(sess_id, from_format, commit=False)
+        cursor.execute('UPDATE "sessions" SET "log_format" = ? WHERE ROWID = ?', (to_format.value, sess_id))
+    except:
+        rollback()
+        raise
     database.commit()
+
+    logging.info("Migrated %s logs of session %s from %s to %s format", migration.num_logs, sess_id, from_format, to_format)
+    return migration.num_logs
+
+def migrate_logs(sess_id: int, from_format: LogStorageFormat, to_format: LogStorageFormat = LogStorageFormat.partitioned):
+    """Move all logs of a session from one storage format to another and
+    update the session's recorded format. This happens in a single
+    transaction.
+
+    Only migrating to the partitioned and archived formats is supported.
+
+    Returns
+    -------
+    int
+        The number of logs that were migrated
+    """
+    from_format = LogStorageFormat(from_format)
+    to_format = LogStorageFormat(to_format)
+    if from_format == to_format:
+        return 0
+
+    try:
+        migration = prepare_migration(sess_id, from_format, to_format)
+    except:
+        # Encoding plain logs may have added lookup values
+        rollback()
+        raise
+    return apply_migration(migration)
@@ -0,0 +1,241 @@
+from datetime import datetime, timedelta
+import json
+import logging
+from pydantic import BaseModel
+from typing import Iterable, List, Optional, Tuple, Union
+
+from lib import scorepool
+from lib.info.models import EventFlags, EventTypes
+from lib.mappings import get_map_and_mode, parse_layer
+from lib.scores import MatchGroup, MatchData
+from lib.storage import LogRecord, MATCH_SUMMARIES_TABLE_NAME, MATCH_PLAYERS_TABLE_NAME, cursor, database, read_cursor, delete_match_summary, rollback
+
+class ExportRange(BaseModel):
+    start_time: Optional[datetime]
+    end_time: Optional[datetime]
+    unload_time: Optional[datetime]
+    map_name: Optional[str]
+
+    @property
+    def has_end_time(self):
+        return self.end_time or self.unload_time
+
+    @property
+    def shortest_end_time(self):
+        if not self.has_end_time:
+            return None
+        elif not self.unload_time:
+            return self.end_time
+        elif not self.end_time:
+            return self.unload_time
+        else:
+            return min(self.end_time, self.unload_time)
+
+    @property
+    def longest_end_time(self):
+        if not self.has_end_time:
+            return None
+        elif not self.unload_time:
+            return self.end_time
+        elif not self.end_time:
+            return self.unload_time
+        else:
+            return max(self.end_time, self.unload_time)
+
+    @property
+    def duration(self):
+        if self.start_time and self.has_end_time:
+            return self.shortest_end_time - self.start_time
+        else:
+            return None
+
+    def is_eligible_for_helo(self):
+        return self.start_time and self.has_end_time
+
+# The logs and fields that are needed to determine the ranges of a session
+RANGE_FLAGS = EventFlags(server_match_started=True, server_match_ended=True, server_map_changed=True)
+RANGE_FIELDS = ('type', 'old', 'new')
+_RANGE_TYPES = frozenset(type_ for type_, allowed in RANGE_FLAGS if allowed)
+
+def get_all_ranges(logs: Iterable[LogRecord]):
+    """Same as `get_ranges`, except that a session with only one range
+    still has it returned"""
+    ranges = [ExportRange()]
+    for log in RANGE_FLAGS.filter_logs(logs):
+        try:
+            log_type = EventTypes(log.type)
+        except ValueError:
+            continue
+
+        if log_type == EventTypes.server_match_ended:
+            ranges[-1].end_time = log.event_time
+            if not ranges[-1].map_name:
+                ranges[-1].map_name = " ".join(get_map_and_mode(log.new))
+
+        elif log_type == EventTypes.server_match_started:
+            ranges[-1].unload_time = log.event_time
+            ranges.append(ExportRange(
+                start_time=log.event_time,
+                map_name=" ".join(get_map_and_mode(log.new))
+            ))
+
+        elif log_type == EventTypes.server_map_changed:
+            if not ranges[-1].start_time:
+                last_start = None
+            else:
+                last_start = (log.event_time - ranges[-1].start_time).total_seconds()
+
+            if len(ranges) >= 2 and last_start and last_start < 30:
+                # The line appeared after the server_match_started event
+                ranges[-2].map_name = parse_layer(log.old).pretty()
+                ranges[-1].map_name = parse_layer(log.new).pretty()
+
+            elif not last_start or last_start > 60:
+                # The line appeared before the server_match_started event
+                ranges[-1].map_name = parse_layer(log.old).pretty()
+
+    return ranges
+
+def get_ranges(logs: Iterable[LogRecord]):
+    ranges = get_all_ranges(logs)
+    if len(ranges) == 1:
+        ranges.clear()
+    return ranges
+
+class SessionSummary:
+    """The ranges and scores of the matches in a session.
+
+    Every match start begins a new range, and logs before the first match
+    start make up a range of their own. Matches are split the same way,
+    except that there is no match for the logs before the first match
+    start if there are none. Ranges are shown to users only when there is
+    more than one.
+    """
+    def __init__(self, ranges: List[ExportRange], scores: Union[MatchGroup, None]):
+        self.all_ranges = ranges
+        self.scores = scores
+
+    @property
+    def ranges(self):
+        return self.all_ranges if len(self.all_ranges) > 1 else []
+
+    @property
+    def match_offset(self):
+        """How many ranges come before the range of the first match"""
+        if self.scores is None:
+            return None
+        return len(self.all_ranges) - len(self.scores.matches)
+
+    def get_match(self, range_index: int) -> MatchData:
+        """Returns the match covering the range at the given index, which
+        is empty if the range does not hold any match"""
+        match_index = range_index - self.match_offset
+        if 0 <= match_index < len(self.scores.matches):
+            return self.scores.matches[match_index]
+        return MatchData(players=[], duration=timedelta())
+
+    def is_consistent(self):
+        return self.match_offset in (0, 1)
+
+def build_summary(logs: Iterable[LogRecord]):
+    """Build the summary of a session in a single pass over its logs"""
+    builder = scorepool.create_group_builder()
+    range_logs = list()
+    for log in logs:
+        builder.feed(log)
+        if log.type in _RANGE_TYPES:
+            range_logs.append(log)
+    return SessionSummary(get_all_ranges(range_logs), builder.build())
+
+def _to_str(value: Union[datetime, None]):
+    return value.isoformat() if value else None
+
+def _to_datetime(value: Union[str, None]):
+    return datetime.fromisoformat(value) if value else None
+
+def summary_to_rows(sess_id: int, summary: SessionSummary) -> Union[Tuple[list, list], None]:
+    """Returns the rows of both summary tables storing the summary of a
+    session, or `None` if it should not be stored. This does not touch the
+    database, so it can run in any thread."""
+    if not summary.is_consistent():
+        logging.warning('Not storing summary of session %s, which has %s ranges but %s matches',
+            sess_id, len(summary.all_ranges), len(summary.scores.matches))
+        return None
+
+    sess_id = int(sess_id)
+    offset = summary.match_offset
+    summary_rows = list()
+    for range_index, range in enumerate(summary.all_ranges):
+        match_index = range_index - offset
+        match = summary.scores.matches[match_index].to_summary() if match_index >= 0 else dict.fromkeys(
+            ('map', 'team1_score', 'team2_score', 'duration'))
+        summary_rows.append((
+            sess_id, range_index, match_index if match_index >= 0 else None,
+            _to_str(range.start_time), _to_str(range.end_time), _to_str(range.unload_time), range.map_name,
+            match['map'], match['team1_score'], match['team2_score'], match['duration'],
+        ))
+
+    player_rows = list()
+    for match_index, match in enumerate(summary.scores.matches):
+        for player in match.players:
+            data = player.to_summary()
+            player_rows.append((
+                sess_id, match_index, player.steam_id, player.name, data['faction'], player.kills,
+                player.deaths, player.teamkills, player.suicides, data['seconds_played'], json.dumps(data),
+            ))
+    return summary_rows, player_rows
+
+def insert_summary_rows(sess_id: int, rows: Tuple[list, list]):
+    """Store rows returned by `summary_to_rows`, replacing any summary the
+    session had before"""
+    summary_rows, player_rows = rows
+    try:
+        delete_match_summary(sess_id, commit=False)
+        cursor.executemany(f'INSERT INTO "{MATCH_SUMMARIES_TABLE_NAME}" VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', summary_rows)
+        cursor.executemany(f'INSERT INTO "{MATCH_PLAYERS_TABLE_NAME}" VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', player_rows)
+    except:
+        rollback()
+        raise
+    database.commit()
+
+def save_summary(sess_id: int, summary: SessionSummary):
+    """Store the summary of a session, replacing any it had before"""
+    rows = summary_to_rows(sess_id, summary)
+    if rows is not None:
+        insert_summary_rows(sess_id, rows)
+
+def load_summary(sess_id: int) -> Union[SessionSummary, None]:
+    """Read the stored summary of a session using a read-only connection.
+    Returns `None` if the session has no summary stored."""
+    with read_cursor() as cur:
+        cur.execute(f'''SELECT "match_index", "start_time", "end_time", "unload_time", "map_name", "match_map",
+            "team1_score", "team2_score", "duration" FROM "{MATCH_SUMMARIES_TABLE_NAME}"
+            WHERE "session_id" = ? ORDER BY "range_index"''', (int(sess_id),))
+        summary_rows = cur.fetchall()
+        if not summary_rows:
+            return None
+
+        cur.execute(f'''SELECT "match_index", "details" FROM "{MATCH_PLAYERS_TABLE_NAME}"
+            WHERE "session_id" = ? ORDER BY "match_index", ROWID''', (int(sess_id),))
+        player_rows = cur.fetchall()
+
+    players = dict()
+    for match_index, details in player_rows:
+        players.setdefault(match_index, list()).append(json.loads(details))
+
+    ranges = list()
+    matches = list()
+    for match_index, start_time, end_time, unload_time, map_name, match_map, team1_score, team2_score, duration in summary_rows:
+        ranges.append(ExportRange(
+            start_time=_to_datetime(start_time),
+            end_time=_to_datetime(end_time),
+            unload_time=_to_datetime(unload_time),
+            map_name=map_name,
+        ))
+        if match_index is not None:
+            matches.append(MatchData.from_summary(
+                dict(map=match_map, team1_score=team1_score, team2_score=team2_score, duration=duration),
+                players.get(match_index, ()),
+            ))
+
+    return SessionSummary(ranges, MatchGroup(matches))
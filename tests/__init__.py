@@ -0,0 +1,14 @@
+# Importing lib.storage opens sessions.db and utils creates a logs folder,
+# both in the working directory. Run tests and benchmarks in a scratch
+# directory instead, with a copy of the configuration.
+import atexit
+import os
+from pathlib import Path
+import shutil
+import tempfile
+
+_ROOT = Path(__file__).resolve().parent.parent
+_SCRATCH = tempfile.mkdtemp(prefix='hlu_tests_')
+shutil.copy(_ROOT / 'config.ini', _SCRATCH)
+os.chdir(_SCRATCH)
+atexit.register(shutil.rmtree, _SCRATCH, ignore_errors=True)
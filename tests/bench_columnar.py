@@ -0,0 +1,46 @@
+"""Compares how long the object and columnar scoring engines take to build
+the scores of sessions with many players.
+
+    python -m tests.bench_columnar [num_matches ...]
+"""
+import logging
+import sys
+import time
+
+from lib import columnar
+from lib.scores import MatchGroup
+from tests.synthetic import make_logs, make_players
+
+def best_of(func, repeat: int = 3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def feed_columns(logs):
+    builder = columnar.ColumnarGroupBuilder()
+    for log in logs:
+        builder.feed(log)
+    return builder
+
+def main(*match_counts: int):
+    if columnar.np is None:
+        print("The columnar engine requires numpy, which is not installed")
+        return
+    # Unmapped weapons would otherwise be reported for every kill
+    logging.disable(logging.WARNING)
+
+    players = make_players(n=400, seed=1)
+    for num_matches in match_counts or (5, 20):
+        logs = make_logs(num_matches=num_matches, minutes_per_match=60, players=players, seed=num_matches)
+        objects = best_of(lambda: MatchGroup.from_logs(logs))
+        loading = best_of(lambda: feed_columns(logs))
+        total = best_of(lambda: feed_columns(logs).build())
+        print(f"{num_matches:>3} matches, {len(logs)} logs: objects {objects * 1000:.0f}ms, "
+              f"columnar {total * 1000:.0f}ms (of which loading columns {loading * 1000:.0f}ms)")
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
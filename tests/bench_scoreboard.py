@@ -0,0 +1,51 @@
+"""Measures building the scoreboard of a session from its logs, most of
+which are score updates, and rendering it.
+
+    python -m tests.bench_scoreboard [num_matches]
+"""
+import logging
+import sys
+import time
+
+from lib.scores import MatchGroup, MatchGroupBuilder, create_scoreboard
+from lib.summaries import build_summary
+from tests.synthetic import make_session
+
+def best_of(func, repeat: int = 5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def feed_with_snapshots(logs, every: int = 1000):
+    """Feed a builder like a live session does, taking a snapshot of the
+    scoreboard every so often"""
+    builder = MatchGroupBuilder()
+    for i, log in enumerate(logs, 1):
+        builder.feed(log)
+        if i % every == 0:
+            builder.snapshot()
+    return builder
+
+def main(num_matches: int = 5):
+    # Unmapped weapons would otherwise be reported for every kill
+    logging.disable(logging.WARNING)
+
+    logs = make_session(num_matches=num_matches)
+    num_scores = sum(1 for log in logs if log.player_combat_score is not None)
+    print(f"{len(logs)} logs over {num_matches} matches, {num_scores} with scores")
+
+    group = MatchGroup.from_logs(logs)
+    for name, func in (
+        ("from_logs", lambda: MatchGroup.from_logs(logs)),
+        ("live, with snapshots", lambda: feed_with_snapshots(logs)),
+        ("summary", lambda: build_summary(iter(logs))),
+        ("render", lambda: [create_scoreboard(match) for match in group]),
+    ):
+        print(f"{name:>20}: {best_of(func) * 1000:.0f}ms")
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,37 @@
+"""Measures building the matches of a large session, either from a list of
+logs held in memory or streamed from an iterator.
+
+    python -m tests.bench_scores [num_logs]
+"""
+import logging
+import sys
+import time
+import tracemalloc
+
+from lib.scores import MatchGroup
+from tests.synthetic import make_large_session
+
+def measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def main(num_logs: int = 500_000):
+    # Unmapped weapons would otherwise be reported for every kill
+    logging.disable(logging.WARNING)
+    print(f"Generating {num_logs} logs...")
+    logs = make_large_session(num_logs)
+
+    for name, func in (
+        ("list", lambda: MatchGroup.from_logs(list(logs))),
+        ("iterator", lambda: MatchGroup.from_logs(iter(logs))),
+    ):
+        group, elapsed, peak = measure(func)
+        print(f"{name:>8}: {elapsed:.2f}s, peak {peak / 1024 / 1024:.1f} MiB, {len(group.matches)} matches")
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
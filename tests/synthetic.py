@@ -0,0 +1,163 @@
+"""Deterministic sessions of made-up logs for tests and benchmarks"""
+from datetime import datetime, timedelta, timezone
+import random
+from typing import List, Tuple
+
+from lib.storage import LogLine, LogRecord
+
+WEAPONS = ["M1 GARAND", "KARABINER 98K", "MP40", "M1A1 THOMPSON", "STG44", "MG42", "BROWNING M1919",
+           "M1 CARBINE", "GEWEHR 43", "M97 TRENCH GUN", "Sherman M4A3(75)[M4A3 Sherman 75mm]",
+           "155MM HOWITZER [M114]", "150MM HOWITZER [sFH 18]", "MK2 GRENADE", "M24 STIELHANDGRANATE",
+           "Panther[Panther (75mm) ]", "BAZOOKA", "PANZERSCHRECK", "M1903 SPRINGFIELD", "COLT M1911"]
+ROLES = ["Rifleman", "Assault", "AutomaticRifleman", "Medic", "Support", "MachineGunner", "AntiTank",
+         "Engineer", "Officer", "Spotter", "Sniper", "TankCommander", "Crewman", "ArmyCommander"]
+MAPS = ["stmereeglise_warfare", "foy_warfare", "hurtgenforest_warfare_V2", "kursk_warfare", "carentan_warfare"]
+SQUADS = ["Able", "Baker", "Charlie", "Dog", "Easy", "Fox", "George", "How"]
+
+Player = Tuple[str, str, str, str, str]
+
+def make_players(n: int = 120, seed: int = 0) -> List[Player]:
+    """Returns tuples of steam ID, name, team, role and squad"""
+    rnd = random.Random(seed)
+    players = []
+    for i in range(n):
+        steamid = str(76561198000000000 + rnd.randrange(10**9))
+        name = "Player_%s_%s" % (i, "".join(rnd.choice("abcdefghijklmnop") for _ in range(rnd.randrange(3, 12))))
+        players.append((steamid, name, "Allies" if i % 2 else "Axis", rnd.choice(ROLES), rnd.choice(SQUADS)))
+    return players
+
+def make_logs(num_matches: int = 5, minutes_per_match: int = 90, players: List[Player] = None, seed: int = 0,
+        start: datetime = None) -> List[LogLine]:
+    """Returns the logs of a session of full matches, with kills, score
+    updates and the occasional suicide, role change and message"""
+    rnd = random.Random(seed)
+    players = players or make_players(seed=seed)
+    t = start or datetime(2024, 1, 1, 18, 0, tzinfo=timezone.utc)
+    logs = []
+    scores = {p[0]: [0, 0, 0, 0] for p in players}
+    kd = {p[0]: [0, 0] for p in players}
+    for m in range(num_matches):
+        map_name = MAPS[m % len(MAPS)]
+        logs.append(LogLine(event_time=t, type="server_match_started", new=map_name.split("_")[0].upper() + " Warfare"))
+        if m:
+            logs.append(LogLine(event_time=t + timedelta(seconds=5), type="server_map_changed", old=MAPS[(m - 1) % len(MAPS)], new=map_name))
+        for p in players:
+            logs.append(LogLine(event_time=t, type="player_join_server", player_name=p[1], player_steamid=p[0]))
+        end = t + timedelta(minutes=minutes_per_match)
+        for p in players:
+            scores[p[0]] = [0, 0, 0, 0]
+        tick = t
+        while tick < end:
+            tick += timedelta(seconds=5)
+            for _ in range(rnd.randrange(0, 6)):
+                a, b = rnd.sample(players, 2)
+                kind = "player_kill" if a[2] != b[2] else ("player_teamkill" if rnd.random() < 0.5 else "player_kill")
+                if kind == "player_kill" and a[2] == b[2]:
+                    continue
+                kd[a[0]][0] += 1
+                kd[b[0]][1] += 1
+                scores[a[0]][0] += 3
+                logs.append(LogLine(event_time=tick, type=kind, player_name=a[1], player_steamid=a[0], player_team=a[2],
+                                    player_role=a[3], player2_name=b[1], player2_steamid=b[0], player2_team=b[2],
+                                    player2_role=b[3], weapon=rnd.choice(WEAPONS)))
+            if rnd.random() < 0.02:
+                a = rnd.choice(players)
+                logs.append(LogLine(event_time=tick, type="player_suicide", player_name=a[1], player_steamid=a[0], player_team=a[2], player_role=a[3]))
+            if rnd.random() < 0.05:
+                a = rnd.choice(players)
+                logs.append(LogLine(event_time=tick, type="player_change_role", player_name=a[1], player_steamid=a[0], player_team=a[2],
+                                    player_role=a[3], old=a[3], new=rnd.choice(ROLES)))
+            if rnd.random() < 0.03:
+                a = rnd.choice(players)
+                logs.append(LogLine(event_time=tick, type="player_message", player_name=a[1], player_steamid=a[0], player_team=a[2],
+                                    team_name=a[2], squad_name=a[4], message="gg wp " * rnd.randrange(1, 5)))
+            if tick.second == 0 and tick.minute % 2 == 0:
+                for p in players:
+                    s = scores[p[0]]
+                    s[1] += rnd.randrange(0, 20)
+                    s[2] += rnd.randrange(0, 20)
+                    s[3] += rnd.randrange(0, 30)
+                    logs.append(LogLine(event_time=tick, type="player_score_update", player_name=p[1], player_steamid=p[0],
+                                        player_team=p[2], player_role=p[3], player_combat_score=s[0], player_offense_score=s[1],
+                                        player_defense_score=s[2], player_support_score=s[3], new=kd[p[0]][0], message=kd[p[0]][1]))
+        logs.append(LogLine(event_time=end, type="server_match_ended", new=map_name.split("_")[0].upper() + " Warfare",
+                            message="%s - %s" % (rnd.randrange(6), rnd.randrange(6))))
+        t = end + timedelta(seconds=90)
+    return logs
+
+def churn(logs: List[LogLine], players: List[Player], seed: int = 1) -> List[LogLine]:
+    """Returns the logs with players leaving, rejoining and switching
+    teams mixed in"""
+    rnd = random.Random(seed)
+    out, offline = [], set()
+    for log in logs:
+        out.append(log)
+        t = log.event_time
+        r = rnd.random()
+        if r < 0.004:
+            p = rnd.choice(players)
+            if p[0] not in offline:
+                offline.add(p[0])
+                out.append(LogLine(event_time=t, type="player_leave_server", player_name=p[1], player_steamid=p[0]))
+        elif r < 0.008 and offline:
+            sid = rnd.choice(sorted(offline))
+            offline.discard(sid)
+            p = next(p for p in players if p[0] == sid)
+            out.append(LogLine(event_time=t, type="player_join_server", player_name=p[1], player_steamid=p[0]))
+        elif r < 0.010:
+            p = rnd.choice(players)
+            new = "Axis" if p[2] == "Allies" else "Allies"
+            out.append(LogLine(event_time=t, type="player_switch_team", player_name=p[1], player_steamid=p[0],
+                old=rnd.choice([None, p[2]]), new=rnd.choice([None, new])))
+    return out
+
+def make_session(num_matches: int = 3, seed: int = 0) -> List[LogLine]:
+    """Returns the logs of a session with players coming and going"""
+    players = make_players(seed=seed)
+    return churn(make_logs(num_matches=num_matches, players=players, seed=seed), players, seed=seed + 1)
+
+def make_large_session(num_logs: int) -> List[LogLine]:
+    """Returns a session of about 90 minute matches with exactly this many logs"""
+    players = make_players()
+    logs = []
+    while len(logs) < num_logs:
+        start = logs[-1].event_time + timedelta(minutes=2) if logs else None
+        logs += churn(make_logs(num_matches=5, players=players, seed=len(logs), start=start), players, seed=len(logs))
+    return logs[:num_logs]
+
+def add_edge_cases(logs: List[LogRecord], players: List[Player], seed: int = 0) -> List[LogRecord]:
+    """Returns the logs with odd ones mixed in, like players leaving or
+    joining twice, scores and kills without teams, logs without players,
+    self kills and event times with microseconds. These are records,
+    since some of them would not pass validation."""
+    rnd = random.Random(seed)
+    out = []
+    for log in logs:
+        out.append(log)
+        t = log.event_time + timedelta(microseconds=rnd.randrange(10**6))
+        r = rnd.random()
+        p = rnd.choice(players)
+        if r < 0.002:
+            out.append(LogRecord(event_time=t, type="player_leave_server", player_name=p[1], player_steamid=p[0]))
+        elif r < 0.004:
+            out.append(LogRecord(event_time=t, type="player_join_server", player_name=p[1], player_steamid=p[0]))
+        elif r < 0.006:
+            out.append(LogRecord(event_time=t, type="player_score_update", player_name=p[1], player_steamid=p[0],
+                player_combat_score=rnd.randrange(300), player_offense_score=rnd.randrange(300),
+                player_defense_score=rnd.randrange(300), player_support_score=rnd.randrange(300),
+                player_team=rnd.choice([None, "Allies", "Axis"])))
+        elif r < 0.007:
+            out.append(LogRecord(event_time=t, type="player_message", message="hi"))
+        elif r < 0.008:
+            q = rnd.choice(players)
+            out.append(LogRecord(event_time=t, type=rnd.choice(["player_kill", "player_teamkill"]), player_name=p[1], player_steamid=p[0],
+                player_team=rnd.choice([None, "Allies", "Axis"]), player2_name=q[1], player2_steamid=q[0],
+                player2_team=rnd.choice([None, "Allies", "Axis"]), weapon=rnd.choice(["M1 GARAND", "KARABINER 98K", "UNKNOWNGUN", None]),
+                **rnd.choice([{}, dict(player_combat_score=5, player_offense_score=1, player_defense_score=2, player_support_score=3)])))
+        elif r < 0.009:
+            out.append(LogRecord(event_time=t, type="player_suicide", player_name=p[1], player_steamid=p[0], player_team=rnd.choice([None, "Allies"])))
+        elif r < 0.0095:
+            out.append(LogRecord(event_time=t, type="player_kill", player_name=p[1], player_steamid=p[0], player_team="Axis",
+                player2_name=p[1], player2_steamid=p[0], player2_team="Axis", weapon="M1 GARAND"))
+    out.sort(key=lambda log: log.event_time)
+    return out
@@ -0,0 +1,60 @@
+from datetime import timedelta
+import unittest
+
+from lib import storage
+from lib.storage import LogStorageFormat, create_logs_table, insert_many_logs, iter_logs, delete_logs, migrate_logs
+from tests.synthetic import make_session
+
+def _key(log):
+    return (log.event_time, log.type, log.player_steamid, log.player2_steamid, log.message, log.new)
+
+class TestArchivedLogs(unittest.TestCase):
+    sess_id = 1_000_001
+
+    def setUp(self):
+        self.logs = make_session(num_matches=1)
+        self.addCleanup(delete_logs, self.sess_id, LogStorageFormat.archived)
+        self.addCleanup(delete_logs, self.sess_id, LogStorageFormat.plain)
+
+    def _num_blocks(self):
+        storage.cursor.execute(f'SELECT COUNT(*) FROM "{storage.ARCHIVE_TABLE_NAME}" WHERE "session_id" = ?', (self.sess_id,))
+        return storage.cursor.fetchone()[0]
+
+    def test_migrate_from_plain(self):
+        create_logs_table(self.sess_id, LogStorageFormat.plain)
+        insert_many_logs(self.sess_id, self.logs, log_format=LogStorageFormat.plain)
+        expected = [_key(log) for log in iter_logs(self.sess_id, LogStorageFormat.plain)]
+
+        self.assertEqual(migrate_logs(self.sess_id, LogStorageFormat.plain, LogStorageFormat.archived), len(self.logs))
+        self.assertEqual([_key(log) for log in iter_logs(self.sess_id, LogStorageFormat.archived)], expected)
+
+    def test_fields(self):
+        insert_many_logs(self.sess_id, self.logs, log_format=LogStorageFormat.archived)
+        for log, original in zip(iter_logs(self.sess_id, LogStorageFormat.archived, fields=('type', 'player_name')), self.logs):
+            self.assertEqual((log.event_time, log.type, log.player_name), (original.event_time, original.type, original.player_name))
+            self.assertIsNone(log.weapon)
+            self.assertIsNone(log.message)
+
+    def test_append_overlapping(self):
+        # Logs gathered after resuming can be older than the newest logs
+        # already archived
+        half = len(self.logs) // 2
+        insert_many_logs(self.sess_id, self.logs[:half], log_format=LogStorageFormat.archived)
+        late = self.logs[half:]
+        overlapping = [log.copy(update=dict(event_time=log.event_time - timedelta(minutes=30))) for log in late[:500]]
+        insert_many_logs(self.sess_id, late, log_format=LogStorageFormat.archived)
+        insert_many_logs(self.sess_id, overlapping, log_format=LogStorageFormat.archived)
+
+        logs = list(iter_logs(self.sess_id, LogStorageFormat.archived))
+        self.assertEqual(len(logs), len(self.logs) + len(overlapping))
+        self.assertEqual([log.event_time for log in logs], sorted(log.event_time for log in logs))
+
+    def test_append_fills_last_block(self):
+        for i in range(0, 1000, 100):
+            insert_many_logs(self.sess_id, self.logs[i:i + 100], log_format=LogStorageFormat.archived)
+        self.assertEqual(self._num_blocks(), 1)
+        self.assertEqual([_key(log) for log in iter_logs(self.sess_id, LogStorageFormat.archived)],
+                         [_key(log) for log in self.logs[:1000]])
+
+if __name__ == '__main__':
+    unittest.main()
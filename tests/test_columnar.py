@@ -0,0 +1,72 @@
+import json
+import logging
+import unittest
+
+from lib import columnar
+from lib.scores import MatchGroup
+from tests.synthetic import make_logs, make_players, churn, add_edge_cases
+
+def _player_state(player):
+    """Everything a player is made of, including what only shows once
+    more logs are fed to it"""
+    data = player.to_summary()
+    data.update(
+        _faction=str(player._faction), _sess_start=str(player._sess_start), _seconds_played=repr(player._seconds_played),
+        _last_seen_playtime=player._last_seen_playtime, names=list(player.names.items()), seconds_played=player.seconds_played,
+        weapons=list(player.weapons.items()), causes=list(player.causes.items()), faction=repr(player.faction),
+        score=player.score.dict(),
+    )
+    return json.loads(json.dumps(data, default=str))
+
+@unittest.skipIf(columnar.np is None, "numpy is not installed")
+class TestColumnarEngine(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.WARNING)
+        players = make_players(seed=3)
+        logs = make_logs(num_matches=3, players=players, seed=3)
+        cls.sessions = {
+            'plain': logs,
+            'churn': churn(logs, players, seed=5),
+            'edge cases': add_edge_cases(churn(logs, players, seed=6), players, seed=7),
+            'empty': [],
+            'one log': logs[:1],
+            'few logs': logs[:40],
+        }
+        for seed in range(8, 12):
+            cls.sessions[f'edge cases {seed}'] = add_edge_cases(
+                churn(make_logs(num_matches=2, players=players, seed=seed), players, seed=seed), players, seed=seed)
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.disable(logging.NOTSET)
+
+    def _build_both(self, logs):
+        builder = columnar.ColumnarGroupBuilder()
+        for log in logs:
+            builder.feed(log)
+        return MatchGroup.from_logs(logs), builder.build()
+
+    def test_players_match_objects(self):
+        self.maxDiff = None
+        for name, logs in self.sessions.items():
+            objects, columns = self._build_both(logs)
+            self.assertEqual(len(objects.matches), len(columns.matches), name)
+            for i, (expected, match) in enumerate(zip(objects.matches, columns.matches)):
+                self.assertEqual((match.map, match.duration, match.team1_score, match.team2_score),
+                                 (expected.map, expected.duration, expected.team1_score, expected.team2_score))
+                self.assertEqual([p.steam_id for p in match.players], [p.steam_id for p in expected.players])
+                for expected_player, player in zip(expected.players, match.players):
+                    # Comparing dicts lists every field that differs
+                    self.assertEqual(_player_state(player), _player_state(expected_player),
+                                     f"{name}, match {i}, player {player.steam_id}")
+
+    def test_exports_match_objects(self):
+        for name, logs in self.sessions.items():
+            with self.subTest(session=name):
+                objects, columns = self._build_both(logs)
+                self.assertEqual(repr(columns.to_dict()), repr(objects.to_dict()))
+                self.assertEqual([m.to_csv() for m in columns], [m.to_csv() for m in objects])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import hashlib
+import unittest
+
+from lib.scores import MatchData, MatchGroup
+from tests.synthetic import make_session
+
+# Digests of the output of the implementation that built matches from a
+# list of logs, before they were built while streaming them
+GROUP_DIGESTS = {
+    0: 'b375f924f454f516d1df479843306fd131ac537997ee49f7afe38218bd09bfde',
+    1: 'a46b94f58431a93ad7d4830df9490794c0afd81c19686fc2a089b681710c0a7a',
+    3: 'ca0e9157988fb8e1f5d0a8e3b7ce5da95c8808854e0523dd364ed9d027f072b1',
+}
+SINGLE_DIGESTS = {
+    1: '10dcb61373c67a4d7cb7e03ae4f7f0766e7324202c7443023f8feedffb595e90',
+    3: '28818c2afc9fe3ac0e61e55fb7a1503dc34751dc7b007d6b2a99bf7a0ea9dfd7',
+}
+
+def _digest(parts):
+    return hashlib.sha256("\x00".join(parts).encode()).hexdigest()
+
+def _match_output(match):
+    return [match.to_text(), match.to_csv(), repr(match.to_dict())]
+
+def _group_output(group):
+    out = [group.stats.to_text(), group.stats.to_csv(), repr(group.to_dict())]
+    for match in group:
+        out += _match_output(match)
+        out.append(repr(sorted((p.steam_id, p.allied_seconds_played, p.axis_seconds_played, p.seconds_played)
+                               for p in match.players)))
+    return out
+
+class TestMatchBuilding(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.sessions = {n: make_session(num_matches=n) if n else [] for n in GROUP_DIGESTS}
+
+    def test_group_matches_previous_output(self):
+        for n, expected in GROUP_DIGESTS.items():
+            with self.subTest(matches=n):
+                group = MatchGroup.from_logs(iter(self.sessions[n]))
+                self.assertEqual(_digest(_group_output(group)), expected)
+
+    def test_group_from_list_or_iterator(self):
+        logs = self.sessions[3]
+        self.assertEqual(_group_output(MatchGroup.from_logs(logs)), _group_output(MatchGroup.from_logs(iter(logs))))
+
+    def test_single_matches_previous_output(self):
+        for n, expected in SINGLE_DIGESTS.items():
+            logs = self.sessions[n]
+            for name, order in (('forward', list(logs)), ('reversed', list(reversed(logs)))):
+                with self.subTest(matches=n, order=name):
+                    self.assertEqual(_digest(_match_output(MatchData.from_logs(order))), expected)
+
+    def test_input_unchanged(self):
+        logs = self.sessions[3]
+        before = list(logs)
+        reversed_logs = list(reversed(logs))
+        reversed_before = list(reversed_logs)
+        MatchGroup.from_logs(logs)
+        MatchData.from_logs(logs)
+        MatchData.from_logs(reversed_logs)
+        self.assertEqual(len(logs), len(before))
+        self.assertTrue(all(a is b for a, b in zip(logs, before)))
+        self.assertTrue(all(a is b for a, b in zip(reversed_logs, reversed_before)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta, timezone
+import unittest
+from unittest import mock
+
+from lib import session as session_module
+from lib import storage
+from lib.session import HLLCaptureSession, SESSIONS, get_active_session
+from lib.storage import LogStorageFormat, count_logs, delete_logs
+from tests.synthetic import make_session
+
+class TestActivation(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        patcher = mock.patch.object(session_module, 'schedule_coro', return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.credentials = mock.Mock(id=900001, guild_id=900002)
+        self.credentials.autosession.logger = mock.Mock()
+        self.sessions = list()
+
+    def _create(self, sess_id: int, end_time):
+        sess = HLLCaptureSession(sess_id, self.credentials.guild_id, f"Session {sess_id}",
+            datetime.now(tz=timezone.utc) - timedelta(minutes=1), end_time, self.credentials)
+        # Capturing is not what is being tested
+        sess.gatherer = mock.Mock()
+        sess.stop = mock.AsyncMock()
+        self.sessions.append(sess)
+        return sess
+
+    async def asyncTearDown(self):
+        for sess in self.sessions:
+            sess._unindex()
+            SESSIONS.pop(sess.id, None)
+            sess.journal.delete()
+
+    async def test_manual_session_stops_autosession(self):
+        autosession = self._create(900011, None)
+        await autosession.activate()
+        self.assertIs(get_active_session(self.credentials.id), autosession)
+
+        manual = self._create(900012, datetime.now(tz=timezone.utc) + timedelta(hours=1))
+        await manual.activate()
+        autosession.stop.assert_awaited_once()
+        manual.stop.assert_not_awaited()
+        manual.gatherer.start.assert_called_once()
+
+    async def test_autosession_does_not_stop_itself(self):
+        autosession = self._create(900021, None)
+        await autosession.activate()
+        autosession.stop.assert_not_awaited()
+        autosession.gatherer.start.assert_called_once()
+
+class TestJournal(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        end_time = datetime.now(tz=timezone.utc) - timedelta(hours=1)
+        storage.cursor.execute('INSERT INTO sessions (guild_id, name, start_time, end_time, credentials_id, modifiers, log_format) VALUES (?,?,?,?,?,?,?)',
+            (900002, "Journal", end_time - timedelta(hours=1), end_time, None, 0, LogStorageFormat.plain.value))
+        self.sess_id = storage.cursor.lastrowid
+        storage.create_logs_table(self.sess_id, LogStorageFormat.plain)
+        storage.database.commit()
+        self.addCleanup(delete_logs, self.sess_id, LogStorageFormat.plain)
+
+        self.logs = make_session(num_matches=1)[:100]
+        self.sess = None
+
+    def _load(self):
+        """Load the session again, as if the bot was restarted"""
+        if self.sess:
+            self.sess.journal.close()
+            SESSIONS.pop(self.sess.id, None)
+        self.sess = HLLCaptureSession.load_from_db(self.sess_id)
+        return self.sess
+
+    async def asyncTearDown(self):
+        self.sess.journal.delete()
+        SESSIONS.pop(self.sess.id, None)
+
+    async def test_recover_unpushed_logs(self):
+        sess = self._load()
+        sess._logs = list(self.logs)
+        sess.write_to_journal()
+
+        sess = self._load()
+        self.assertEqual(sess.recover_from_journal(), len(self.logs))
+        self.assertEqual(count_logs(self.sess_id), len(self.logs))
+
+    async def test_pushed_logs_are_not_recovered_again(self):
+        sess = self._load()
+        sess._logs = list(self.logs[:60])
+        sess.write_to_journal()
+        # Crash after the logs were committed but before the journal is reset
+        with mock.patch.object(sess.journal, 'reset'):
+            sess.push_to_db()
+        sess._logs = list(self.logs[60:])
+        sess.write_to_journal()
+
+        sess = self._load()
+        self.assertEqual(sess.recover_from_journal(), len(self.logs) - 60)
+        self.assertEqual(count_logs(self.sess_id), len(self.logs))
+
+        # Logs journaled after recovering must not be skipped
+        sess._logs = list(self.logs[:10])
+        sess.write_to_journal()
+        sess = self._load()
+        self.assertEqual(sess.recover_from_journal(), 10)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 from datetime import datetime, timedelta, timezone
 import asyncio
+import heapq
 from pathlib import Path
 import re
 
@@ -90,7 +91,157 @@ def get_config() -> ConfigParser:
     
 
 _SCHEDULER_TIME_BETWEEN_INTERVAL = timedelta(minutes=3)
-def schedule_coro(dt: datetime, coro_func, *args, error_logger = None): # How do you annotate coroutines???
+
+class ScheduledCoro:
+    """A coroutine function scheduled for execution at a specific time.
+    Returned by `schedule_coro`."""
+    __slots__ = ('when', 'coro_func', 'args', 'error_logger', 'name', '_cancelled', '_task')
+
+    def __init__(self, when: datetime, coro_func, args: tuple = (), error_logger = None, name: str = None):
+        self.when = when
+        self.coro_func = coro_func
+        self.args = args
+        self.error_logger = error_logger
+        if name is None:
+            owner = getattr(coro_func, '__self__', None)
+            name = getattr(coro_func, '__qualname__', repr(coro_func))
+            if owner is not None:
+                name = f"{owner} {name}"
+        self.name = name
+        self._cancelled = False
+        self._task = None
+
+    def __repr__(self):
+        return f"<ScheduledCoro {self.name} at {self.when.isoformat()}>"
+
+    def done(self):
+        """Whether the coroutine has finished running or was cancelled"""
+        return self._cancelled or (self._task is not None and self._task.done())
+
+    def cancelled(self):
+        return self._cancelled or (self._task is not None and self._task.cancelled())
+
+    def cancel(self):
+        """Cancel the coroutine, also when it is already running.
+
+        Returns
+        -------
+        bool
+            Whether it was cancelled, False if it was already done.
+        """
+        if self._task is not None:
+            return self._task.cancel()
+        if self._cancelled:
+            return False
+        self._cancelled = True
+        SCHEDULER._on_cancel()
+        return True
+
+    async def _run(self):
+        try:
+            res = await self.coro_func(*self.args)
+        except:
+            if self.error_logger:
+                self.error_logger.exception('Scheduled coroutine raised an exception')
+            else:
+                raise
+        else:
+            return res
+
+class Scheduler:
+    """Runs scheduled coroutines from a single task, sleeping until the
+    next one is due.
+
+    Coroutines are kept in a heap ordered by their due time. Cancelled
+    ones are left in the heap and skipped, until they make up over half
+    of it. Since due times are wall-clock times, the scheduler never
+    sleeps longer than `_SCHEDULER_TIME_BETWEEN_INTERVAL` at once so that
+    time drift is accounted for.
+    """
+    def __init__(self):
+        self._heap = list()
+        self._counter = 0
+        self._num_cancelled = 0
+        self._loop = None
+        self._task = None
+        self._wakeup = None
+
+    def __len__(self):
+        return len(self._heap) - self._num_cancelled
+
+    def schedule(self, job: ScheduledCoro):
+        self._ensure_running()
+        self._counter += 1
+        entry = (job.when.timestamp(), self._counter, job)
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            self._wakeup.set()
+        return job
+
+    def upcoming(self, limit: int = None):
+        """Returns the scheduled coroutines that have not started yet, ordered
+        by when they are due.
+
+        Parameters
+        ----------
+        limit : int, optional
+            The maximum number of coroutines to return, by default None
+
+        Returns
+        -------
+        List[ScheduledCoro]
+            The scheduled coroutines
+        """
+        entries = (entry for entry in self._heap if not entry[2]._cancelled)
+        if limit is None:
+            entries = sorted(entries)
+        else:
+            entries = heapq.nsmallest(limit, entries)
+        return [entry[2] for entry in entries]
+
+    def _on_cancel(self):
+        self._num_cancelled += 1
+        if self._num_cancelled > len(self._heap) // 2:
+            self._heap = [entry for entry in self._heap if not entry[2]._cancelled]
+            heapq.heapify(self._heap)
+            self._num_cancelled = 0
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task.done():
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        max_sleep = _SCHEDULER_TIME_BETWEEN_INTERVAL.total_seconds()
+        while True:
+            self._wakeup.clear()
+
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            when, _, job = self._heap[0]
+            if job._cancelled:
+                heapq.heappop(self._heap)
+                self._num_cancelled -= 1
+                continue
+
+            time_left = when - datetime.now(tz=timezone.utc).timestamp()
+            if time_left > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=min(time_left, max_sleep))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            job._task = self._loop.create_task(job._run())
+
+SCHEDULER = Scheduler()
+
+def schedule_coro(dt: datetime, coro_func, *args, error_logger = None, name: str = None): # How do you annotate coroutines???
     """Schedule a coroutine for execution at a specific time.
 
     Time drift will be accounted for.
@@ -101,30 +252,17 @@ def schedule_coro(dt: datetime, coro_func, *args, error_logger = None): # How do
         The date and time
     coro : Coroutine
         The coroutine to schedule
+    error_logger : Logger, optional
+        A logger to log exceptions with, instead of raising them
+    name : str, optional
+        A name describing the coroutine, by default derived from it
+
+    Returns
+    -------
+    ScheduledCoro
+        A handle that can be used to cancel the coroutine
     """
-    async def scheduled_coro():
-        time_to_sleep = _SCHEDULER_TIME_BETWEEN_INTERVAL.total_seconds()
-
-        time_left = dt - datetime.now(tz=timezone.utc)
-        if not (time_left < timedelta(0)):
-
-            while time_left > _SCHEDULER_TIME_BETWEEN_INTERVAL:
-                await asyncio.sleep(time_to_sleep)
-                time_left = dt - datetime.now(tz=timezone.utc)
-
-            await asyncio.sleep(time_left.total_seconds())
-
-        try:
-            res = await coro_func(*args)
-        except:
-            if error_logger:
-                error_logger.exception('Scheduled coroutine raised an exception')
-            else:
-                raise
-        
-        return res
-
-    return asyncio.create_task(scheduled_coro())
+    return SCHEDULER.schedule(ScheduledCoro(dt, coro_func, args, error_logger=error_logger, name=name))
 
 
 LOGS_FOLDER = Path('logs')